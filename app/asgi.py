@@ -0,0 +1,733 @@
+#!/usr/bin/python3
+"""
+    ASGI entry point of the app, serving the read-only routes asynchronously.
+
+    The home page, the pages of the categories & of the menu items & the
+    JSON of the catalogue, of a category & of a menu item are served to
+    anonymous visitors (GET & HEAD requests without a session cookie) by
+    coroutines. These read through the asynchronous driver of the database
+    (aiosqlite, asyncpg or aiomysql @see `DB_ASYNC_URL`) & render the
+    templates in Jinja's async mode, so a request waiting for the database
+    holds a coroutine rather than a thread & a single process keeps
+    thousands of connections busy.
+
+    Any other request is handed to the WSGI app, in a pool of threads. Both
+    share the same app: models, templates, url map, caches & request hooks
+    (metrics, rate limits, compression), & answer the same responses. The
+    asynchronous views always read from the primary database.
+
+    e.g. `uvicorn --app-dir app asgi:application`
+
+    Usage:
+        python3 app/asgi.py serve
+            Serves the app on `APP_HOST`:`APP_PORT` with uvicorn.
+        python3 app/asgi.py benchmark [--connections N] [--requests N]
+            Runs the threaded WSGI server of app/serve.py & this one in turn,
+            with a single worker, no rate limits & no load shedding, while
+            `--connections` concurrent clients send `--requests` requests to
+            the read-only routes, & reports the throughput & the latency of
+            both.
+"""
+
+
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import config
+from flask import (
+    Response, abort, g, make_response, request, session as login_session
+)
+from flask.signals import before_render_template, template_rendered
+from functools import wraps
+import inspect
+import io
+import metrics
+from metrics import query_budget
+import os
+import project
+from ratelimit import rate_limit
+import ratelimit
+import serializers
+import signal
+from sqlalchemy.ext.asyncio import AsyncSession, async_scoped_session
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import NoResultFound
+import socket
+import subprocess
+import sys
+import time
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import is_resource_modified, parse_cookie
+
+
+app = project.create_app(warmUp=config.APP_WARM_UP)
+asyncEngine = config.createAsyncEngine()
+metrics.instrumentEngine(asyncEngine.sync_engine)
+# Every request served asynchronously (i.e. every task) gets its own session,
+# which is removed once its response has been sent @see serveAsync
+session = async_scoped_session(
+    sessionmaker(bind=asyncEngine, class_=AsyncSession),
+    scopefunc=asyncio.current_task
+)
+# Compiles the same templates for `render_async`, in a cache of its own
+jinjaEnvironment = app.jinja_env.overlay(enable_async=True, cache_size=400)
+# Serves the requests handed to the WSGI app
+threads = ThreadPoolExecutor(
+    max_workers=config.DB_POOL_SIZE + config.DB_MAX_OVERFLOW
+)
+admission = ratelimit.AdmissionControl(config.ASGI_MAX_CONCURRENCY)
+readOnlyMethods = ['GET', 'HEAD']
+
+
+def cached_page(getKey):
+    """Same as `project.cached_page`, for the asynchronous views."""
+    def decorator(f):
+        @wraps(f)
+        async def decorated(*args, **kwargs):
+            if (
+                'username' in login_session or
+                '_flashes' in login_session or
+                project.readsOwnWrites()
+            ):
+                return await f(*args, **kwargs)
+
+            key = getKey(*args, **kwargs)
+            if key is None:
+                return await f(*args, **kwargs)
+
+            page = project.pageCache.get(key)
+            if page is not None:
+                body, mimetype = page
+                return Response(body, mimetype=mimetype)
+
+            response = make_response(await f(*args, **kwargs))
+            if response.status_code == 200:
+                project.pageCache.set(
+                    key, (response.get_data(), response.mimetype)
+                )
+
+            return response
+
+        return decorated
+
+    return decorator
+
+
+def conditional(getValidators):
+    """
+        Same as `project.conditional`, for the asynchronous views.
+        `getValidators` is run on the session (@see runSync).
+    """
+    def decorator(f):
+        @wraps(f)
+        async def decorated(*args, **kwargs):
+            validators = await runSync(getValidators, *args, **kwargs)
+            if validators is None:
+                return await f(*args, **kwargs)
+
+            etag, lastModified = validators
+            if is_resource_modified(
+                request.environ, etag=etag, last_modified=lastModified
+            ):
+                response = make_response(await f(*args, **kwargs))
+            else:
+                response = Response(status=304)
+
+            if response.status_code in [200, 304]:
+                response.set_etag(etag)
+                if lastModified is not None:
+                    response.last_modified = lastModified
+
+            return response
+
+        return decorated
+
+    return decorator
+
+
+async def runSync(f, *args, **kwargs):
+    """
+        Returns `f(dbSession, *args, **kwargs)`, `dbSession` being the
+        synchronous facade of the request's session: the helpers of
+        app/project.py run as they are, their queries awaiting the driver.
+    """
+    return await session().run_sync(f, *args, **kwargs)
+
+
+async def render_template(name, **context):
+    """Same as `flask.render_template`, rendering in Jinja's async mode."""
+    if 'categories' not in g:
+        g.categoriesVersion, g.categories = await runSync(
+            project.getCategoryList
+        )
+
+    template = jinjaEnvironment.get_template(name)
+    app.update_template_context(context)
+    before_render_template.send(
+        app, _async_wrapper=app.ensure_sync, template=template, context=context
+    )
+    output = await template.render_async(context)
+    template_rendered.send(
+        app, _async_wrapper=app.ensure_sync, template=template, context=context
+    )
+
+    return output
+
+
+@query_budget(2)
+@cached_page(lambda: 'home')
+async def home():
+    menuItems = await runSync(
+        project.getLatestMenuItems, project.readsOwnWrites()
+    )
+
+    return await render_template('home.html', menuItems=menuItems)
+
+
+@query_budget(4)
+@cached_page(project.getCategoryPageKey)
+async def showMenuItemsInACategory(categorySlug):
+    try:
+        after = int(request.args.get('after', 0))
+    except ValueError:
+        abort(400)
+
+    return await render_template(
+        'category.html',
+        **await runSync(project.getCategoryPage, categorySlug, after)
+    )
+
+
+@query_budget(3)
+@cached_page(project.getMenuItemPageKey)
+async def showMenuItem(categorySlug, menuSlug):
+    try:
+        menuItem = await runSync(project.getMenuItem, categorySlug, menuSlug)
+    except NoResultFound:
+        abort(404)
+
+    return await render_template(
+        'menuItem.html',
+        menuItem=menuItem,
+        categorySlug=categorySlug
+    )
+
+
+@rate_limit(lambda: project.getCatalogueCost())
+@query_budget(4)
+@conditional(project.getCatalogueValidators)
+async def getAllItemsInCatalogue():
+    if 'after' in request.args or 'limit' in request.args:
+        return await runSync(project.getCataloguePage)
+
+    if not await runSync(project.hasCategories):
+        return project.noCategoriesFound()
+
+    return Response(
+        streamCatalogue(
+            config.JSON_STREAM_CHUNK_SIZE,
+            compact=project.isCompactRequested()
+        ),
+        mimetype='application/json'
+    )
+
+
+@rate_limit(2)
+@query_budget(3)
+@conditional(project.getCategoryValidators)
+async def getCategoryJSON(categorySlug):
+    return await runSync(project.getCategoryDocument, categorySlug)
+
+
+@rate_limit(1)
+@query_budget(4)
+@conditional(project.getMenuItemValidators)
+async def showMenuItemJSON(categorySlug, menuSlug):
+    return await runSync(project.getMenuItemDocument, categorySlug, menuSlug)
+
+
+# endpoint => asynchronous view
+views = {
+    view.__name__: view for view in [
+        home,
+        showMenuItemsInACategory,
+        showMenuItem,
+        getAllItemsInCatalogue,
+        getCategoryJSON,
+        showMenuItemJSON
+    ]
+}
+
+
+async def streamCatalogue(chunkSize, compact=False):
+    """
+        Same as `project.streamCatalogue`, reading through a server-side
+        cursor of a connection of its own to `asyncEngine`.
+    """
+    async with asyncEngine.connect() as connection:
+        rows = await connection.stream(serializers.selectCatalogueRows())
+        encoder = serializers.CategoryEncoder(compact=compact)
+
+        yield serializers.openCatalogue()
+        async for chunk in rows.partitions(chunkSize):
+            yield encoder.encode(chunk)
+        yield encoder.finish() + serializers.closeCatalogue(compact)
+
+
+async def application(scope, receive, send):
+    """The ASGI app."""
+    if scope['type'] == 'lifespan':
+        return await serveLifespan(receive, send)
+    if scope['type'] != 'http':
+        raise RuntimeError(
+            'Unsupported ASGI scope "{}" provided.'.format(scope['type'])
+        )
+
+    environ = makeEnviron(scope)
+    view = getAsyncView(environ)
+    if view is None:
+        await serveThreaded(environ, receive, send)
+    else:
+        await serveAsync(view, environ, send)
+
+
+def getAsyncView(environ):
+    """Returns the asynchronous view of the request, if it may use one."""
+    if environ['REQUEST_METHOD'] not in readOnlyMethods:
+        return None
+
+    cookies = parse_cookie(environ)
+    if app.session_interface.get_cookie_name(app) in cookies:
+        return None
+
+    try:
+        endpoint, arguments = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+
+    return views.get(endpoint)
+
+
+async def serveAsync(view, environ, send):
+    """
+        Serves the request with `view` the way `Flask.wsgi_app` would, the
+        request context lasting until the response has been sent.
+    """
+    environ[ratelimit.asyncRequestKey] = True
+    context = app.request_context(environ)
+    context.push()
+    admitted = False
+    error = None
+    try:
+        try:
+            if config.ASGI_MAX_CONCURRENCY <= 0 or admission.admit():
+                admitted = config.ASGI_MAX_CONCURRENCY > 0
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = view(**request.view_args)
+                    if inspect.isawaitable(rv):
+                        rv = await rv
+            else:
+                rv = ratelimit.makeRejection(
+                    503, 'The server is busy, please try again.', retryAfter=1
+                )
+        except Exception as e:
+            rv = app.handle_user_exception(e)
+        response = app.finalize_request(rv)
+    except Exception as e:
+        error = e
+        response = app.handle_exception(e)
+
+    try:
+        await sendResponse(response, environ, send)
+    finally:
+        await session.remove()
+        if admitted:
+            admission.release()
+        context.pop(error)
+
+
+async def sendResponse(response, environ, send):
+    body = response.response
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': encodeHeaders(
+                response.get_wsgi_headers(environ).to_wsgi_list()
+            )
+        })
+        if (
+            environ['REQUEST_METHOD'] == 'HEAD' or
+            response.status_code in [204, 304]
+        ):
+            pass
+        elif hasattr(body, '__aiter__'):
+            async for chunk in body:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                if chunk:
+                    await sendBody(send, chunk)
+        else:
+            for chunk in response.iter_encoded():
+                await sendBody(send, chunk)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(body, 'aclose'):
+            await body.aclose()
+        response.close()
+
+
+async def sendBody(send, chunk):
+    await send({
+        'type': 'http.response.body', 'body': chunk, 'more_body': True
+    })
+
+
+async def serveThreaded(environ, receive, send):
+    """Serves the request with the WSGI app in `threads`."""
+    environ['wsgi.input'] = io.BytesIO(await readBody(receive))
+    loop = asyncio.get_running_loop()
+    started = []
+    written = []
+
+    def startResponse(status, headers, exc_info=None):
+        started[:] = [int(status.split(' ', 1)[0]), headers]
+        return written.append
+
+    chunks = await loop.run_in_executor(threads, app, environ, startResponse)
+    try:
+        iterator = iter(chunks)
+        status, headers = started
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': encodeHeaders(headers)
+        })
+        for chunk in written:
+            await sendBody(send, chunk)
+        while True:
+            chunk = await loop.run_in_executor(threads, next, iterator, None)
+            if chunk is None:
+                break
+            if chunk:
+                await sendBody(send, chunk)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(chunks, 'close'):
+            await loop.run_in_executor(threads, chunks.close)
+
+
+async def readBody(receive):
+    body = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        body.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+
+    return b''.join(body)
+
+
+def makeEnviron(scope):
+    """Returns the WSGI environ of the request of an ASGI `http` scope."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    rootPath = scope.get('root_path', '')
+    path = scope['path']
+    if rootPath and path.startswith(rootPath):
+        path = path[len(rootPath):]
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': rootPath.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ['CONTENT_TYPE', 'CONTENT_LENGTH']:
+            name = 'HTTP_' + name
+        if name in environ:
+            separator = '; ' if name == 'HTTP_COOKIE' else ','
+            value = environ[name] + separator + value
+        environ[name] = value
+
+    return environ
+
+
+def encodeHeaders(headers):
+    return [
+        (name.lower().encode('latin-1'), value.encode('latin-1'))
+        for name, value in headers
+    ]
+
+
+async def serveLifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if config.APP_WARM_UP:
+                for name in jinjaEnvironment.list_templates():
+                    jinjaEnvironment.get_template(name)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncEngine.dispose()
+            threads.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def fetch(reader, writer, path):
+    """
+        Sends a GET request for `path` on a kept alive connection & reads
+        the response, returning its status & whether the connection is
+        still open.
+    """
+    writer.write((
+        'GET {} HTTP/1.1\r\nHost: localhost\r\n'
+        'Accept-Encoding: gzip\r\n\r\n'
+    ).format(path).encode('latin-1'))
+    await writer.drain()
+
+    statusLine = await reader.readline()
+    if not statusLine:
+        raise ConnectionResetError('The server closed the connection.')
+    status = int(statusLine.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in [b'\r\n', b'\n', b'']:
+            break
+        name, separator, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif status not in [204, 304]:
+        await reader.read()
+        return status, False
+
+    return status, headers.get('connection') != 'close'
+
+
+async def runLoad(host, port, connections, requests, paths):
+    """
+        Sends `requests` requests for `paths` in turn over `connections`
+        concurrent connections, returning the latency of every request, the
+        number of responses per status & the number of failed requests.
+    """
+    latencies = []
+    statuses = Counter()
+    failures = []
+    sent = iter(range(requests))
+
+    async def client():
+        reader = writer = None
+        for i in sent:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                start = time.perf_counter()
+                status, keptAlive = await fetch(
+                    reader, writer, paths[i % len(paths)]
+                )
+                latencies.append(time.perf_counter() - start)
+                statuses[status] += 1
+            except (OSError, ValueError, IndexError,
+                    asyncio.IncompleteReadError):
+                failures.append(i)
+                keptAlive = False
+            if not keptAlive and writer is not None:
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+
+    await asyncio.gather(*[client() for i in range(connections)])
+
+    return latencies, statuses, len(failures)
+
+
+def getBenchmarkPaths():
+    from models import Category, MenuItem
+    from sqlalchemy import select
+
+    with config.engine.connect() as connection:
+        row = connection.execute(
+            select([Category.slug, MenuItem.slug]).join_from(
+                MenuItem, Category, MenuItem.category_id == Category.id
+            ).limit(1)
+        ).first()
+    if row is None:
+        raise RuntimeError('The benchmark needs at least one menu item.')
+
+    categorySlug, menuSlug = row
+    return [
+        '/',
+        '/catalogue/{}/items'.format(categorySlug),
+        '/catalogue/{}/{}'.format(categorySlug, menuSlug),
+        '/catalogue.json?limit=10',
+        '/catalogue.json/{}'.format(categorySlug),
+        '/catalogue.json/{}/{}'.format(categorySlug, menuSlug)
+    ]
+
+
+def getFreePort(host):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind((host, 0))
+        return probe.getsockname()[1]
+
+
+def waitForServer(host, port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+
+    raise RuntimeError('The server did not start on port {}.'.format(port))
+
+
+def benchmark(connections, requests, servers=None):
+    """
+        Returns a row per server: the duration of the run, the latency of
+        every request, the number of responses per status & of failures.
+
+        `servers` are the (name, command) of the servers to run in turn, by
+        default the threaded WSGI server of app/serve.py & this one.
+    """
+    host = '127.0.0.1'
+    appFolder = os.path.dirname(os.path.abspath(__file__))
+    if servers is None:
+        servers = [
+            ('wsgi', [
+                sys.executable,
+                os.path.join(appFolder, 'serve.py'),
+                '--workers', '1'
+            ]),
+            ('asgi', [sys.executable, os.path.abspath(__file__), 'serve'])
+        ]
+    paths = getBenchmarkPaths()
+    rows = []
+    for name, command in servers:
+        port = getFreePort(host)
+        # The request log of the WSGI server is left out. The server gets a
+        # process group of its own, as it may fork (e.g. the reloader of
+        # the development server) & all of it is stopped afterwards.
+        server = subprocess.Popen(
+            command,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+            env=dict(
+                os.environ,
+                APP_HOST=host,
+                APP_PORT=str(port),
+                RATE_LIMIT_ENABLED='false',
+                APP_MAX_CONCURRENCY='0',
+                ASGI_MAX_CONCURRENCY='0'
+            )
+        )
+        try:
+            waitForServer(host, port)
+            # Fills the caches & the connection pool first
+            asyncio.run(runLoad(host, port, 20, 20 * len(paths), paths))
+            start = time.perf_counter()
+            latencies, statuses, failures = asyncio.run(
+                runLoad(host, port, connections, requests, paths)
+            )
+            rows.append((
+                name,
+                time.perf_counter() - start,
+                sorted(latencies),
+                statuses,
+                failures
+            ))
+        finally:
+            os.killpg(server.pid, signal.SIGTERM)
+            server.wait()
+
+    return rows
+
+
+def printBenchmark(rows, connections, requests):
+    print('{} requests over {} concurrent connections'.format(
+        requests, connections
+    ))
+    line = '{:>7} {:>8} {:>8} {:>8} {:>8} {:>8} {:>9}  {}'
+    print(line.format(
+        'server', 'req/s', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'max (ms)',
+        'failures', 'statuses'
+    ))
+    for name, elapsed, latencies, statuses, failures in rows:
+        print(line.format(
+            name,
+            int(len(latencies) / elapsed),
+            '%.1f' % (getPercentile(latencies, 50) * 1000),
+            '%.1f' % (getPercentile(latencies, 90) * 1000),
+            '%.1f' % (getPercentile(latencies, 99) * 1000),
+            '%.1f' % (getPercentile(latencies, 100) * 1000),
+            failures,
+            ', '.join(
+                '{}: {}'.format(s, c) for s, c in sorted(statuses.items())
+            )
+        ))
+
+
+def getPercentile(values, percent):
+    if not values:
+        return float('nan')
+
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Serves the app asynchronously or benchmarks it.'
+    )
+    parser.add_argument('command', choices=['serve', 'benchmark'])
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=10000)
+    arguments = parser.parse_args()
+
+    if arguments.command == 'serve':
+        import uvicorn
+
+        uvicorn.run(
+            application,
+            host=config.APP_HOST,
+            port=config.APP_PORT,
+            log_level='warning'
+        )
+        sys.exit(0)
+
+    printBenchmark(
+        benchmark(arguments.connections, arguments.requests),
+        arguments.connections,
+        arguments.requests
+    )
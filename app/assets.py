@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+"""
+    Static assets pipeline.
+
+    Usage:
+        python3 app/assets.py build
+            Builds every file under `app/static` (& the bundles below) into
+            `app/static/dist`: stylesheets are minified, the name of every
+            file gets a hash of its content & a gzip (& a brotli, when the
+            brotli package is installed) compressed copy is written next to
+            it. `app/static/dist/manifest.json` maps the original names to
+            the built ones.
+
+    Once built, `url_for('static', filename=...)` points at the built file,
+    which is served with far-future, immutable caching headers (its name
+    changes whenever its content does) & precompressed according to the
+    request's `Accept-Encoding`. Without a build, the original files are
+    served as before.
+"""
+
+
+from flask import request, send_from_directory, url_for
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+staticFolder = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'static'
+)
+distName = 'dist'
+manifestName = 'manifest.json'
+# Built files served as a single file, in place of all of their sources
+bundles = {
+    'css/app.css': ['css/simple-sidebar.css', 'css/main.css']
+}
+# Only files at least this large are worth compressing
+minCompressSize = 256
+# Built files never change, their name does
+maxAge = 365 * 24 * 3600
+cacheControl = 'public, max-age={}, immutable'.format(maxAge)
+# Content encoding => extension of the precompressed files, best first
+encodings = [('br', '.br'), ('gzip', '.gz')]
+
+
+def minifyCSS(css):
+    """
+        Drops the comments (but `/*! ... */` licenses) & the whitespace not
+        needed by stylesheets.
+    """
+    css = re.sub(r'/\*(?!!).*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r' ?([{};,>]) ?', r'\1', css)
+    css = css.replace(';}', '}')
+
+    return css.strip() + '\n'
+
+
+def readSource(name):
+    with open(os.path.join(staticFolder, name), 'rb') as source:
+        content = source.read()
+
+    if name.endswith('.css'):
+        content = minifyCSS(content.decode('utf-8')).encode('utf-8')
+
+    return content
+
+
+def getHashedName(name, content):
+    root, extension = os.path.splitext(name)
+
+    return '{}.{}{}'.format(
+        root, hashlib.sha256(content).hexdigest()[:12], extension
+    )
+
+
+def writeBuiltFile(distFolder, name, content):
+    path = os.path.join(distFolder, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as built:
+        built.write(content)
+
+    if len(content) < minCompressSize:
+        return
+    # mtime is fixed so that builds of the same content are identical
+    with open(path + '.gz', 'wb') as compressed:
+        compressed.write(gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as compressed:
+            compressed.write(brotli.compress(content))
+
+
+def getSourceNames():
+    names = []
+    for directory, subdirectories, files in os.walk(staticFolder):
+        relative = os.path.relpath(directory, staticFolder)
+        if relative.split(os.sep)[0] == distName:
+            continue
+        for fileName in files:
+            names.append(
+                os.path.normpath(os.path.join(relative, fileName)).replace(
+                    os.sep, '/'
+                )
+            )
+
+    return sorted(names)
+
+
+def build():
+    """Builds all the assets, returning the manifest."""
+    distFolder = os.path.join(staticFolder, distName)
+    shutil.rmtree(distFolder, ignore_errors=True)
+
+    manifest = {}
+    contents = {name: readSource(name) for name in getSourceNames()}
+    for name, sources in bundles.items():
+        contents[name] = b''.join(contents[source] for source in sources)
+
+    for name, content in sorted(contents.items()):
+        hashedName = getHashedName(name, content)
+        writeBuiltFile(distFolder, hashedName, content)
+        manifest[name] = distName + '/' + hashedName
+
+    with open(os.path.join(distFolder, manifestName), 'w') as output:
+        json.dump(manifest, output, indent=4, sort_keys=True)
+
+    return manifest
+
+
+def loadManifest():
+    """Returns the manifest of the latest build, empty without a build."""
+    try:
+        with open(os.path.join(staticFolder, distName, manifestName)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+# original name => built name, relative to `staticFolder`
+manifest = loadManifest()
+
+
+def init_app(app):
+    """
+        Makes `url_for('static', ...)` & the `asset_urls` template helper
+        point at the built assets & serves them.
+    """
+    app.url_defaults(useBuiltAsset)
+    app.view_functions['static'] = makeStaticView(app)
+    app.jinja_env.globals['asset_urls'] = getAssetUrls
+
+
+def useBuiltAsset(endpoint, values):
+    if endpoint == 'static' and values.get('filename') in manifest:
+        values['filename'] = manifest[values['filename']]
+
+
+def getAssetUrls(name):
+    """
+        Returns the urls to include for `name`: the url of the built file,
+        or the urls of all of its sources when it is a bundle that has not
+        been built.
+    """
+    if name in bundles and name not in manifest:
+        return [url_for('static', filename=s) for s in bundles[name]]
+
+    return [url_for('static', filename=name)]
+
+
+def makeStaticView(app):
+    defaultView = app.view_functions['static']
+
+    def serveStatic(filename):
+        if not filename.startswith(distName + '/'):
+            return defaultView(filename=filename)
+
+        path = os.path.join(staticFolder, filename)
+        response = None
+        for encoding, extension in encodings:
+            if (
+                encoding in request.accept_encodings and
+                os.path.isfile(path + extension)
+            ):
+                response = send_from_directory(
+                    staticFolder,
+                    filename + extension,
+                    mimetype=mimetypes.guess_type(filename)[0],
+                    max_age=maxAge
+                )
+                response.content_encoding = encoding
+                break
+        if response is None:
+            response = send_from_directory(
+                staticFolder, filename, max_age=maxAge
+            )
+
+        response.headers['Cache-Control'] = cacheControl
+        response.vary.add('Accept-Encoding')
+
+        return response
+
+    return serveStatic
+
+
+if __name__ == '__main__':
+    import sys
+
+    if sys.argv[1:] != ['build']:
+        print(__doc__)
+        sys.exit(1)
+
+    built = build()
+    print('Built {} assets into {}.'.format(
+        len(built), os.path.join(staticFolder, distName)
+    ))
@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+
+
+from collections import OrderedDict
+import config
+import pickle
+import threading
+import time
+
+
+class CacheBackend(object):
+    """
+        Interface implemented by every cache backend.
+
+        Backends only have to implement `_get`, `_set`, `_delete` & `clear`,
+        the hit/miss bookkeeping is done here.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+            Returns the value cached under `key` or `None` when it is
+            missing or has expired.
+        """
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+            Caches `value` under `key` for `ttl` seconds (or for the
+            backend's default ttl when `ttl` is `None`).
+        """
+        self._set(key, value, ttl)
+
+    def delete(self, *keys):
+        for key in keys:
+            self._delete(key)
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def _delete(self, key):
+        raise NotImplementedError
+
+
+class LocalCache(CacheBackend):
+    """
+        In-process LRU cache holding at most `maxsize` entries, each of them
+        expiring `ttl` seconds after being set (never if `ttl` is `None`).
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        super(LocalCache, self).__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expiresAt = entry
+            if expiresAt is not None and expiresAt <= time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        expiresAt = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._entries[key] = (value, expiresAt)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SharedCache(CacheBackend):
+    """
+        Cache kept in a store shared by all the processes of the app.
+
+        `client` only needs the `get`, `set(name, value, ex=None)`, `delete`
+        & `scan_iter(match)` methods of a redis client. Values are pickled &
+        keys are prefixed with `namespace` so several caches can share
+        a single store.
+    """
+
+    def __init__(self, client, namespace, ttl=None):
+        super(SharedCache, self).__init__()
+        self.client = client
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self._key('*')):
+            self.client.delete(key)
+
+    def _get(self, key):
+        value = self.client.get(self._key(key))
+        if value is None:
+            return None
+
+        return pickle.loads(value)
+
+    def _set(self, key, value, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(
+            self._key(key),
+            pickle.dumps(value),
+            ex=(None if ttl is None else int(ttl))
+        )
+
+    def _delete(self, key):
+        self.client.delete(self._key(key))
+
+    def _key(self, key):
+        return '{}:{}'.format(self.namespace, key)
+
+
+class LocalStore(object):
+    """
+        In-process stand-in for a shared key-value store, implementing the
+        subset of the redis client api used by `SharedCache`.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            entry = self._values.get(name)
+            if entry is None:
+                return None
+
+            value, expiresAt = entry
+            if expiresAt is not None and expiresAt <= time.time():
+                del self._values[name]
+                return None
+
+            return value
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            self._values[name] = (
+                value, None if ex is None else time.time() + ex
+            )
+
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            return len([
+                name for name in names
+                if self._values.pop(name, None) is not None
+            ])
+
+    def scan_iter(self, match='*'):
+        prefix = match[:-1] if match.endswith('*') else None
+        with self._lock:
+            names = [
+                name for name in self._values
+                if name == match or (
+                    prefix is not None and name.startswith(prefix)
+                )
+            ]
+
+        return iter(names)
+
+
+_sharedClient = None
+
+
+def getSharedClient():
+    """
+        Returns the client of the store configured through `CACHE_URL`,
+        which is created on first use.
+    """
+    global _sharedClient
+    if _sharedClient is None:
+        if config.CACHE_URL in [None, '', 'local']:
+            _sharedClient = LocalStore()
+        else:
+            # redis is only needed when a shared cache is configured
+            import redis
+            _sharedClient = redis.StrictRedis.from_url(config.CACHE_URL)
+
+    return _sharedClient
+
+
+def makeCache(namespace, maxsize=1024, ttl=None):
+    """Returns a cache using the backend configured in `CACHE_BACKEND`."""
+    if config.CACHE_BACKEND == 'local':
+        return LocalCache(maxsize=maxsize, ttl=ttl)
+    elif config.CACHE_BACKEND == 'shared':
+        return SharedCache(getSharedClient(), namespace, ttl=ttl)
+
+    raise RuntimeError(
+        'Unsupported cache backend "{}" provided.'.format(
+            config.CACHE_BACKEND
+        )
+    )
@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+"""
+    Compression of the responses.
+
+    Responses of a compressible type are compressed with the best encoding
+    accepted by the client among brotli, zstd (when the brotli & zstandard
+    packages are installed) & gzip, if they are at least
+    `COMPRESSION_MIN_SIZE` bytes long. Streamed responses are compressed
+    chunk by chunk as they are sent, so they are still streamed.
+
+    Usage:
+        python3 app/compression.py benchmark
+            Reports the size & the CPU time of the compressed catalogue per
+            encoding & response size, to tune `COMPRESSION_MIN_SIZE`.
+"""
+
+
+import config
+from flask import request
+import gzip
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+compressibleTypes = [
+    'application/atom+xml',
+    'application/feed+json',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml'
+]
+
+
+class Encoder(object):
+    """Compresses a response body with a content encoding."""
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def compressor(self):
+        """
+            Returns a streaming compressor: a `(compress, flush, finish)`
+            triple of functions, `flush` returning what the client needs to
+            decode all the data compressed so far.
+        """
+        raise NotImplementedError
+
+
+class GzipEncoder(Encoder):
+    level = 6
+
+    def compress(self, data):
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def compressor(self):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + 15)
+
+        return (
+            compressor.compress,
+            lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+            compressor.flush
+        )
+
+
+class BrotliEncoder(Encoder):
+    # Dynamic responses are compressed on every request, the higher
+    # qualities are far slower for a few percent smaller responses
+    quality = 4
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.quality)
+
+    def compressor(self):
+        compressor = brotli.Compressor(quality=self.quality)
+
+        return (compressor.process, compressor.flush, compressor.finish)
+
+
+class ZstdEncoder(Encoder):
+    level = 3
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def compressor(self):
+        compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+
+        return (
+            compressor.compress,
+            lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            compressor.flush
+        )
+
+
+def getEncoders():
+    """Returns the available encoders by content encoding, best first."""
+    encoders = []
+    if brotli is not None:
+        encoders.append(('br', BrotliEncoder()))
+    if zstandard is not None:
+        encoders.append(('zstd', ZstdEncoder()))
+    encoders.append(('gzip', GzipEncoder()))
+
+    return encoders
+
+
+encoders = getEncoders()
+
+
+def init_app(app):
+    """Compresses the responses of `app`, if `COMPRESSION_ENABLED`."""
+    if config.COMPRESSION_ENABLED:
+        app.after_request(compressResponse)
+
+
+def compressResponse(response):
+    if not isCompressible(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding, encoder = pickEncoder()
+    if encoder is None:
+        return response
+
+    # The compressed body differs from the uncompressed one byte for byte,
+    # yet both are the same representation of the resource. The etag is
+    # weakened even when the body is too small to be compressed so that
+    # both the `200` & the `304` responses carry the same one.
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+    if response.status_code == 304:
+        return response
+
+    if hasattr(response.response, '__aiter__'):
+        # Streamed by the asynchronous views @see app/asgi.py
+        response.response = compressChunksAsync(response.response, encoder)
+        response.headers.pop('Content-Length', None)
+    elif response.is_streamed:
+        response.response = compressChunks(response.response, encoder)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config.COMPRESSION_MIN_SIZE:
+            return response
+        response.set_data(encoder.compress(data))
+    response.content_encoding = encoding
+
+    return response
+
+
+def isCompressible(response):
+    # Static files are served precompressed by app/assets.py
+    if request.endpoint == 'static':
+        return False
+    if response.status_code == 304:
+        return True
+
+    return (
+        response.status_code == 200 and
+        not response.direct_passthrough and
+        'Content-Encoding' not in response.headers and
+        'no-transform' not in response.headers.get('Cache-Control', '') and
+        (
+            response.mimetype.startswith('text/') or
+            response.mimetype in compressibleTypes
+        )
+    )
+
+
+def pickEncoder():
+    """Returns the best encoding accepted by the client & its encoder."""
+    accepted = request.accept_encodings
+    for encoding, encoder in encoders:
+        if accepted[encoding]:
+            return encoding, encoder
+
+    return None, None
+
+
+def compressChunks(chunks, encoder):
+    """
+        Yields the compressed chunks, flushing the compressor after every
+        one of them so that the client can decode them as they arrive.
+    """
+    compress, flush, finish = encoder.compressor()
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            output = compress(chunk) + flush()
+            if output:
+                yield output
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+async def compressChunksAsync(chunks, encoder):
+    """Same as `compressChunks`, for asynchronous iterables."""
+    compress, flush, finish = encoder.compressor()
+    try:
+        async for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            output = compress(chunk) + flush()
+            if output:
+                yield output
+        yield finish()
+    finally:
+        if hasattr(chunks, 'aclose'):
+            await chunks.aclose()
+
+
+def benchmark(data, sizes, repeat=20):
+    """
+        Returns a row per size & encoding: the size of the compressed prefix
+        of `data` of that size & the CPU time taken to compress it.
+    """
+    rows = []
+    for size in sizes:
+        sample = data[:size]
+        for encoding, encoder in encoders:
+            start = time.process_time()
+            for i in range(repeat):
+                compressed = encoder.compress(sample)
+            elapsed = (time.process_time() - start) / repeat
+            rows.append((len(sample), encoding, len(compressed), elapsed))
+
+    return rows
+
+
+if __name__ == '__main__':
+    import serializers
+    import sys
+
+    if sys.argv[1:] != ['benchmark']:
+        print(__doc__)
+        sys.exit(1)
+
+    with config.engine.connect() as connection:
+        rows = connection.execute(
+            serializers.selectCatalogueRows()
+        ).fetchall()
+    catalogues = [
+        (
+            'compact' if compact else 'full',
+            ''.join(serializers.encodeCatalogue([rows], compact)).encode()
+        )
+        for compact in [False, True]
+    ]
+
+    sizes = [256, 1024, 4096, 16384, 65536, 262144, 1048576]
+    print('{:>6} {:>10} {:>8} {:>10} {:>7} {:>10}'.format(
+        'json', 'size', 'encoding', 'compressed', 'ratio', 'cpu (us)'
+    ))
+    for name, data in catalogues:
+        for size, encoding, compressed, elapsed in benchmark(
+            data, [s for s in sizes if s <= len(data)] + [len(data)]
+        ):
+            print('{:>6} {:>10} {:>8} {:>10} {:>7.3f} {:>10.1f}'.format(
+                name,
+                size,
+                encoding,
+                compressed,
+                compressed / size,
+                elapsed * 1e6
+            ))
@@ -3,10 +3,17 @@
 from dotenv import load_dotenv, find_dotenv
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
 
 
 load_dotenv(find_dotenv())
 
+
+def isEnabled(name, default='false'):
+    """Reads a boolean flag from the environment."""
+    return os.environ.get(name, default).lower() in ['1', 'true', 'yes', 'on']
+
+
 # Database Credentials
 DB_CONNECTION = os.environ.get('DB_CONNECTION', 'sqlite')
 DB_USERNAME = os.environ.get('DB_USERNAME')
@@ -15,6 +22,29 @@ DB_HOST = os.environ.get('DB_HOST')
 DB_PORT = os.environ.get('DB_PORT')
 DB_DATABASE = os.environ.get('DB_DATABASE', 'item_catalogue')
 
+# Database Connection Pool
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = isEnabled('DB_POOL_PRE_PING', 'true')
+
+# Read Replicas
+# Comma separated database urls of the replicas the queries of read-only
+# requests are sent to @see app/routing.py
+DB_REPLICA_URLS = [
+    url.strip()
+    for url in os.environ.get('DB_REPLICA_URLS', '').split(',')
+    if url.strip()
+]
+# How a replica is picked: `round_robin` or `least_latency`
+DB_REPLICA_STRATEGY = os.environ.get('DB_REPLICA_STRATEGY', 'round_robin')
+# Seconds during which a visitor who wrote something reads from the primary,
+# so they see their own changes even if the replicas lag behind
+DB_PRIMARY_PIN_SECONDS = int(os.environ.get('DB_PRIMARY_PIN_SECONDS', 5))
+# Database url used by the asynchronous views @see app/asgi.py, by default
+# the database above through aiosqlite, asyncpg or aiomysql
+DB_ASYNC_URL = os.environ.get('DB_ASYNC_URL') or None
+
 # Google OAuth credentials
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
@@ -24,29 +54,142 @@ FB_APP_ID = os.environ.get('FB_APP_ID')
 FB_APP_SECRET = os.environ.get('FB_APP_SECRET')
 FB_VERSION = os.environ.get('FB_VERSION', 'v2.10')
 
+# OAuth provider endpoints, which can be pointed at a local fake provider
+GOOGLE_API_URL = os.environ.get(
+    'GOOGLE_API_URL', 'https://www.googleapis.com'
+)
+GOOGLE_ACCOUNTS_URL = os.environ.get(
+    'GOOGLE_ACCOUNTS_URL', 'https://accounts.google.com'
+)
+FB_GRAPH_URL = os.environ.get('FB_GRAPH_URL', 'https://graph.facebook.com')
+
+# HTTP client used to call the OAuth providers @see app/http_client.py
+OAUTH_CONNECT_TIMEOUT = float(os.environ.get('OAUTH_CONNECT_TIMEOUT', 3))
+OAUTH_READ_TIMEOUT = float(os.environ.get('OAUTH_READ_TIMEOUT', 5))
+OAUTH_RETRIES = int(os.environ.get('OAUTH_RETRIES', 2))
+OAUTH_RETRY_BACKOFF = float(os.environ.get('OAUTH_RETRY_BACKOFF', 0.2))
+OAUTH_POOL_SIZE = int(os.environ.get('OAUTH_POOL_SIZE', 10))
+
 # App Config
 APP_HOST = os.environ.get('APP_HOST', '0.0.0.0')
 APP_PORT = int(os.environ.get('APP_PORT', 8000))
 APP_SECRET_KEY = os.environ.get('APP_SECRET_KEY', 'super_secret_key')
+# Compiles the templates & primes the caches before serving any request
+APP_WARM_UP = isEnabled('APP_WARM_UP', 'true')
+# Keeps the compiled templates on disk, in `TEMPLATE_BYTECODE_CACHE_DIR` or
+# else in a directory of the system's temporary directory
+TEMPLATE_BYTECODE_CACHE_ENABLED = isEnabled(
+    'TEMPLATE_BYTECODE_CACHE_ENABLED', 'true'
+)
+TEMPLATE_BYTECODE_CACHE_DIR = (
+    os.environ.get('TEMPLATE_BYTECODE_CACHE_DIR') or None
+)
+# Number of worker processes started by app/serve.py
+APP_WORKERS = int(os.environ.get('APP_WORKERS', 4))
+# Number of rows encoded at a time while streaming `/catalogue.json`
+JSON_STREAM_CHUNK_SIZE = int(os.environ.get('JSON_STREAM_CHUNK_SIZE', 500))
+# Compresses the responses of at least `COMPRESSION_MIN_SIZE` bytes, as
+# well as all the streamed ones @see app/compression.py
+COMPRESSION_ENABLED = isEnabled('COMPRESSION_ENABLED', 'true')
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+# Where the session data is kept: `sql` (the `sessions` table), `shared`
+# (the store at `CACHE_URL`) or `cookie` (Flask's signed session cookie)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sql')
+# Expired sessions are deleted from the `sessions` table once every
+# `SESSION_SWEEP_EVERY` session writes on average
+SESSION_SWEEP_EVERY = int(os.environ.get('SESSION_SWEEP_EVERY', 1000))
+# Adds the number of SQL statements & the time spent in the database, in
+# rendering & in total to the headers of every response
+METRICS_HEADERS = isEnabled('METRICS_HEADERS')
+# Fails requests running more SQL statements than their declared budget
+# instead of only reporting them @see app/metrics.py
+QUERY_BUDGET_STRICT = isEnabled('QUERY_BUDGET_STRICT')
+# Rate Limiting @see app/ratelimit.py
+# Every client may run requests costing up to `RATE_LIMIT_BURST` tokens at
+# once, its bucket being refilled at `RATE_LIMIT_RATE` tokens per second.
+RATE_LIMIT_ENABLED = isEnabled('RATE_LIMIT_ENABLED', 'true')
+# `local` keeps the buckets in every process, `shared` in the store at
+# `CACHE_URL` so that all processes share them
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'local')
+RATE_LIMIT_RATE = float(os.environ.get('RATE_LIMIT_RATE', 5))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', 60))
+# Requests a process serves at once before answering `503`, by default as
+# many as the database connections it may open (0 never sheds requests)
+APP_MAX_CONCURRENCY = int(os.environ.get(
+    'APP_MAX_CONCURRENCY', DB_POOL_SIZE + DB_MAX_OVERFLOW
+))
+# Requests the asynchronous views of app/asgi.py serve at once before
+# answering `503`, as they only wait for the database with a coroutine
+# (0 never sheds requests)
+ASGI_MAX_CONCURRENCY = int(os.environ.get('ASGI_MAX_CONCURRENCY', 1000))
+# Cache Config
+# `local` keeps a cache per process, `shared` keeps it in the store at
+# `CACHE_URL` (e.g. redis://localhost:6379/0) so all processes share it.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'local')
+CACHE_URL = os.environ.get('CACHE_URL')
+# Seconds after which the cached category list is reloaded
+CATEGORY_CACHE_TTL = int(os.environ.get('CATEGORY_CACHE_TTL', 300))
+# Number of pages rendered for anonymous visitors kept in the page cache &
+# the seconds after which they are rendered again
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 1024))
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 600))
+# Number of the newest menu items kept in the feed of the catalogue & of
+# every category @see app/feeds.py, the most feeds kept per process & the
+# seconds after which a feed is reloaded (0 keeps them until evicted)
+FEED_SIZE = int(os.environ.get('FEED_SIZE', 20))
+FEED_CACHE_SIZE = int(os.environ.get('FEED_CACHE_SIZE', 1024))
+FEED_TTL = int(os.environ.get('FEED_TTL', 600))
+# Number of rendered fragments of the templates (e.g. the sidebar) kept in
+# the fragment cache & the seconds after which they are rendered again
+# @see app/templating.py
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 256))
+FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+# Number of (category slug, menu item slug) => menu item id lookups cached
+SLUG_CACHE_SIZE = int(os.environ.get('SLUG_CACHE_SIZE', 4096))
+# Number of email => user id lookups of the users logging in cached & the
+# seconds they are cached for
+USER_ID_CACHE_SIZE = int(os.environ.get('USER_ID_CACHE_SIZE', 10000))
+USER_ID_CACHE_TTL = int(os.environ.get('USER_ID_CACHE_TTL', 3600))
 # Username used in Database Seeds @see app/seeds.py
 USER_NAME_FOR_DB_SEEDS = os.environ.get('USER_NAME_FOR_DB_SEEDS')
 # Email Id used in Database Seeds @see app/seeds.py
 USER_EMAIL_FOR_DB_SEEDS = os.environ.get('USER_EMAIL_FOR_DB_SEEDS')
 
+# Settings shared by every pooled engine.
+# `pool_size` & `max_overflow` bound how many connections each process may
+# hold open, `pool_recycle` drops connections older than the given number of
+# seconds & `pool_pre_ping` tests a connection before handing it out so
+# that connections killed by the server are transparently replaced.
+poolOptions = {
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_recycle': DB_POOL_RECYCLE,
+    'pool_pre_ping': DB_POOL_PRE_PING
+}
+
 engine = None
 if DB_CONNECTION == 'sqlite':
-    engine = create_engine('sqlite:///{}.db'.format(DB_DATABASE))
+    # Every thread gets its own connection to the sqlite file, so a
+    # QueuePool is used explicitly (the sqlite default is a NullPool).
+    engine = create_engine(
+        'sqlite:///{}.db'.format(DB_DATABASE),
+        poolclass=QueuePool,
+        connect_args={'check_same_thread': False},
+        **poolOptions
+    )
 elif DB_CONNECTION == 'pgsql':
     engine = create_engine(
         'postgresql+psycopg2://{}:{}@{}:{}/{}'.format(
             DB_USERNAME, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE
-        )
+        ),
+        **poolOptions
     )
 elif DB_CONNECTION == 'mysql':
     engine = create_engine(
         'mysql+mysqldb://{}:{}@{}:{}/{}'.format(
             DB_USERNAME, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE
-        )
+        ),
+        **poolOptions
     )
 else:
     raise RuntimeError(
@@ -54,3 +197,47 @@ else:
             DB_CONNECTION
         )
     )
+
+
+def createReplicaEngine(url):
+    if url.startswith('sqlite'):
+        return create_engine(
+            url,
+            poolclass=QueuePool,
+            connect_args={'check_same_thread': False},
+            **poolOptions
+        )
+
+    return create_engine(url, **poolOptions)
+
+
+# Engines of the read replicas, in the order of `DB_REPLICA_URLS`
+replicaEngines = [createReplicaEngine(url) for url in DB_REPLICA_URLS]
+
+
+def createAsyncEngine():
+    """
+        Returns the engine of the asynchronous views, which needs the
+        asynchronous driver of the database to be installed.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    url = DB_ASYNC_URL
+    if url is None and DB_CONNECTION == 'sqlite':
+        url = 'sqlite+aiosqlite:///{}.db'.format(DB_DATABASE)
+    elif url is None:
+        url = '{}://{}:{}@{}:{}/{}'.format(
+            {
+                'pgsql': 'postgresql+asyncpg',
+                'mysql': 'mysql+aiomysql'
+            }[DB_CONNECTION],
+            DB_USERNAME, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE
+        )
+
+    if url.startswith('sqlite'):
+        return create_async_engine(
+            url, poolclass=AsyncAdaptedQueuePool, **poolOptions
+        )
+
+    return create_async_engine(url, **poolOptions)
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+"""
+    Menu item counters of the categories.
+
+    `categories.item_count` & `categories.last_item_at` hold the number of
+    menu items of every category & the creation time of the newest one, so
+    that reading them costs nothing beyond the category row. They are
+    updated in the same transaction as the menu items, by `updateCounters`
+    for single changes & by `reconcile` for bulk ones.
+
+    Usage:
+        python3 app/counters.py reconcile
+            Recomputes the counters of every category from the `menu_items`
+            table & repairs the ones which drifted.
+"""
+
+
+from config import engine
+from models import Category, MenuItem
+from sqlalchemy import func, select
+
+
+def updateCounters(connection, categoryId, delta):
+    """
+        Adds `delta` to the item count of the category whose menu items
+        have just been added (`delta` > 0) or deleted (`delta` < 0) through
+        `connection` (a connection or a session), once they are flushed.
+    """
+    categories = Category.__table__
+    connection.execute(
+        categories.update().where(
+            categories.c.id == categoryId
+        ).values(
+            item_count=categories.c.item_count + delta,
+            last_item_at=selectLastItemAt(categories.c.id),
+            # Counting the menu items is no edit of the category
+            updated_at=categories.c.updated_at
+        )
+    )
+
+
+def reconcile(connection):
+    """
+        Recomputes the counters of all the categories in a single statement,
+        returning the number of categories whose counters were repaired.
+    """
+    categories = Category.__table__
+    itemCount = selectItemCount(categories.c.id)
+    lastItemAt = selectLastItemAt(categories.c.id)
+
+    return connection.execute(
+        categories.update().where(
+            (categories.c.item_count != itemCount) |
+            categories.c.last_item_at.is_distinct_from(lastItemAt)
+        ).values(
+            item_count=itemCount,
+            last_item_at=lastItemAt,
+            updated_at=categories.c.updated_at
+        )
+    ).rowcount
+
+
+def selectItemCount(categoryId):
+    menuItems = MenuItem.__table__
+
+    return select([func.count(menuItems.c.id)]).where(
+        menuItems.c.category_id == categoryId
+    ).scalar_subquery()
+
+
+def selectLastItemAt(categoryId):
+    menuItems = MenuItem.__table__
+
+    return select([func.max(menuItems.c.created_at)]).where(
+        menuItems.c.category_id == categoryId
+    ).scalar_subquery()
+
+
+if __name__ == '__main__':
+    import sys
+
+    if sys.argv[1:] != ['reconcile']:
+        print(__doc__)
+        sys.exit(1)
+
+    with engine.begin() as connection:
+        repaired = reconcile(connection)
+    print('Repaired the counters of {} categories.'.format(repaired))
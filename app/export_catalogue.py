@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+"""
+    Exports the whole catalogue without going through the web app.
+
+    Usage:
+        python3 app/export_catalogue.py [--format json|ndjson]
+            [--output FILE] [--workers N] [--chunk-size N]
+
+    `json` writes the same document as `/catalogue.json`, `ndjson` writes one
+    category (with its `menu_items`) per line. Rows are read `--chunk-size`
+    at a time through a server-side cursor.
+
+    The export is a consistent snapshot of the catalogue. On PostgreSQL,
+    every category is exported by one of `--workers` processes into a shard
+    file of its own, all of them reading the snapshot of a single
+    REPEATABLE READ transaction (@see `pg_export_snapshot`). The shards are
+    then concatenated in the order of `/catalogue.json`, so the output does
+    not depend on the number of workers. Other databases cannot share a
+    snapshot between connections, the whole catalogue is then read by a
+    single query instead.
+"""
+
+
+import argparse
+from config import engine
+from models import Category
+import multiprocessing
+import os
+import serializers
+import shutil
+from sqlalchemy import desc, select, text
+import sys
+import tempfile
+import time
+
+
+def disposeEngine():
+    """
+        Runs in every worker so that it opens connections of its own
+        instead of sharing (or closing) the ones inherited from its parent.
+    """
+    engine.dispose(close=False)
+
+
+def writeCategories(connection, output, chunkSize, separator=',',
+                    categoryId=None):
+    """
+        Writes the categories (or only the one with `categoryId`) read
+        through `connection` to `output`. Returns the number of menu items
+        written.
+    """
+    written = 0
+
+    def countMenuItems(chunks):
+        nonlocal written
+        for chunk in chunks:
+            written += sum(1 for row in chunk if row.menu_item_id is not None)
+            yield chunk
+
+    rows = connection.execution_options(
+        stream_results=True
+    ).execute(serializers.selectCatalogueRows(categoryId))
+
+    for chunk in serializers.encodeCategories(
+        countMenuItems(serializers.fetchChunks(rows, chunkSize)),
+        separator=separator
+    ):
+        output.write(chunk)
+
+    return written
+
+
+def exportCategory(task):
+    """
+        Writes one category to the shard file at `path`, reading the
+        snapshot `snapshotId`. Returns the path & the number of menu items
+        written.
+    """
+    categoryId, path, chunkSize, snapshotId = task
+
+    with engine.connect() as connection, \
+            open(path, 'w', encoding='utf-8') as shard:
+        connection = connection.execution_options(
+            isolation_level='REPEATABLE READ'
+        )
+        with connection.begin():
+            connection.execute(
+                text('SET TRANSACTION SNAPSHOT :snapshot'),
+                {'snapshot': snapshotId}
+            )
+            written = writeCategories(
+                connection, shard, chunkSize, categoryId=categoryId
+            )
+
+    return path, written
+
+
+def getCategoryIds(connection):
+    categories = Category.__table__
+
+    return [
+        row.id for row in connection.execute(
+            select([categories.c.id]).order_by(
+                desc(categories.c.created_at), categories.c.id
+            )
+        )
+    ]
+
+
+def export(output, outputFormat, workers, chunkSize):
+    started = time.time()
+    separator = ',' if outputFormat == 'json' else '\n'
+
+    if outputFormat == 'json':
+        output.write('{"categories":[')
+    if engine.dialect.name == 'postgresql' and workers > 1:
+        categories, written = exportShards(
+            output, separator, workers, chunkSize
+        )
+    else:
+        with engine.connect() as connection:
+            categories = len(getCategoryIds(connection))
+            written = writeCategories(
+                connection, output, chunkSize, separator
+            )
+    output.write(']}\n' if outputFormat == 'json' else '\n')
+
+    elapsed = max(time.time() - started, 1e-6)
+    print(
+        'Exported {} categories & {} menu items in {:.1f}s '
+        '({:.0f} menu items/s)'.format(
+            categories, written, elapsed, written / elapsed
+        ),
+        file=sys.stderr
+    )
+
+
+def exportShards(output, separator, workers, chunkSize):
+    """
+        Writes every category through a pool of `workers` processes, all
+        reading the snapshot of the transaction listing the categories,
+        which stays open until they are done. Returns the number of
+        categories & of menu items written.
+    """
+    # Connections must not be inherited by the workers
+    engine.dispose()
+
+    with engine.connect() as connection:
+        connection = connection.execution_options(
+            isolation_level='REPEATABLE READ'
+        )
+        with connection.begin():
+            snapshotId = connection.execute(
+                text('SELECT pg_export_snapshot()')
+            ).scalar()
+            categoryIds = getCategoryIds(connection)
+            written = writeShards(
+                output, separator, workers, chunkSize, categoryIds,
+                snapshotId
+            )
+
+    return len(categoryIds), written
+
+
+def writeShards(output, separator, workers, chunkSize, categoryIds,
+                snapshotId):
+    written = 0
+    shardDirectory = tempfile.mkdtemp(prefix='catalogue-export-')
+    tasks = [
+        (
+            categoryId,
+            os.path.join(shardDirectory, '%d.json' % i),
+            chunkSize,
+            snapshotId
+        )
+        for i, categoryId in enumerate(categoryIds)
+    ]
+
+    try:
+        pool = multiprocessing.Pool(workers, initializer=disposeEngine)
+        try:
+            # Results come back in the order of the tasks, so every shard
+            # can be appended & removed as soon as it is ready
+            for i, (path, count) in enumerate(
+                pool.imap(exportCategory, tasks)
+            ):
+                if i > 0:
+                    output.write(separator)
+                with open(path, encoding='utf-8') as shard:
+                    shutil.copyfileobj(shard, output)
+                os.remove(path)
+                written += count
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(shardDirectory, ignore_errors=True)
+
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Exports the whole catalogue.'
+    )
+    parser.add_argument(
+        '--format', choices=['json', 'ndjson'], default='json'
+    )
+    parser.add_argument(
+        '--output', default='-', help='file to write to (stdout by default)'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=multiprocessing.cpu_count()
+    )
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    arguments = parser.parse_args()
+
+    if arguments.output == '-':
+        export(
+            sys.stdout, arguments.format, arguments.workers,
+            arguments.chunk_size
+        )
+    else:
+        with open(arguments.output, 'w', encoding='utf-8') as output:
+            export(
+                output, arguments.format, arguments.workers,
+                arguments.chunk_size
+            )
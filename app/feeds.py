@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+"""
+    Feeds of the latest menu items.
+
+    The `FEED_SIZE` newest menu items of the catalogue & of every category
+    are kept ready as plain entries (the columns of the menu item & of its
+    category), so that the home page & the Atom & JSON feeds are served
+    without querying the database. They are all loaded at start-up by
+    `seed` & then updated in place by the handlers adding, editing &
+    deleting menu items.
+
+    The database is only read for a feed missing from the cache: one that
+    was evicted or has expired after `FEED_TTL` seconds, which is what lets
+    every process catch up with the writes served by the others when each
+    of them keeps its own feeds (the `local` cache backend). Until then,
+    visitors who wrote read the feeds from the database
+    (@see `project.readsOwnWrites`).
+"""
+
+
+from models import Category, MenuItem
+from sqlalchemy import desc, func, select
+import threading
+
+
+class LatestItems(object):
+    """Keeps the newest `size` entries of every feed in `cache`."""
+
+    def __init__(self, cache, size):
+        self.cache = cache
+        self.size = size
+        # Serializes the updates of the feeds of this process
+        self._lock = threading.Lock()
+
+    def get(self, dbSession, categoryId=None):
+        """
+            Returns the newest entries of the catalogue, or of the category
+            with `categoryId`, newest first. They are only loaded through
+            `dbSession` when the feed is not cached.
+        """
+        key = getFeedKey(categoryId)
+        entries = self.cache.get(key)
+        if entries is None:
+            entries = self.load(dbSession, categoryId)
+            self.cache.set(key, entries)
+
+        return entries
+
+    def load(self, dbSession, categoryId=None):
+        query = selectEntries().order_by(
+            *getEntryOrder(MenuItem.__table__)
+        ).limit(self.size)
+        if categoryId is not None:
+            query = query.where(MenuItem.__table__.c.category_id == categoryId)
+
+        return [makeEntry(row) for row in dbSession.execute(query)]
+
+    def seed(self, dbSession):
+        """
+            Loads the feed of the catalogue & of every category, the latter
+            with a single query ranking the menu items of every category.
+            Returns the number of feeds loaded.
+        """
+        self.cache.set(getFeedKey(), self.load(dbSession))
+
+        feeds = {
+            row.id: [] for row in dbSession.execute(
+                select([Category.__table__.c.id])
+            )
+        }
+        ranked = selectEntries().add_columns(
+            func.row_number().over(
+                partition_by=MenuItem.__table__.c.category_id,
+                order_by=getEntryOrder(MenuItem.__table__)
+            ).label('position')
+        ).subquery()
+        for row in dbSession.execute(
+            select([ranked]).where(
+                ranked.c.position <= self.size
+            ).order_by(ranked.c.category_id, ranked.c.position)
+        ):
+            feeds.setdefault(row.category_id, []).append(makeEntry(row))
+
+        for categoryId, entries in feeds.items():
+            self.cache.set(getFeedKey(categoryId), entries)
+
+        return len(feeds) + 1
+
+    def addItem(self, menuItem):
+        """Adds a menu item which has just been committed to its feeds."""
+        entry = makeEntryOf(menuItem)
+
+        def add(entries):
+            entries.append(entry)
+            entries.sort(key=getEntryKey, reverse=True)
+            return entries[:self.size]
+
+        for categoryId in [None, menuItem.category_id]:
+            self.change(categoryId, add)
+
+    def updateItem(self, menuItem):
+        """Updates the entry of a menu item which has just been edited."""
+        entry = makeEntryOf(menuItem)
+
+        def update(entries):
+            return [entry if e['id'] == entry['id'] else e for e in entries]
+
+        for categoryId in [None, menuItem.category_id]:
+            self.change(categoryId, update)
+
+    def removeItem(self, dbSession, menuItemId, categoryId):
+        """
+            Removes a menu item which has just been deleted from its feeds.
+            A feed it was part of is loaded again through `dbSession`, to
+            take in the menu item which now makes it up.
+        """
+        for feedCategoryId in [None, categoryId]:
+            key = getFeedKey(feedCategoryId)
+            with self._lock:
+                entries = self.cache.get(key)
+                if entries is None:
+                    continue
+                if any(e['id'] == menuItemId for e in entries):
+                    self.cache.set(
+                        key, self.load(dbSession, feedCategoryId)
+                    )
+
+    def change(self, categoryId, update):
+        """
+            Replaces a cached feed by `update(entries)`. Feeds which are not
+            cached are left to be loaded, with the change, when next read.
+        """
+        key = getFeedKey(categoryId)
+        with self._lock:
+            entries = self.cache.get(key)
+            if entries is not None:
+                # Cached values are shared with the readers & never changed
+                self.cache.set(key, update(list(entries)))
+
+    def clear(self):
+        self.cache.clear()
+
+
+def getFeedKey(categoryId=None):
+    if categoryId is None:
+        return 'latest'
+
+    return 'category:{}'.format(categoryId)
+
+
+def getEntryOrder(menuItems):
+    return [desc(menuItems.c.created_at), desc(menuItems.c.id)]
+
+
+def getEntryKey(entry):
+    return entry['created_at'], entry['id']
+
+
+def selectEntries():
+    """Selects the columns of the entries, out of the menu items."""
+    menuItems = MenuItem.__table__
+    categories = Category.__table__
+
+    return select([
+        menuItems.c.id,
+        menuItems.c.name,
+        menuItems.c.slug,
+        menuItems.c.description,
+        menuItems.c.category_id,
+        menuItems.c.created_at,
+        menuItems.c.updated_at,
+        categories.c.name.label('category_name'),
+        categories.c.slug.label('category_slug')
+    ]).select_from(
+        menuItems.join(categories, menuItems.c.category_id == categories.c.id)
+    )
+
+
+def makeEntry(row):
+    """
+        Returns a row of `selectEntries` as an entry, which templates use
+        like a menu item (e.g. `entry.category.slug`).
+    """
+    return {
+        'id': row.id,
+        'name': row.name,
+        'slug': row.slug,
+        'description': row.description,
+        'category_id': row.category_id,
+        'created_at': row.created_at,
+        'updated_at': row.updated_at,
+        'category': {
+            'id': row.category_id,
+            'name': row.category_name,
+            'slug': row.category_slug
+        }
+    }
+
+
+def makeEntryOf(menuItem):
+    """Returns the entry of a menu item loaded along with its category."""
+    return {
+        'id': menuItem.id,
+        'name': menuItem.name,
+        'slug': menuItem.slug,
+        'description': menuItem.description,
+        'category_id': menuItem.category_id,
+        'created_at': menuItem.created_at,
+        'updated_at': menuItem.updated_at,
+        'category': {
+            'id': menuItem.category.id,
+            'name': menuItem.category.name,
+            'slug': menuItem.category.slug
+        }
+    }
+
+
+def formatTimestamp(timestamp):
+    """Formats a timestamp of the database (in UTC) as RFC 3339 does."""
+    return timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def getUpdatedAt(entries):
+    """Returns the latest modification time of the entries, if any."""
+    timestamps = [e['updated_at'] or e['created_at'] for e in entries]
+
+    return max(timestamps) if timestamps else None
+
+
+def makeFeedItems(entries, getUrl):
+    """
+        Returns the items of a feed of `entries`, as both the Atom & the
+        JSON feeds show them. `getUrl(entry)` returns the url of the page
+        of an entry.
+    """
+    return [{
+        'url': getUrl(entry),
+        'title': entry['name'],
+        'summary': entry['description'],
+        'category': entry['category'],
+        'published': formatTimestamp(entry['created_at']),
+        'updated': formatTimestamp(entry['updated_at'] or entry['created_at'])
+    } for entry in entries]
+
+
+def makeJSONFeed(title, homePageUrl, feedUrl, items):
+    """Returns the document of a JSON Feed (version 1.1) of `items`."""
+    return {
+        'version': 'https://jsonfeed.org/version/1.1',
+        'title': title,
+        'home_page_url': homePageUrl,
+        'feed_url': feedUrl,
+        'items': [{
+            'id': item['url'],
+            'url': item['url'],
+            'title': item['title'],
+            'content_text': item['summary'] or '',
+            'date_published': item['published'],
+            'date_modified': item['updated'],
+            'tags': [item['category']['name']]
+        } for item in items]
+    }
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+"""
+    Shared HTTP client used to call the OAuth providers.
+
+    Connections are kept alive & pooled across requests, every call has
+    connect & read timeouts & idempotent calls are retried with exponential
+    backoff when the provider fails or cannot be reached. Libraries built
+    on httplib2 (i.e. oauth2client) make their calls through
+    `httplib2Client`.
+"""
+
+
+from concurrent.futures import ThreadPoolExecutor
+import config
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def makeSession():
+    retry = Retry(
+        total=config.OAUTH_RETRIES,
+        backoff_factor=config.OAUTH_RETRY_BACKOFF,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=frozenset(['GET', 'DELETE'])
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=config.OAUTH_POOL_SIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+session = makeSession()
+# Runs the calls which do not depend on each other concurrently
+executor = ThreadPoolExecutor(max_workers=config.OAUTH_POOL_SIZE)
+
+
+def request(method, url, **kwargs):
+    kwargs.setdefault(
+        'timeout', (config.OAUTH_CONNECT_TIMEOUT, config.OAUTH_READ_TIMEOUT)
+    )
+
+    return session.request(method, url, **kwargs)
+
+
+def getJSON(url, params=None):
+    """Returns the decoded JSON body of a GET request to `url`."""
+    return request('GET', url, params=params).json()
+
+
+def getAllJSON(*calls):
+    """
+        Runs a GET request for every (url, params) pair in `calls` at the
+        same time & returns their decoded JSON bodies, in the same order.
+    """
+    futures = [
+        executor.submit(getJSON, url, params) for url, params in calls
+    ]
+
+    return [future.result() for future in futures]
+
+
+class Httplib2Client(object):
+    """
+        Stands in for an `httplib2.Http`, making its requests through the
+        pooled session, with its timeouts. Errors are raised as
+        `requests.RequestException`.
+    """
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+                connection_type=None):
+        response = request(
+            method,
+            uri,
+            data=body,
+            headers=headers,
+            allow_redirects=redirections > 0
+        )
+        info = dict(response.headers)
+        info['status'] = str(response.status_code)
+
+        return httplib2.Response(info), response.content
+
+
+httplib2Client = Httplib2Client()
@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+"""
+    Resolution of the users logging in.
+
+    A login resolves the email given by the OAuth provider to the id of the
+    user, creating the user when there is none yet, with a single atomic
+    get-or-create statement where the database supports it:
+        PostgreSQL  INSERT ... ON CONFLICT (email) DO UPDATE ... RETURNING id
+        MySQL       INSERT ... ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+    & otherwise with a lookup followed, for a new user, by an insert which
+    gives way to a concurrent login having created the same user. Either
+    way the unique index on `users.email` guarantees a single user per
+    email. Resolved ids are then cached by email.
+
+    Usage:
+        python3 app/identity.py benchmark [--threads N] [--logins N]
+            Races `--threads` concurrent logins of the same new users,
+            checks that each of them got a single user & id, & reports the
+            latency of a login resolved by the database & by the cache.
+            The users it creates are deleted afterwards.
+"""
+
+
+import cache
+from models import User
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+import threading
+import time
+
+
+class UserResolver(object):
+    """Resolves emails to user ids through `engine`, caching them."""
+
+    def __init__(self, engine, cache):
+        self.engine = engine
+        self.cache = cache
+
+    def resolve(self, email, name=None, picture=None):
+        """
+            Returns the id of the user with the given email, creating the
+            user with the given name & picture if there is none.
+        """
+        userId = self.cache.get(email)
+        if userId is None:
+            with self.engine.begin() as connection:
+                userId = getOrCreateUser(connection, {
+                    'email': email,
+                    'name': name,
+                    'picture': picture
+                })
+            self.cache.set(email, userId)
+
+        return userId
+
+
+def getOrCreateUser(connection, values):
+    """Returns the id of the user with `values['email']`, creating it."""
+    users = User.__table__
+    dialect = connection.dialect.name
+
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        statement = insert(users).values(**values)
+        # Unlike `DO NOTHING`, `DO UPDATE` returns the id of an existing user
+        return connection.execute(
+            statement.on_conflict_do_update(
+                index_elements=[users.c.email],
+                set_={'email': statement.excluded.email}
+            ).returning(users.c.id)
+        ).scalar()
+    elif dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        # The id of an existing user becomes the id reported as inserted
+        return connection.execute(
+            insert(users).values(**values).on_duplicate_key_update(
+                id=func.last_insert_id(users.c.id)
+            )
+        ).lastrowid
+
+    userId = selectUserId(connection, values['email'])
+    if userId is not None:
+        return userId
+
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        result = connection.execute(
+            insert(users).values(**values).on_conflict_do_nothing(
+                index_elements=[users.c.email]
+            )
+        )
+        if result.rowcount:
+            return result.inserted_primary_key[0]
+    else:
+        try:
+            with connection.begin_nested():
+                return connection.execute(
+                    users.insert().values(**values)
+                ).inserted_primary_key[0]
+        except IntegrityError:
+            pass
+
+    # Created by a concurrent login in the meantime
+    return selectUserId(connection, values['email'])
+
+
+def selectUserId(connection, email):
+    users = User.__table__
+
+    return connection.execute(
+        select([users.c.id]).where(users.c.email == email)
+    ).scalar()
+
+
+def benchmark(engine, threads, logins):
+    """
+        Races `threads` concurrent logins for each of `logins` new users,
+        returning the number of logins which did not agree on a single
+        user, then times the resolution of existing users.
+    """
+    emails = [
+        'identity-benchmark-{}@example.invalid'.format(i)
+        for i in range(logins)
+    ]
+    users = User.__table__
+    # email => ids resolved by each thread
+    resolved = {email: [] for email in emails}
+    barrier = threading.Barrier(threads)
+
+    def login():
+        resolver = UserResolver(engine, cache.LocalCache())
+        barrier.wait()
+        for email in emails:
+            resolved[email].append(resolver.resolve(email, 'Benchmark'))
+
+    try:
+        workers = [threading.Thread(target=login) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        with engine.connect() as connection:
+            rows = dict(connection.execute(
+                select([users.c.email, func.count(users.c.id)]).where(
+                    users.c.email.in_(emails)
+                ).group_by(users.c.email)
+            ).fetchall())
+        conflicts = sum(
+            1 for email in emails
+            if rows.get(email) != 1 or len(set(resolved[email])) != 1
+        )
+
+        timings = {}
+        for name, resolver in [
+            ('database', UserResolver(engine, cache.LocalCache(maxsize=0))),
+            ('cache', UserResolver(engine, cache.LocalCache()))
+        ]:
+            for email in emails:
+                resolver.resolve(email)
+            start = time.perf_counter()
+            for email in emails:
+                resolver.resolve(email)
+            timings[name] = (time.perf_counter() - start) / len(emails)
+    finally:
+        with engine.begin() as connection:
+            connection.execute(users.delete().where(users.c.email.in_(emails)))
+
+    return conflicts, timings
+
+
+if __name__ == '__main__':
+    import argparse
+    from config import engine
+
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the resolution of the users logging in.'
+    )
+    parser.add_argument('command', choices=['benchmark'])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=200)
+    arguments = parser.parse_args()
+
+    conflicts, timings = benchmark(
+        engine, arguments.threads, arguments.logins
+    )
+    print('{} concurrent logins of {} new users: {} conflicts'.format(
+        arguments.threads, arguments.logins, conflicts
+    ))
+    for name, elapsed in sorted(timings.items()):
+        print('Login resolved by the {}: {:.1f} us'.format(
+            name, elapsed * 1e6
+        ))
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+"""
+    Bulk imports categories & menu items from JSON Lines or CSV files.
+
+    Usage:
+        python3 app/import_catalogue.py [--categories FILE] [--items FILE]
+            [--user-email EMAIL] [--upsert] [--batch-size N]
+            [--transaction-size N]
+
+    Categories are read from records with `name` & `slug` fields & are owned
+    by the user with the given email (`USER_EMAIL_FOR_DB_SEEDS` by default).
+    Menu items are read from records with `name`, `slug`, `description` &
+    `category` (the slug of their category) fields. Files ending in `.csv`
+    are read as CSV with a header row, any other file as JSON Lines.
+
+    Records are streamed & inserted `--batch-size` rows per statement,
+    committing every `--transaction-size` rows, so memory use does not grow
+    with the size of the files. With `--upsert`, records whose slug already
+    exists update the existing row instead, so an import can be re-run,
+    leaving the owner & the item counters of a category as they are.
+    Once the menu items are imported, the search index & the item counters
+    of the categories are rebuilt.
+"""
+
+
+import argparse
+from config import engine, USER_EMAIL_FOR_DB_SEEDS
+import counters
+import csv
+import json
+from models import Category, MenuItem, User
+import search
+from sqlalchemy import func, select
+import time
+
+
+def readRecords(path):
+    """Yields the records of a JSON Lines or CSV file one at a time."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            for record in csv.DictReader(f):
+                yield record
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def makeInsert(connection, table, upsert):
+    """
+        Returns the statement inserting rows into `table`, which updates
+        the row having the same slug instead when `upsert` is set.
+    """
+    if not upsert:
+        return table.insert()
+
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table)
+        return statement.on_duplicate_key_update(
+            getUpdatedValues(table, statement.inserted)
+        )
+    else:
+        raise RuntimeError(
+            'Upserts are not supported for "{}" databases.'.format(dialect)
+        )
+
+    statement = insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.slug],
+        set_=getUpdatedValues(table, statement.excluded)
+    )
+
+
+# Columns an upsert leaves as they are on an existing row: the keys, the
+# owner of a category, the timestamps & the counters of app/counters.py,
+# which the proposed rows only hold the defaults of
+keptColumns = [
+    'id',
+    'slug',
+    'user_id',
+    'item_count',
+    'last_item_at',
+    'created_at',
+    'updated_at'
+]
+
+
+def getUpdatedValues(table, proposed):
+    """
+        Returns the values an upsert sets on an existing row: the ones
+        proposed for insertion, except for the `keptColumns`.
+    """
+    values = {
+        c.name: proposed[c.name]
+        for c in table.columns
+        if c.name not in keptColumns
+    }
+    values['updated_at'] = func.current_timestamp()
+
+    return values
+
+
+def importRows(connection, table, rows, upsert, batchSize, transactionSize):
+    """
+        Inserts `rows` in batches of `batchSize`, in transactions of at most
+        `transactionSize` rows. Returns the number of rows imported.
+    """
+    statement = makeInsert(connection, table, upsert)
+    imported = 0
+    uncommitted = 0
+    started = time.time()
+    transaction = connection.begin()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) < batchSize:
+            continue
+
+        connection.execute(statement, batch)
+        imported += len(batch)
+        uncommitted += len(batch)
+        batch = []
+        if uncommitted >= transactionSize:
+            transaction.commit()
+            transaction = connection.begin()
+            uncommitted = 0
+            reportProgress(table.name, imported, started)
+
+    if batch:
+        connection.execute(statement, batch)
+        imported += len(batch)
+    transaction.commit()
+    reportProgress(table.name, imported, started)
+
+    return imported
+
+
+def reportProgress(tableName, imported, started):
+    elapsed = max(time.time() - started, 1e-6)
+    print('{}: {} rows in {:.1f}s ({:.0f} rows/s)'.format(
+        tableName, imported, elapsed, imported / elapsed
+    ))
+
+
+def importCategories(connection, path, userId, **options):
+    return importRows(
+        connection,
+        Category.__table__,
+        (
+            {
+                'name': record['name'],
+                'slug': record['slug'],
+                'user_id': userId
+            }
+            for record in readRecords(path)
+        ),
+        **options
+    )
+
+
+def importMenuItems(connection, path, **options):
+    # Category slug => id, so that items can be inserted without lookups
+    categoryIds = {
+        row.slug: row.id
+        for row in connection.execute(select([
+            Category.__table__.c.slug, Category.__table__.c.id
+        ]))
+    }
+    # Number of menu items of unknown categories
+    skipped = [0]
+
+    def rows():
+        for record in readRecords(path):
+            categoryId = categoryIds.get(record['category'])
+            if categoryId is None:
+                skipped[0] += 1
+                continue
+
+            yield {
+                'name': record['name'],
+                'slug': record['slug'],
+                'description': record.get('description') or None,
+                'category_id': categoryId
+            }
+
+    imported = importRows(
+        connection, MenuItem.__table__, rows(), **options
+    )
+    if skipped[0]:
+        print('Skipped {} menu items of unknown categories.'.format(
+            skipped[0]
+        ))
+
+    return imported
+
+
+def getUserId(connection, email):
+    userId = connection.execute(
+        select([User.__table__.c.id]).where(User.__table__.c.email == email)
+    ).scalar()
+    if userId is None:
+        raise RuntimeError('No user with the email "{}" found.'.format(email))
+
+    return userId
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Bulk imports categories & menu items.'
+    )
+    parser.add_argument('--categories', help='file of categories')
+    parser.add_argument('--items', help='file of menu items')
+    parser.add_argument(
+        '--user-email',
+        default=USER_EMAIL_FOR_DB_SEEDS,
+        help='email of the user owning the imported categories'
+    )
+    parser.add_argument(
+        '--upsert',
+        action='store_true',
+        help='update the rows whose slug already exists'
+    )
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--transaction-size', type=int, default=50000)
+    arguments = parser.parse_args()
+
+    options = {
+        'upsert': arguments.upsert,
+        'batchSize': arguments.batch_size,
+        'transactionSize': arguments.transaction_size
+    }
+    with engine.connect() as connection:
+        if arguments.categories:
+            importCategories(
+                connection,
+                arguments.categories,
+                getUserId(connection, arguments.user_email),
+                **options
+            )
+        if arguments.items:
+            importMenuItems(connection, arguments.items, **options)
+            with connection.begin():
+                search.getSearchIndex(connection).rebuild(connection)
+                counters.reconcile(connection)
+
+    print('The catalogue was imported successfully!')
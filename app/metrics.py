@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+"""
+    Per-request instrumentation of the app.
+
+    Every request records the number of SQL statements it ran, the time
+    spent in the database, in rendering templates & in total. These are
+    kept per endpoint as histograms, which are exposed on `/metrics` in the
+    Prometheus text format, along with the time taken to render every
+    template (& every cached fragment of a template @see app/templating.py).
+"""
+
+
+import config
+from flask import Response, current_app, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from functools import wraps
+from sqlalchemy import event
+import threading
+import time
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class Histogram(object):
+    """Cumulative histogram of observed values, as Prometheus expects."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+
+# name => (help, buckets, label)
+metrics = {
+    'app_request_duration_seconds': (
+        'Time taken to handle a request.',
+        [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+        'endpoint'
+    ),
+    'app_db_queries': (
+        'Number of SQL statements run by a request.',
+        [0, 1, 2, 3, 5, 10, 20, 50, 100],
+        'endpoint'
+    ),
+    'app_db_duration_seconds': (
+        'Time spent running SQL statements during a request.',
+        [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5],
+        'endpoint'
+    ),
+    'app_template_render_seconds': (
+        'Time spent rendering templates during a request.',
+        [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1],
+        'endpoint'
+    ),
+    'app_template_duration_seconds': (
+        'Time taken to render a template or a fragment which was not cached.',
+        [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1],
+        'template'
+    )
+}
+
+# (name, label value) => Histogram
+histograms = {}
+histogramsLock = threading.Lock()
+
+
+def observe(name, endpoint, value):
+    key = (name, endpoint)
+    histogram = histograms.get(key)
+    if histogram is None:
+        with histogramsLock:
+            histogram = histograms.setdefault(
+                key, Histogram(metrics[name][1])
+            )
+    histogram.observe(value)
+
+
+def query_budget(maxQueries):
+    """
+        Declares the most SQL statements the view is expected to run.
+
+        Exceeding it logs a warning or, when `QUERY_BUDGET_STRICT` is on
+        (e.g. while testing), raises `QueryBudgetExceeded`.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            g.queryBudget = maxQueries
+            return f(*args, **kwargs)
+
+        return decorated
+
+    return decorator
+
+
+def init_app(app, engines):
+    """Instruments `app` & the SQL statements run through `engines`."""
+    for engine in engines:
+        instrumentEngine(engine)
+    before_render_template.connect(startRender, app)
+    template_rendered.connect(endRender, app)
+    app.before_request(startRequest)
+    app.after_request(endRequest)
+    app.add_url_rule('/metrics', 'getMetrics', getMetrics)
+
+
+def instrumentEngine(engine):
+    """Counts the SQL statements run through `engine` in the metrics."""
+    event.listen(engine, 'before_cursor_execute', startQuery)
+    event.listen(engine, 'after_cursor_execute', endQuery)
+
+
+def startQuery(connection, cursor, statement, parameters, context,
+               executemany):
+    connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def endQuery(connection, cursor, statement, parameters, context,
+             executemany):
+    elapsed = time.perf_counter() - connection.info['query_start'].pop()
+    if has_request_context() and 'metrics' in g:
+        g.metrics['queries'] += 1
+        g.metrics['db_time'] += elapsed
+
+
+def startRender(sender, template, context, **extra):
+    if 'metrics' in g:
+        g.metrics['render_start'].append(time.perf_counter())
+
+
+def endRender(sender, template, context, **extra):
+    if 'metrics' in g and g.metrics['render_start']:
+        elapsed = time.perf_counter() - g.metrics['render_start'].pop()
+        g.metrics['render_time'] += elapsed
+        recordRender(template.name, elapsed)
+
+
+def recordRender(name, elapsed):
+    """Records the time taken to render the template (or fragment) `name`."""
+    if has_request_context() and 'metrics' in g:
+        g.metrics['templates'].append((name, elapsed))
+
+
+def startRequest():
+    g.metrics = {
+        'start': time.perf_counter(),
+        'queries': 0,
+        'db_time': 0,
+        'render_start': [],
+        'render_time': 0,
+        'templates': []
+    }
+
+
+def endRequest(response):
+    if 'metrics' not in g:
+        return response
+
+    recorded = g.pop('metrics')
+    total = time.perf_counter() - recorded['start']
+    endpoint = request.endpoint or 'unknown'
+    observe('app_request_duration_seconds', endpoint, total)
+    observe('app_db_queries', endpoint, recorded['queries'])
+    observe('app_db_duration_seconds', endpoint, recorded['db_time'])
+    observe('app_template_render_seconds', endpoint, recorded['render_time'])
+    for name, elapsed in recorded['templates']:
+        observe('app_template_duration_seconds', name, elapsed)
+
+    if config.METRICS_HEADERS:
+        response.headers['X-DB-Queries'] = str(recorded['queries'])
+        response.headers['Server-Timing'] = (
+            'db;dur={:.2f}, render;dur={:.2f}, total;dur={:.2f}'.format(
+                recorded['db_time'] * 1000,
+                recorded['render_time'] * 1000,
+                total * 1000
+            )
+        )
+
+    budget = g.get('queryBudget')
+    if budget is not None and recorded['queries'] > budget:
+        message = '{} ran {} SQL statements, its budget is {}.'.format(
+            endpoint, recorded['queries'], budget
+        )
+        if config.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
+
+    return response
+
+
+def getMetrics():
+    lines = []
+    for name, (description, buckets, label) in sorted(metrics.items()):
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} histogram'.format(name))
+        for (histogramName, value), histogram in sorted(
+            histograms.items()
+        ):
+            if histogramName != name:
+                continue
+
+            labels = '{}="{}"'.format(label, value)
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    name, labels, bound, count
+                ))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(
+                name, labels, histogram.count
+            ))
+            lines.append('{}_sum{{{}}} {}'.format(
+                name, labels, histogram.sum
+            ))
+            lines.append('{}_count{{{}}} {}'.format(
+                name, labels, histogram.count
+            ))
+
+    return Response(
+        '\n'.join(lines) + '\n',
+        mimetype='text/plain; version=0.0.4'
+    )
@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+"""
+    Versioned, reversible schema migrations.
+
+    Usage:
+        python3 app/migrate.py [upgrade]
+            Applies every pending migration.
+        python3 app/migrate.py downgrade [VERSION]
+            Reverts the latest migration, or every migration newer than
+            VERSION when it is given.
+        python3 app/migrate.py status
+            Lists the migrations & whether they have been applied.
+
+    Migrations check the current schema before changing it, so they can also
+    be applied to a database freshly created by `app/models.py`.
+"""
+
+
+from config import engine
+import counters
+from models import Base, Category, User, UserSession
+import search
+import sys
+from sqlalchemy import (
+    Column, MetaData, String, Table, TIMESTAMP, func, inspect, select, text
+)
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql.functions import current_timestamp
+
+
+metadata = MetaData()
+
+# Versions of the migrations applied to the database
+schemaMigrations = Table(
+    'schema_migrations',
+    metadata,
+    Column('version', String(100), primary_key=True),
+    Column(
+        'applied_at',
+        TIMESTAMP,
+        nullable=False,
+        server_default=current_timestamp()
+    )
+)
+
+
+class Migration(object):
+    """A reversible change to the schema, identified by its version."""
+    version = None
+    description = None
+
+    def upgrade(self, connection):
+        raise NotImplementedError
+
+    def downgrade(self, connection):
+        raise NotImplementedError
+
+
+class AddLookupIndexes(Migration):
+    version = '0001'
+    description = 'Add indexes on the lookup, join & ordering columns'
+    indexes = [
+        ('users', 'ix_users_email'),
+        ('categories', 'ix_categories_user_id'),
+        ('categories', 'ix_categories_name'),
+        ('categories', 'ix_categories_created_at'),
+        ('menu_items', 'ix_menu_items_category_id_created_at'),
+        ('menu_items', 'ix_menu_items_created_at')
+    ]
+
+    def upgrade(self, connection):
+        # The index on `users.email` is unique, which the users created
+        # twice by concurrent first logins would violate
+        mergeDuplicateUsers(connection)
+        for tableName, indexName in self.indexes:
+            createIndex(connection, getIndex(tableName, indexName))
+
+    def downgrade(self, connection):
+        for tableName, indexName in reversed(self.indexes):
+            dropIndex(connection, getIndex(tableName, indexName))
+
+
+class AddSearchIndex(Migration):
+    version = '0002'
+    description = 'Add the full-text search index of the menu items'
+
+    def upgrade(self, connection):
+        search.createIndex(connection)
+
+    def downgrade(self, connection):
+        search.dropIndex(connection)
+
+
+class AddSessionsTable(Migration):
+    version = '0003'
+    description = 'Add the table of server-side sessions'
+
+    def upgrade(self, connection):
+        UserSession.__table__.create(connection, checkfirst=True)
+
+    def downgrade(self, connection):
+        UserSession.__table__.drop(connection, checkfirst=True)
+
+
+class AddCategoryCounters(Migration):
+    version = '0004'
+    description = 'Add the menu item counters of the categories'
+    columns = ['item_count', 'last_item_at']
+
+    def upgrade(self, connection):
+        for name in self.columns:
+            addColumn(connection, Category.__table__.c[name])
+        counters.reconcile(connection)
+
+    def downgrade(self, connection):
+        for name in reversed(self.columns):
+            dropColumn(connection, Category.__table__.c[name])
+
+
+# Every migration, in the order they have to be applied
+migrations = [
+    AddLookupIndexes(),
+    AddSearchIndex(),
+    AddSessionsTable(),
+    AddCategoryCounters()
+]
+
+
+def getIndex(tableName, indexName):
+    """Returns the index named `indexName` declared in `app/models.py`."""
+    for index in Base.metadata.tables[tableName].indexes:
+        if index.name == indexName:
+            return index
+
+    raise KeyError(indexName)
+
+
+def mergeDuplicateUsers(connection):
+    """
+        Merges the users sharing an email into the first one created: their
+        categories are handed over to it & they are deleted. Returns the
+        number of users deleted.
+    """
+    users = User.__table__
+    categories = Category.__table__
+    duplicates = connection.execute(
+        select([users.c.email, func.min(users.c.id).label('id')]).group_by(
+            users.c.email
+        ).having(func.count(users.c.id) > 1)
+    ).fetchall()
+
+    merged = 0
+    for email, userId in duplicates:
+        otherIds = [
+            row.id for row in connection.execute(
+                select([users.c.id]).where(
+                    (users.c.email == email) & (users.c.id != userId)
+                ).order_by(users.c.id)
+            )
+        ]
+        connection.execute(
+            categories.update().where(
+                categories.c.user_id.in_(otherIds)
+            ).values(
+                user_id=userId, updated_at=categories.c.updated_at
+            )
+        )
+        connection.execute(users.delete().where(users.c.id.in_(otherIds)))
+        merged += len(otherIds)
+        print('Merged the users {} into the user {} ({})'.format(
+            ', '.join(str(i) for i in otherIds), userId, email
+        ))
+
+    return merged
+
+
+def hasIndex(connection, index):
+    return index.name in [
+        i['name'] for i in inspect(connection).get_indexes(index.table.name)
+    ]
+
+
+def createIndex(connection, index):
+    if not hasIndex(connection, index):
+        index.create(connection)
+
+
+def dropIndex(connection, index):
+    if hasIndex(connection, index):
+        index.drop(connection)
+
+
+def hasColumn(connection, column):
+    return column.name in [
+        c['name'] for c in inspect(connection).get_columns(column.table.name)
+    ]
+
+
+def addColumn(connection, column):
+    """Adds a column declared in `app/models.py` to its existing table."""
+    if not hasColumn(connection, column):
+        connection.execute(text('ALTER TABLE {} ADD COLUMN {}'.format(
+            column.table.name,
+            CreateColumn(column).compile(dialect=connection.dialect)
+        )))
+
+
+def dropColumn(connection, column):
+    if hasColumn(connection, column):
+        connection.execute(text('ALTER TABLE {} DROP COLUMN {}'.format(
+            column.table.name, column.name
+        )))
+
+
+def getAppliedVersions(connection):
+    metadata.create_all(connection)
+
+    return set(
+        row.version
+        for row in connection.execute(select([schemaMigrations.c.version]))
+    )
+
+
+def upgrade():
+    with engine.connect() as connection:
+        applied = getAppliedVersions(connection)
+
+    for migration in migrations:
+        if migration.version in applied:
+            continue
+
+        with engine.begin() as connection:
+            migration.upgrade(connection)
+            connection.execute(
+                schemaMigrations.insert().values(version=migration.version)
+            )
+        print('Applied {} {}'.format(
+            migration.version, migration.description
+        ))
+
+
+def downgrade(version=None):
+    with engine.connect() as connection:
+        applied = getAppliedVersions(connection)
+
+    reverting = [m for m in migrations if m.version in applied]
+    if version is None:
+        reverting = reverting[-1:]
+    else:
+        reverting = [m for m in reverting if m.version > version]
+
+    for migration in reversed(reverting):
+        with engine.begin() as connection:
+            migration.downgrade(connection)
+            connection.execute(schemaMigrations.delete().where(
+                schemaMigrations.c.version == migration.version
+            ))
+        print('Reverted {} {}'.format(
+            migration.version, migration.description
+        ))
+
+
+def status():
+    with engine.connect() as connection:
+        applied = getAppliedVersions(connection)
+
+    for migration in migrations:
+        print('[{}] {} {}'.format(
+            'x' if migration.version in applied else ' ',
+            migration.version,
+            migration.description
+        ))
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    if command == 'upgrade':
+        upgrade()
+    elif command == 'downgrade':
+        downgrade(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif command == 'status':
+        status()
+    else:
+        print(__doc__)
+        sys.exit(1)
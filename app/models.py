@@ -4,7 +4,7 @@
 from config import engine
 from datetime import datetime
 from sqlalchemy import (
-    Column, ForeignKey, Integer, String, Text, TIMESTAMP
+    Column, ForeignKey, Index, Integer, String, Text, TIMESTAMP
 )
 from sqlalchemy.sql.functions import current_timestamp
 from sqlalchemy.ext.declarative import declarative_base
@@ -60,11 +60,18 @@ class Category(Base):
     user_id = Column(Integer, ForeignKey('users.id'))
     name = Column(String(100), nullable=False)
     slug = Column(String(100), nullable=False, unique=True)
+    # A query of the menu items, newest first, as a category may have far
+    # too many of them to be loaded at once
     menu_items = relationship(
         'MenuItem',
-        order_by='desc(MenuItem.created_at)',
+        order_by='[desc(MenuItem.created_at), MenuItem.id]',
+        lazy='dynamic',
         backref='category'
     )
+    # Number of menu items & creation time of the newest one, kept up to
+    # date by every write to the menu items @see app/counters.py
+    item_count = Column(Integer, nullable=False, server_default='0')
+    last_item_at = Column(TIMESTAMP, nullable=True)
     created_at = Column(
         TIMESTAMP,
         nullable=False,
@@ -124,6 +131,29 @@ class MenuItem(Base):
         }
 
 
+class UserSession(Base):
+    """docstring for UserSession"""
+    __tablename__ = 'sessions'
+
+    id = Column(String(64), primary_key=True)
+    data = Column(Text, nullable=False)
+    expires_at = Column(TIMESTAMP, nullable=False, index=True)
+
+
+# Indexes matching the columns every page looks up, joins & orders by.
+# @see app/migrate.py for adding them to an existing database.
+Index('ix_users_email', User.email, unique=True)
+Index('ix_categories_user_id', Category.user_id)
+Index('ix_categories_name', Category.name)
+Index('ix_categories_created_at', Category.created_at.desc())
+Index(
+    'ix_menu_items_category_id_created_at',
+    MenuItem.category_id,
+    MenuItem.created_at.desc()
+)
+Index('ix_menu_items_created_at', MenuItem.created_at.desc())
+
+
 if __name__ == '__main__':
     Base.metadata.create_all(engine)
     print("All the tables were created sucessfully!")
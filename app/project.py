@@ -1,31 +1,112 @@
 #!/usr/bin/python3
 
 
+import assets
+import cache
+import compression
 import config
+import counters
+from datetime import datetime
+import feeds
 from flask import (
-    Flask, abort, redirect, render_template, make_response,
+    Flask, Response, abort, g, redirect, render_template, make_response,
     request, url_for, flash, jsonify, session as login_session
 )
 from functools import wraps
-import httplib2
+import hashlib
+import http_client
+import identity
 import json
-from models import Base, Category, MenuItem, User
+import metrics
+from metrics import query_budget
+from models import Base, Category, MenuItem
 from oauth2client.client import OAuth2WebServerFlow, FlowExchangeError
+import serializers
+import sessions
 import string
-from sqlalchemy import desc
-from sqlalchemy.orm import joinedload, sessionmaker
+from sqlalchemy import desc, event, func, inspect, lambda_stmt, select
+from sqlalchemy.orm import joinedload, scoped_session, sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
 import random
+from ratelimit import rate_limit
+import ratelimit
 import requests
+import routing
+import search
+import templating
+from werkzeug.http import is_resource_modified
 
 
 Base.metadata.bind = config.engine
-DBSession = sessionmaker(bind=config.engine)
-session = DBSession()
+DBSession = sessionmaker(
+    bind=config.engine, class_=routing.RoutingSession
+)
+# Every thread (i.e. every request being served) gets its own session, which
+# is checked out of the engine's connection pool on first use & handed back
+# once the request's app context is torn down (@see shutdown_session).
+# Read-only requests read from a replica, if any @see app/routing.py
+session = scoped_session(DBSession)
+
+# The list of categories shown in the sidebar of every page
+categoryCache = cache.makeCache('categories', ttl=config.CATEGORY_CACHE_TTL)
+# Pages rendered for anonymous visitors @see cached_page
+pageCache = cache.makeCache(
+    'pages', maxsize=config.PAGE_CACHE_SIZE, ttl=config.PAGE_CACHE_TTL
+)
+# (category slug, menu item slug) => menu item id @see resolveMenuItemId
+menuItemIdCache = cache.makeCache(
+    'menu_item_ids', maxsize=config.SLUG_CACHE_SIZE
+)
+# Rendered fragments of the templates @see app/templating.py
+fragmentCache = cache.makeCache(
+    'fragments',
+    maxsize=config.FRAGMENT_CACHE_SIZE,
+    ttl=config.FRAGMENT_CACHE_TTL
+)
+# Email => id of the users logging in @see app/identity.py
+userResolver = identity.UserResolver(
+    config.engine,
+    cache.makeCache(
+        'user_ids',
+        maxsize=config.USER_ID_CACHE_SIZE,
+        ttl=config.USER_ID_CACHE_TTL
+    )
+)
+# The newest menu items of the catalogue & of every category @see app/feeds.py
+latestItems = feeds.LatestItems(
+    cache.makeCache(
+        'feeds', maxsize=config.FEED_CACHE_SIZE, ttl=config.FEED_TTL or None
+    ),
+    config.FEED_SIZE
+)
+
+# Visitors who changed menu items lately get the cookie @see readsOwnWrites
+ownWritesCookieName = 'own_writes'
 
 emptyValues = [None, False, "", []]
+# Largest number of categories returned by a single page of the catalogue.
+maxCataloguePageSize = 100
+# Number of menu items shown on a single page of search results.
+searchPageSize = 20
+# Number of menu items shown on a single page of a category.
+categoryPageSize = 50
+# Number of the latest menu items shown on the home page.
+homePageSize = 10
+# @see getSearchIndex
+searchIndex = None
 
 app = Flask(__name__)
+app.secret_key = config.APP_SECRET_KEY
+metrics.init_app(app, [config.engine] + config.replicaEngines)
+routing.init_app(app, DBSession, session)
+ratelimit.init_app(app)
+assets.init_app(app)
+compression.init_app(app)
+templating.init_app(app, fragmentCache)
+# Keeps the session data server-side, the cookie only holds the session id
+sessionInterface = sessions.makeSessionInterface(config.engine)
+if sessionInterface is not None:
+    app.session_interface = sessionInterface
 
 
 def requires_auth(f):
@@ -38,26 +119,247 @@ def requires_auth(f):
     return decorated
 
 
+def conditional(getValidators):
+    """
+        Answers conditional GET requests (`If-None-Match`/`If-Modified-Since`)
+        with a `304 Not Modified` before the view is even called.
+
+        `getValidators` receives the view's arguments & returns an
+        (etag, last modified) pair, or `None` when the requested resource
+        does not exist, in which case the view is left to handle it.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            validators = getValidators(*args, **kwargs)
+            if validators is None:
+                return f(*args, **kwargs)
+
+            etag, lastModified = validators
+            if is_resource_modified(
+                request.environ, etag=etag, last_modified=lastModified
+            ):
+                response = make_response(f(*args, **kwargs))
+            else:
+                response = Response(status=304)
+
+            if response.status_code in [200, 304]:
+                response.set_etag(etag)
+                if lastModified is not None:
+                    response.last_modified = lastModified
+
+            return response
+
+        return decorated
+
+    return decorator
+
+
+def cached_page(getKey):
+    """
+        Serves the page rendered by the view out of `pageCache`.
+
+        `getKey` receives the view's arguments & returns the key of the
+        page, or `None` if it is not to be cached. Only pages rendered for
+        anonymous visitors without pending flash messages are cached, as
+        all of them get the same output.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if (
+                'username' in login_session or
+                '_flashes' in login_session or
+                readsOwnWrites()
+            ):
+                return f(*args, **kwargs)
+
+            key = getKey(*args, **kwargs)
+            if key is None:
+                return f(*args, **kwargs)
+
+            page = pageCache.get(key)
+            if page is not None:
+                body, mimetype = page
+                return Response(body, mimetype=mimetype)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                pageCache.set(key, (response.get_data(), response.mimetype))
+
+            return response
+
+        return decorated
+
+    return decorator
+
+
+def readsOwnWrites():
+    """
+        Tells whether the visitor changed menu items lately. With the `local`
+        cache backend, every process only updates its own feeds & pages on
+        the writes it serves, so the next requests of the visitor, which
+        any process may serve, bypass them until they have all expired.
+    """
+    return ownWritesCookieName in request.cookies
+
+
+@app.after_request
+def pinOwnWrites(response):
+    if g.pop('wroteMenuItems', False) and config.CACHE_BACKEND == 'local':
+        response.set_cookie(
+            ownWritesCookieName,
+            '1',
+            max_age=max(config.FEED_TTL, config.PAGE_CACHE_TTL) or None,
+            httponly=True
+        )
+
+    return response
+
+
+@app.teardown_appcontext
+def shutdown_session(exception=None):
+    """
+        Rolls back anything left uncommitted & releases the request's
+        session so its connection goes back to the pool.
+    """
+    session.remove()
+
+
+@event.listens_for(DBSession, 'after_flush')
+def recordCategoryChanges(dbSession, flushContext):
+    for instance in (
+        list(dbSession.new) + list(dbSession.dirty) + list(dbSession.deleted)
+    ):
+        if isinstance(instance, Category):
+            dbSession.info['categories_changed'] = True
+            return
+
+
+@event.listens_for(DBSession, 'after_flush')
+def recordMenuItemMoves(dbSession, flushContext):
+    """Notes whether any menu item was deleted or got another url."""
+    for instance in dbSession.deleted:
+        if isinstance(instance, MenuItem):
+            dbSession.info['menu_items_moved'] = True
+            return
+
+    for instance in dbSession.dirty:
+        if isinstance(instance, MenuItem):
+            attributes = inspect(instance).attrs
+            if (
+                attributes.slug.history.has_changes() or
+                attributes.category_id.history.has_changes()
+            ):
+                dbSession.info['menu_items_moved'] = True
+                return
+
+
+@event.listens_for(DBSession, 'after_commit')
+def invalidateCategoryCache(dbSession):
+    """
+        Drops the cached category list once a change to any category has
+        been committed.
+    """
+    if dbSession.info.pop('categories_changed', False):
+        categoryCache.delete('list')
+        # The sidebar of every cached page lists the categories
+        pageCache.clear()
+        # & the entries of the feeds name them
+        latestItems.clear()
+
+
+@event.listens_for(DBSession, 'after_commit')
+def invalidateMenuItemIds(dbSession):
+    """
+        Drops the cached menu item ids once a menu item has been renamed,
+        moved or deleted, as their old slugs may now point elsewhere.
+    """
+    if dbSession.info.pop('menu_items_moved', False):
+        menuItemIdCache.clear()
+
+
+@event.listens_for(DBSession, 'after_commit')
+def commitSearchChanges(dbSession):
+    """
+        Applies the changes made to the in-process search index once they
+        have been committed @see app/search.py
+    """
+    if searchIndex is not None:
+        searchIndex.commit(dbSession)
+
+
+@event.listens_for(DBSession, 'after_soft_rollback')
+def forgetCategoryChanges(dbSession, previousTransaction):
+    dbSession.info.pop('categories_changed', None)
+    dbSession.info.pop('menu_items_moved', None)
+    if searchIndex is not None:
+        searchIndex.rollback(dbSession)
+
+
+@app.context_processor
+def injectCategories():
+    """
+        Makes the categories available to the sidebar of every page, along
+        with their version, under which the sidebar is cached.
+    """
+    # The asynchronous views load them beforehand @see app/asgi.py
+    if 'categories' not in g:
+        g.categoriesVersion, g.categories = getCategoryList(session)
+
+    return {
+        'categories': g.categories,
+        'categories_version': g.categoriesVersion
+    }
+
+
 @app.route('/')
+@query_budget(2)
+@cached_page(lambda: 'home')
 def home():
     """Show main landing page."""
-    if 'categories' not in login_session:
-        categories = session.query(Category).order_by(Category.name).all()
-        login_session['categories'] = [c.serialize for c in categories]
+    return render_template('home.html', menuItems=getLatestMenuItems(
+        session, readsOwnWrites()
+    ))
+
 
-    menuItems = session.query(MenuItem).options(
-        joinedload(MenuItem.category)
-    ).order_by(desc(MenuItem.created_at)).limit(10).all()
+def getLatestMenuItems(dbSession, fresh=False):
+    """
+        Returns the entries of the newest menu items, along with their
+        category, out of the feed of the catalogue @see app/feeds.py
+        The feed is read from the database when `fresh` is set.
+    """
+    if fresh:
+        return latestItems.load(dbSession)[:homePageSize]
 
-    return render_template('home.html', menuItems=menuItems)
+    return latestItems.get(dbSession)[:homePageSize]
 
 
 @app.route('/catalogue/<string:categorySlug>/items')
+@query_budget(4)
+@cached_page(lambda categorySlug: getCategoryPageKey(categorySlug))
 def showMenuItemsInACategory(categorySlug):
+    """
+        Shows a page of `categoryPageSize` menu items of the category,
+        starting after the menu item whose id is given as `after`, which
+        is a `404` once that menu item was deleted or moved.
+    """
     try:
-        category = session.query(Category).filter_by(
+        after = int(request.args.get('after', 0))
+    except ValueError:
+        abort(400)
+
+    return render_template(
+        'category.html', **getCategoryPage(session, categorySlug, after)
+    )
+
+
+def getCategoryPage(dbSession, categorySlug, after):
+    """Returns the context of the category page, aborting with a `404`."""
+    try:
+        category = dbSession.query(Category).filter_by(
             slug=categorySlug
-        ).options(joinedload(Category.menu_items)).one()
+        ).one()
         if category in emptyValues:
             """
                 This is necessary because while using 'sqlite'
@@ -67,11 +369,70 @@ def showMenuItemsInACategory(categorySlug):
     except NoResultFound:
         abort(404)
 
-    return render_template(
-        'category.html',
-        category=category,
-        numberOfItems=len(category.menu_items)
+    menuItems = getMenuItemsPage(
+        dbSession, category.id, after, categoryPageSize
     )
+    if after and not menuItems and not hasMenuItem(
+        dbSession, category.id, after
+    ):
+        # `after` names no menu item of the category (anymore)
+        abort(404)
+    nextAfter = None
+    if len(menuItems) > categoryPageSize:
+        menuItems = menuItems[:categoryPageSize]
+        nextAfter = menuItems[-1].id
+
+    return {
+        'category': category,
+        'menuItems': menuItems,
+        'numberOfItems': category.item_count,
+        'after': after,
+        'nextAfter': nextAfter
+    }
+
+
+def getCategoryPageKey(categorySlug):
+    """Only the first page of a category is cached (@see invalidatePages)."""
+    if 'after' in request.args:
+        return None
+
+    return 'category:' + categorySlug
+
+
+def getMenuItemPageKey(categorySlug, menuSlug):
+    return 'item:%s:%s' % (categorySlug, menuSlug)
+
+
+def getMenuItemsPage(dbSession, categoryId, after, limit):
+    """
+        Returns up to `limit + 1` menu items of the category following the
+        menu item whose id is `after` (from the newest one if it is `0`),
+        the extra one telling whether there is a next page. There are none
+        when that menu item is not one of the category.
+
+        The page starts right after the position of that menu item in the
+        `(created_at desc, id)` order, so it is found through the index on
+        `(category_id, created_at)` however deep it is.
+    """
+    query = select(MenuItem).where(
+        MenuItem.category_id == categoryId
+    ).order_by(desc(MenuItem.created_at), MenuItem.id)
+    if after:
+        previous = select([MenuItem.created_at]).where(
+            (MenuItem.id == after) & (MenuItem.category_id == categoryId)
+        ).scalar_subquery()
+        query = query.where(
+            (MenuItem.created_at < previous) |
+            ((MenuItem.created_at == previous) & (MenuItem.id > after))
+        )
+
+    return dbSession.execute(query.limit(limit + 1)).scalars().all()
+
+
+def hasMenuItem(dbSession, categoryId, menuItemId):
+    return dbSession.execute(select([MenuItem.id]).where(
+        (MenuItem.id == menuItemId) & (MenuItem.category_id == categoryId)
+    )).first() is not None
 
 
 @app.route('/catalogue/<string:categorySlug>', methods=['GET', 'POST'])
@@ -116,7 +477,13 @@ def addMenuItemToACategory(categorySlug):
         )
 
         session.add(menuItem)
+        session.flush()
+        getSearchIndex().add(session, menuItem)
+        counters.updateCounters(session, category.id, 1)
         session.commit()
+        latestItems.addItem(menuItem)
+        g.wroteMenuItems = True
+        invalidatePages(categorySlug)
         flash('Menu Item: %s was added' % menuItem.name)
 
         return redirect(url_for(
@@ -126,9 +493,13 @@ def addMenuItemToACategory(categorySlug):
 
 
 @app.route('/catalogue/<string:categorySlug>/<string:menuSlug>')
+@query_budget(3)
+@cached_page(
+    lambda categorySlug, menuSlug: getMenuItemPageKey(categorySlug, menuSlug)
+)
 def showMenuItem(categorySlug, menuSlug):
     try:
-        menuItem = getMenuItem(categorySlug, menuSlug)
+        menuItem = getMenuItem(session, categorySlug, menuSlug)
     except NoResultFound:
         abort(404)
 
@@ -146,7 +517,7 @@ def showMenuItem(categorySlug, menuSlug):
 @requires_auth
 def editMenuItem(categorySlug, menuSlug):
     try:
-        menuItem = getMenuItem(categorySlug, menuSlug)
+        menuItem = getMenuItem(session, categorySlug, menuSlug)
     except NoResultFound:
         abort(404)
 
@@ -176,7 +547,11 @@ def editMenuItem(categorySlug, menuSlug):
         menuItem.slug = slug
         menuItem.description = formValues.get('description', None)
         session.add(menuItem)
+        getSearchIndex().update(session, menuItem)
         session.commit()
+        latestItems.updateItem(menuItem)
+        g.wroteMenuItems = True
+        invalidatePages(categorySlug, menuSlug, slug)
         flash('Menu Item: %s was edited' % menuItem.name)
     else:
         abort(405)
@@ -195,7 +570,7 @@ def editMenuItem(categorySlug, menuSlug):
 @requires_auth
 def deleteMenuItem(categorySlug, menuSlug):
     try:
-        menuItem = getMenuItem(categorySlug, menuSlug)
+        menuItem = getMenuItem(session, categorySlug, menuSlug)
     except NoResultFound:
         abort(404)
 
@@ -212,8 +587,16 @@ def deleteMenuItem(categorySlug, menuSlug):
         (request.method == 'DELETE') or
         (request.form.get('_method', None) == 'DELETE')
     ):
+        menuItemId = menuItem.id
+        categoryId = menuItem.category_id
+        getSearchIndex().remove(session, menuItem)
         session.delete(menuItem)
+        session.flush()
+        counters.updateCounters(session, categoryId, -1)
         session.commit()
+        latestItems.removeItem(session, menuItemId, categoryId)
+        g.wroteMenuItems = True
+        invalidatePages(categorySlug, menuSlug)
         flash('Menu Item: %s was deleted' % menuItem.name)
     else:
         abort(405)
@@ -224,11 +607,28 @@ def deleteMenuItem(categorySlug, menuSlug):
     ))
 
 
+@app.route('/search')
+@query_budget(5)
+def searchMenuItems():
+    try:
+        query, page = getSearchArguments()
+    except ValueError:
+        abort(400)
+
+    total, menuItems = findMenuItems(query, page)
+
+    return render_template(
+        'search.html',
+        query=query,
+        menuItems=menuItems,
+        total=total,
+        page=page,
+        numberOfPages=(total + searchPageSize - 1) // searchPageSize
+    )
+
+
 @app.route('/login', methods=['GET'])
 def login():
-    if 'categories' not in login_session:
-        categories = session.query(Category).order_by(Category.name).all()
-        login_session['categories'] = [c.serialize for c in categories]
     state = ''.join(
         random.choice(string.ascii_uppercase + string.digits)
         for x in range(32)
@@ -246,6 +646,7 @@ def login():
 
 
 @app.route('/fbconnect', methods=['POST'])
+@rate_limit(10)
 def fbconnect():
     if request.args.get('state') != login_session['state']:
         response = make_response(json.dumps('Invalid state parameter.'), 401)
@@ -257,26 +658,41 @@ def fbconnect():
     app_id = config.FB_APP_ID
     app_secret = config.FB_APP_SECRET
 
-    url = 'https://graph.facebook.com/oauth/access_token'
-    url += '?grant_type=fb_exchange_token'
-    url += "&client_id={}&client_secret={}&fb_exchange_token={}".format(
-        app_id, app_secret, access_token
-    )
-
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[1]
-    result = json.loads(result)
-    token = result['access_token']
+    try:
+        result = http_client.getJSON(
+            config.FB_GRAPH_URL + '/oauth/access_token',
+            params={
+                'grant_type': 'fb_exchange_token',
+                'client_id': app_id,
+                'client_secret': app_secret,
+                'fb_exchange_token': access_token
+            }
+        )
+        token = result['access_token']
 
-    # Use token to get user info from API
-    userinfo_url = "https://graph.facebook.com/{}/me".format(config.FB_VERSION)
+        # Use token to get user info & picture from API
+        userinfo_url = "{}/{}/me".format(
+            config.FB_GRAPH_URL, config.FB_VERSION
+        )
+        data, picture = http_client.getAllJSON(
+            (
+                userinfo_url,
+                {'access_token': token, 'fields': 'name,id,email'}
+            ),
+            (
+                userinfo_url + '/picture',
+                {
+                    'access_token': token,
+                    'redirect': 0,
+                    'height': 200,
+                    'width': 200
+                }
+            )
+        )
+    except requests.RequestException:
+        return providerUnavailable()
 
-    url = userinfo_url + '?access_token=%s&fields=name,id,email' % token
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[1]
-    # print "url sent for API access:%s"% url
-    # print "API JSON result: %s" % result
-    data = json.loads(result)
+    sessions.regenerateSession(login_session._get_current_object())
     login_session['provider'] = 'facebook'
     login_session['username'] = data["name"]
     login_session['email'] = data["email"]
@@ -285,20 +701,14 @@ def fbconnect():
     # The token must be stored in the login_session in order to properly logout
     login_session['access_token'] = token
 
-    # Get user picture
-    url = userinfo_url + '/picture'
-    url += '?access_token=%s&redirect=0&height=200&width=200' % token
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[1]
-    data = json.loads(result)
-
-    login_session['picture'] = data["data"]["url"]
+    login_session['picture'] = picture["data"]["url"]
 
-    # see if user exists
-    user_id = getUserID(login_session['email'])
-    if not user_id:
-        user_id = createUser(login_session)
-    login_session['user_id'] = user_id
+    # see if user exists, creating it otherwise
+    login_session['user_id'] = userResolver.resolve(
+        login_session['email'],
+        name=login_session['username'],
+        picture=login_session['picture']
+    )
 
     output = ''
     output += '<h1>Welcome, '
@@ -319,16 +729,22 @@ def fbdisconnect():
     facebook_id = login_session['facebook_id']
     # The access token must me included to successfully logout
     access_token = login_session['access_token']
-    url = 'https://graph.facebook.com/{}/permissions?access_token={}'.format(
-        facebook_id, access_token
-    )
+    url = '{}/{}/permissions'.format(config.FB_GRAPH_URL, facebook_id)
+
+    try:
+        result = http_client.request(
+            'DELETE', url, params={'access_token': access_token}
+        )
+    except requests.RequestException:
+        return revokeFailed()
+    if not result.ok:
+        return revokeFailed()
 
-    h = httplib2.Http()
-    h.request(url, 'DELETE')[1]
     return "You have been logged out"
 
 
 @app.route('/gconnect', methods=['POST'])
+@rate_limit(10)
 def gconnect():
     # Validate state token
     if request.args.get('state') != login_session['state']:
@@ -346,7 +762,11 @@ def gconnect():
             scope='',
             redirect_uri='postmessage'
         )
-        credentials = oauth_flow.step2_exchange(code)
+        credentials = oauth_flow.step2_exchange(
+            code, http=http_client.httplib2Client
+        )
+    except requests.RequestException:
+        return providerUnavailable()
     except FlowExchangeError:
         response = make_response(
             json.dumps('Failed to upgrade the authorization code.'),
@@ -356,12 +776,23 @@ def gconnect():
 
         return response
 
-    # Check that the access token is valid.
+    # Check that the access token is valid, while fetching the user info
+    # which is only used once the token has been validated.
     access_token = credentials.access_token
-    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s'
-           % access_token)
-    h = httplib2.Http()
-    result = json.loads(h.request(url, 'GET')[1])
+    try:
+        result, data = http_client.getAllJSON(
+            (
+                config.GOOGLE_API_URL + '/oauth2/v1/tokeninfo',
+                {'access_token': access_token}
+            ),
+            (
+                config.GOOGLE_API_URL + '/oauth2/v1/userinfo',
+                {'access_token': access_token, 'alt': 'json'}
+            )
+        )
+    except requests.RequestException:
+        return providerUnavailable()
+
     # If there was an error in the access token info, abort.
     if result.get('error') is not None:
         response = make_response(json.dumps(result.get('error')), 500)
@@ -394,27 +825,22 @@ def gconnect():
         response.headers['Content-Type'] = 'application/json'
         return response
 
+    sessions.regenerateSession(login_session._get_current_object())
     # Store the access token in the session for later use.
     login_session['access_token'] = credentials.access_token
     login_session['gplus_id'] = gplus_id
     login_session['provider'] = 'google'
 
-    # Get user info
-    userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-    params = {'access_token': credentials.access_token, 'alt': 'json'}
-    answer = requests.get(userinfo_url, params=params)
-
-    data = answer.json()
-
     login_session['username'] = data['name']
     login_session['picture'] = data['picture']
     login_session['email'] = data['email']
 
-    # see if user exists
-    user_id = getUserID(login_session['email'])
-    if not user_id:
-        user_id = createUser(login_session)
-    login_session['user_id'] = user_id
+    # see if user exists, creating it otherwise
+    login_session['user_id'] = userResolver.resolve(
+        login_session['email'],
+        name=login_session['username'],
+        picture=login_session['picture']
+    )
 
     output = ''
     output += '<h1>Welcome, '
@@ -443,14 +869,16 @@ def gdisconnect():
     print('In gdisconnect access token is %s', access_token)
     print('User name is: ')
     print(login_session['username'])
-    url = 'https://accounts.google.com/o/oauth2/revoke?token={}'.format(
-        login_session['access_token']
-    )
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[0]
+    url = config.GOOGLE_ACCOUNTS_URL + '/o/oauth2/revoke'
+    try:
+        result = http_client.request(
+            'GET', url, params={'token': login_session['access_token']}
+        )
+    except requests.RequestException:
+        return revokeFailed()
     print('result is ')
-    print(result)
-    if result['status'] == '200':
+    print(result.status_code)
+    if result.status_code == 200:
         del login_session['access_token']
         del login_session['gplus_id']
         del login_session['username']
@@ -460,11 +888,7 @@ def gdisconnect():
         response.headers['Content-Type'] = 'application/json'
         return response
     else:
-        response = make_response(
-            json.dumps('Failed to revoke token for given user.', 400)
-        )
-        response.headers['Content-Type'] = 'application/json'
-        return response
+        return revokeFailed()
 
 
 # Disconnect based on provider
@@ -483,6 +907,7 @@ def logout():
         del login_session['picture']
         del login_session['user_id']
         del login_session['provider']
+        sessions.regenerateSession(login_session._get_current_object())
         flash("You have successfully been logged out.")
     else:
         flash("You were not logged in")
@@ -493,58 +918,179 @@ def logout():
 # JSON API Routes
 
 @app.route('/catalogue.json')
+@rate_limit(lambda: getCatalogueCost())
+@query_budget(4)
+@conditional(lambda: getCatalogueValidators(session))
 def getAllItemsInCatalogue():
-    try:
-        categories = session.query(Category).options(
-            joinedload(Category.menu_items)
-        ).order_by(desc(Category.created_at)).all()
+    """
+        Dumps the whole catalogue.
+
+        By default the response is streamed straight from a server-side
+        cursor so the catalogue is never held in memory as a whole.
+        When `after` and/or `limit` are given, a page of `limit` categories
+        whose id is greater than `after` is returned along with the cursor
+        for the next page instead.
+
+        The menu items are encoded as arrays when `compact=1` is given
+        (@see app/serializers.py).
+    """
+    if 'after' in request.args or 'limit' in request.args:
+        return getCataloguePage(session)
+
+    if not hasCategories(session):
+        return noCategoriesFound()
+
+    return Response(
+        ratelimit.admission.track(streamCatalogue(
+            config.JSON_STREAM_CHUNK_SIZE,
+            session.get_bind(),
+            compact=isCompactRequested()
+        )),
+        mimetype='application/json'
+    )
 
-        if categories in emptyValues:
-            raise NoResultFound
-    except NoResultFound:
+
+def getCatalogueCost():
+    """A page of the catalogue costs far less than the whole of it."""
+    if 'after' in request.args or 'limit' in request.args:
+        return 2
+
+    return 20
+
+
+def hasCategories(dbSession):
+    return dbSession.query(Category.id).first() is not None
+
+
+def noCategoriesFound():
+    response = {
+        'message': 'No Categories found in the system.'
+    }
+
+    return jsonify(response), 400
+
+
+def getCataloguePage(dbSession):
+    try:
+        after = int(request.args.get('after', 0))
+        limit = int(request.args.get('limit', maxCataloguePageSize))
+        if after < 0 or not (0 < limit <= maxCataloguePageSize):
+            raise ValueError
+    except ValueError:
         response = {
-            'message': 'No Categories found in the system.'
+            'message': '"after" must be a category id & "limit" must be '
+                       'between 1 and %d.' % maxCataloguePageSize
         }
         return jsonify(response), 400
-    response = []
+
+    categoryTable = Category.__table__
+    menuItemTable = MenuItem.__table__
+    categories = [
+        serializers.serializeRow(row) for row in dbSession.execute(
+            serializers.selectCategories().where(
+                categoryTable.c.id > after
+            ).order_by(categoryTable.c.id).limit(limit)
+        )
+    ]
+
+    compact = isCompactRequested()
+    menuItems = {}
+    if categories not in emptyValues:
+        for row in dbSession.execute(
+            serializers.selectMenuItems().where(
+                menuItemTable.c.category_id.in_([c['id'] for c in categories])
+            ).order_by(desc(menuItemTable.c.created_at), menuItemTable.c.id)
+        ):
+            menuItem = serializers.serializeRow(row)
+            menuItems.setdefault(row.category_id, []).append(
+                serializers.compactMenuItem(menuItem) if compact else menuItem
+            )
+
     for category in categories:
-        menuItems = [m.serialize for m in category.menu_items]
-        category = category.serialize
-        category['menu_items'] = menuItems
-        response.append(category)
+        category['menu_items'] = menuItems.get(category['id'], [])
+
+    nextAfter = None
+    nextPage = None
+    if len(categories) == limit:
+        nextAfter = categories[-1]['id']
+        nextPage = url_for(
+            'getAllItemsInCatalogue',
+            after=nextAfter,
+            limit=limit,
+            **getCompactArguments(compact)
+        )
 
-    return jsonify(categories=response)
+    return jsonResponse(
+        categories=categories,
+        next_after=nextAfter,
+        next=nextPage,
+        **getMenuItemFields(compact)
+    )
 
 
 @app.route('/catalogue.json/<string:categorySlug>')
+@rate_limit(2)
+@query_budget(3)
+@conditional(
+    lambda categorySlug: getCategoryValidators(session, categorySlug)
+)
 def getCategoryJSON(categorySlug):
-    try:
-        category = session.query(Category).filter_by(
-            slug=categorySlug
-        ).options(
-            joinedload(Category.menu_items)
-        ).one()
+    return getCategoryDocument(session, categorySlug)
 
-        if category in emptyValues:
-            raise NoResultFound
-    except NoResultFound:
+
+def getCategoryDocument(dbSession, categorySlug):
+    rows = dbSession.execute(
+        serializers.selectCatalogueRows(categorySlug=categorySlug)
+    ).fetchall()
+    if rows in emptyValues:
         response = {
             'message': "No Category %s found in the system." % categorySlug
         }
 
         return jsonify(response), 400
 
-    menuItems = [m.serialize for m in category.menu_items]
-    response = category.serialize
-    response['menu_items'] = menuItems
+    compact = isCompactRequested()
+    fields = ''
+    if compact:
+        fields = ',"menu_item_fields":%s' % serializers.dumpJSON(
+            serializers.menuItemFields
+        )
 
-    return jsonify(category=response)
+    return Response(
+        '{"category":%s%s}\n' % (
+            ''.join(serializers.encodeCategories([rows], compact=compact)),
+            fields
+        ),
+        mimetype='application/json'
+    )
 
 
 @app.route('/catalogue.json/<string:categorySlug>/<string:menuSlug>')
+@rate_limit(1)
+@query_budget(4)
+@conditional(
+    lambda categorySlug, menuSlug: getMenuItemValidators(
+        session, categorySlug, menuSlug
+    )
+)
 def showMenuItemJSON(categorySlug, menuSlug):
+    return getMenuItemDocument(session, categorySlug, menuSlug)
+
+
+def getMenuItemDocument(dbSession, categorySlug, menuSlug):
+    def load(menuItemId):
+        return dbSession.execute(lambda_stmt(
+            lambda: serializers.selectMenuItems().join_from(
+                MenuItem, Category, MenuItem.category_id == Category.id
+            ).where(
+                MenuItem.id == menuItemId,
+                MenuItem.slug == menuSlug,
+                Category.slug == categorySlug
+            )
+        )).first()
+
     try:
-        menuItem = getMenuItem(categorySlug, menuSlug)
+        row = loadByMenuItemId(dbSession, categorySlug, menuSlug, load)
     except NoResultFound:
         response = {
             'message': 'No result found.'
@@ -552,48 +1098,536 @@ def showMenuItemJSON(categorySlug, menuSlug):
 
         return jsonify(response), 404
 
-    return jsonify(menu_item=menuItem.serialize)
+    return jsonResponse(menu_item=serializers.serializeRow(row))
+
+
+@app.route('/search.json')
+@rate_limit(2)
+@query_budget(5)
+def searchMenuItemsJSON():
+    try:
+        query, page = getSearchArguments()
+    except ValueError:
+        response = {
+            'message': '"page" must be a positive number.'
+        }
+        return jsonify(response), 400
+
+    total, ids = getSearchIndex().search(
+        session, query, (page - 1) * searchPageSize, searchPageSize
+    )
+    compact = isCompactRequested()
+    menuItems = {}
+    if ids not in emptyValues:
+        menuItems = {
+            row.id: serializers.serializeRow(row)
+            for row in session.execute(serializers.selectMenuItems().where(
+                MenuItem.__table__.c.id.in_(ids)
+            ))
+        }
+        if compact:
+            menuItems = {
+                i: serializers.compactMenuItem(m) for i, m in menuItems.items()
+            }
+
+    nextPage = None
+    if page * searchPageSize < total:
+        nextPage = url_for(
+            'searchMenuItemsJSON',
+            q=query,
+            page=page + 1,
+            **getCompactArguments(compact)
+        )
+
+    return jsonResponse(
+        query=query,
+        total=total,
+        page=page,
+        menu_items=[menuItems[i] for i in ids if i in menuItems],
+        next=nextPage,
+        **getMenuItemFields(compact)
+    )
+
+
+# Feed Routes
+
+@app.route('/feeds/latest.<any(atom, json):feedFormat>')
+@query_budget(2)
+@conditional(
+    lambda feedFormat: getFeedValidators(feedFormat, getFeedEntries(session))
+)
+def getLatestItemsFeed(feedFormat):
+    """Feed of the newest menu items of the catalogue."""
+    return renderFeed(
+        feedFormat,
+        'Latest Items',
+        url_for('home', _external=True),
+        getFeedEntries(session)
+    )
+
+
+@app.route(
+    '/feeds/categories/<string:categorySlug>.<any(atom, json):feedFormat>'
+)
+@query_budget(2)
+@conditional(
+    lambda categorySlug, feedFormat: getCategoryFeedValidators(
+        categorySlug, feedFormat
+    )
+)
+def getCategoryFeed(categorySlug, feedFormat):
+    """Feed of the newest menu items of a category."""
+    category = findCategory(categorySlug)
+    if category is None:
+        abort(404)
+
+    return renderFeed(
+        feedFormat,
+        '%s Items' % category['name'],
+        url_for(
+            'showMenuItemsInACategory',
+            categorySlug=categorySlug,
+            _external=True
+        ),
+        getFeedEntries(session, category['id'])
+    )
+
+
+def getFeedEntries(dbSession, categoryId=None):
+    """
+        Returns the entries of a feed, read once per request from the
+        database for visitors who changed menu items lately.
+    """
+    if not readsOwnWrites():
+        return latestItems.get(dbSession, categoryId)
+
+    feeds = g.setdefault('feeds', {})
+    if categoryId not in feeds:
+        feeds[categoryId] = latestItems.load(dbSession, categoryId)
+
+    return feeds[categoryId]
+
+
+@app.route('/cache.json')
+def getCacheStats():
+    return jsonify(
+        fragments=fragmentCache.stats(),
+        feeds=latestItems.cache.stats(),
+        categories=categoryCache.stats(),
+        pages=pageCache.stats(),
+        menu_item_ids=menuItemIdCache.stats(),
+        user_ids=userResolver.cache.stats()
+    )
 
 
 # Helper Functions
 
 
-def createUser(login_session):
-    newUser = User(
-        name=login_session.get('username'),
-        email=login_session.get('email'),
-        picture=login_session.get('picture')
+def revokeFailed():
+    response = make_response(
+        json.dumps('Failed to revoke token for given user.'),
+        400
     )
-    session.add(newUser)
-    session.commit()
-    user = session.query(User).filter_by(email=login_session['email']).one()
+    response.headers['Content-Type'] = 'application/json'
 
-    return user.id
+    return response
 
 
-def getUserID(email):
-    try:
-        user = session.query(User).filter_by(email=email).one()
-        if user in emptyValues:
-            raise NoResultFound
+def providerUnavailable():
+    response = make_response(
+        json.dumps('Failed to reach the login provider.'),
+        502
+    )
+    response.headers['Content-Type'] = 'application/json'
 
-        return user.id
-    except NoResultFound:
+    return response
+
+
+def jsonResponse(**values):
+    """
+        Same response as `jsonify(**values)`, encoded by the faster
+        `serializers.dumpJSON`.
+    """
+    return Response(
+        serializers.dumpJSON(values) + '\n', mimetype='application/json'
+    )
+
+
+def isCompactRequested():
+    """Whether the menu items of a JSON response are to be compact."""
+    return request.args.get('compact', '').lower() in ['1', 'true']
+
+
+def getCompactArguments(compact):
+    """Query arguments keeping the next page as compact as this one."""
+    return {'compact': 1} if compact else {}
+
+
+def getMenuItemFields(compact):
+    """Lists the fields of the compact menu items in the response."""
+    return {'menu_item_fields': serializers.menuItemFields} if compact else {}
+
+
+def invalidatePages(categorySlug, *menuSlugs):
+    """
+        Drops the cached pages showing the menu items of a category: the
+        home page's latest items, the category page & the given item pages.
+    """
+    pageCache.delete(
+        'home',
+        'category:' + categorySlug,
+        *[getMenuItemPageKey(categorySlug, m) for m in menuSlugs]
+    )
+
+
+def streamCatalogue(chunkSize, engine, compact=False):
+    """
+        Yields the catalogue as JSON in the same shape & key order as
+        `jsonify(categories=...)`, encoding `chunkSize` rows at a time.
+
+        The rows are read through a server-side cursor on a connection of
+        its own to `engine`, as the response is streamed after the request
+        is over.
+    """
+    with engine.connect() as connection:
+        rows = connection.execution_options(
+            stream_results=True
+        ).execute(serializers.selectCatalogueRows())
+
+        for output in serializers.encodeCatalogue(
+            serializers.fetchChunks(rows, chunkSize), compact=compact
+        ):
+            yield output
+
+
+def getSearchIndex():
+    """Returns the search backend, which is picked on first use."""
+    global searchIndex
+    if searchIndex is None:
+        with config.engine.connect() as connection:
+            searchIndex = search.getSearchIndex(connection)
+
+    return searchIndex
+
+
+def getSearchArguments():
+    query = request.args.get('q', '').strip(" \t\n\r")
+    page = int(request.args.get('page', 1))
+    if page < 1:
+        raise ValueError
+
+    return query, page
+
+
+def findMenuItems(query, page):
+    """
+        Returns the number of menu items matching `query` & the menu items
+        on the given page of results, best matches first.
+    """
+    total, ids = getSearchIndex().search(
+        session, query, (page - 1) * searchPageSize, searchPageSize
+    )
+    if ids in emptyValues:
+        return total, []
+
+    menuItems = {
+        m.id: m for m in session.query(MenuItem).filter(
+            MenuItem.id.in_(ids)
+        ).options(joinedload(MenuItem.category))
+    }
+
+    return total, [menuItems[i] for i in ids if i in menuItems]
+
+
+def getCategories(dbSession):
+    """
+        Returns all the categories ordered by name, out of `categoryCache`
+        whenever possible.
+    """
+    return getCategoryList(dbSession)[1]
+
+
+def getCategoryList(dbSession):
+    """
+        Returns a (version, categories) pair: all the categories ordered by
+        name & a digest of them, which changes along with any of them.
+    """
+    categoryList = categoryCache.get('list')
+    if categoryList is None:
+        categories = [
+            c.serialize
+            for c in dbSession.query(Category).order_by(Category.name)
+        ]
+        version = hashlib.sha1(
+            serializers.dumpJSON(categories).encode('utf-8')
+        ).hexdigest()
+        categoryList = (version, categories)
+        categoryCache.set('list', categoryList)
+
+    return categoryList
+
+
+def findCategory(categorySlug):
+    """Returns the category with the given slug, out of `getCategories`."""
+    for category in getCategories(session):
+        if category['slug'] == categorySlug:
+            return category
+
+    return None
+
+
+def renderFeed(feedFormat, title, homePageUrl, entries):
+    """Returns the feed of `entries` as Atom or as JSON Feed."""
+    feedUrl = url_for(
+        request.endpoint, _external=True, **request.view_args
+    )
+    items = feeds.makeFeedItems(entries, lambda entry: url_for(
+        'showMenuItem',
+        categorySlug=entry['category']['slug'],
+        menuSlug=entry['slug'],
+        _external=True
+    ))
+
+    if feedFormat == 'json':
+        return Response(
+            serializers.dumpJSON(
+                feeds.makeJSONFeed(title, homePageUrl, feedUrl, items)
+            ) + '\n',
+            mimetype='application/feed+json'
+        )
+
+    updatedAt = feeds.getUpdatedAt(entries)
+    return Response(
+        render_template(
+            'feed.xml',
+            title=title,
+            homePageUrl=homePageUrl,
+            feedUrl=feedUrl,
+            updated=feeds.formatTimestamp(updatedAt or datetime.utcnow()),
+            items=items
+        ),
+        mimetype='application/atom+xml'
+    )
+
+
+def getFeedValidators(feedFormat, entries):
+    """
+        Validators of a feed, out of the ids & the modification times of
+        its entries, without querying the database. Like the other lists,
+        feeds have no last modified time @see makeValidators
+    """
+    row = [feedFormat] + [
+        (e['id'], e['category']['name'], e['updated_at'] or e['created_at'])
+        for e in entries
+    ]
+
+    return makeValidators(row)
+
+
+def getCategoryFeedValidators(categorySlug, feedFormat):
+    category = findCategory(categorySlug)
+    if category is None:
+        return None
+
+    return getFeedValidators(
+        feedFormat, getFeedEntries(session, category['id'])
+    )
+
+
+def getCatalogueValidators(dbSession):
+    """
+        Validators of the whole catalogue, out of a single aggregate query
+        over both the `categories` & the `menu_items` tables.
+    """
+    row = dbSession.execute(select(
+        getModificationAggregates(Category.__table__) +
+        getModificationAggregates(MenuItem.__table__)
+    )).first()
+
+    return makeValidators(row)
+
+
+def getCategoryValidators(dbSession, categorySlug):
+    categories = Category.__table__
+    menuItems = MenuItem.__table__
+    row = dbSession.execute(select(
+        getModificationAggregates(
+            categories, categories.c.slug == categorySlug
+        ) +
+        getModificationAggregates(
+            menuItems,
+            menuItems.c.category_id == select([categories.c.id]).where(
+                categories.c.slug == categorySlug
+            ).scalar_subquery()
+        )
+    )).first()
+
+    if not row[0]:
+        return None
+
+    return makeValidators(row)
+
+
+def getMenuItemValidators(dbSession, categorySlug, menuSlug):
+    menuItemId = resolveMenuItemId(dbSession, categorySlug, menuSlug)
+    if menuItemId is None:
+        return None
+
+    menuItems = MenuItem.__table__
+    row = dbSession.execute(select([
+        menuItems.c.id,
+        menuItems.c.category_id,
+        func.coalesce(menuItems.c.updated_at, menuItems.c.created_at)
+    ]).where(
+        (menuItems.c.id == menuItemId) & (menuItems.c.slug == menuSlug)
+    )).first()
+
+    if row is None:
         return None
 
+    return makeValidators(row, [row[2]])
+
 
-def getMenuItem(categorySlug, menuSlug):
-    menuItem = session.query(MenuItem).filter_by(
-        slug=menuSlug
-    ).options(joinedload(MenuItem.category)).one()
+def getModificationAggregates(table, whereclause=None):
+    """
+        Returns the row count, the highest id & the latest modification
+        time of (the matching rows of) `table` as scalar subqueries.
 
-    if menuItem in emptyValues or menuItem.category.slug != categorySlug:
-        raise NoResultFound
+        Together they change whenever a row is added, edited or deleted.
+    """
+    aggregates = []
+    for name, aggregate in [
+        ('count', func.count(table.c.id)),
+        ('max_id', func.max(table.c.id)),
+        ('modified_at', func.max(
+            func.coalesce(table.c.updated_at, table.c.created_at)
+        ))
+    ]:
+        query = select([aggregate])
+        if whereclause is not None:
+            query = query.where(whereclause)
+        aggregates.append(query.label(table.name + '_' + name))
+
+    return aggregates
+
+
+def makeValidators(row, timestamps=()):
+    """
+        Makes an (etag, last modified) pair out of a row of aggregates.
+
+        The query string is part of the etag as it changes the payload.
+        Since deleting a row does not move any timestamp, only the etag
+        reliably reflects deletions: responses listing several rows are
+        given no `timestamps`, & so no last modified time, lest a deletion
+        be answered with a stale `304` to `If-Modified-Since`.
+    """
+    etag = hashlib.sha1(
+        repr((tuple(row), request.query_string)).encode('utf-8')
+    ).hexdigest()
+    timestamps = [t for t in timestamps if t is not None]
+
+    return etag, (max(timestamps) if timestamps else None)
+
+
+def getMenuItem(dbSession, categorySlug, menuSlug):
+    """
+        Returns the menu item at the given slugs. Its category is loaded
+        along with it, so `menuItem.category` does not run another query.
+    """
+    def load(menuItemId):
+        return dbSession.execute(lambda_stmt(
+            lambda: select(MenuItem, Category).join(
+                Category, MenuItem.category_id == Category.id
+            ).where(
+                MenuItem.id == menuItemId,
+                MenuItem.slug == menuSlug,
+                Category.slug == categorySlug
+            )
+        )).first()
+
+    return loadByMenuItemId(dbSession, categorySlug, menuSlug, load).MenuItem
+
+
+def loadByMenuItemId(dbSession, categorySlug, menuSlug, load):
+    """
+        Resolves the slugs to a menu item id & returns `load(menuItemId)`,
+        which returns `None` unless the menu item is still at these slugs.
+    """
+    for attempt in range(2):
+        menuItemId = resolveMenuItemId(dbSession, categorySlug, menuSlug)
+        if menuItemId is None:
+            break
+
+        loaded = load(menuItemId)
+        if loaded not in emptyValues:
+            return loaded
+
+        # The cached id is stale, e.g. the item was renamed by another
+        # process, so it is looked up again
+        menuItemIdCache.delete(getMenuItemIdKey(categorySlug, menuSlug))
+
+    raise NoResultFound
+
+
+def resolveMenuItemId(dbSession, categorySlug, menuSlug):
+    """
+        Returns the id of the menu item at the given slugs (or `None`), out
+        of `menuItemIdCache` whenever possible.
+
+        The lookup only selects the id, filtering by both slugs in SQL, &
+        is built as a lambda statement so that SQLAlchemy caches its
+        compiled form instead of building it anew on every call.
+    """
+    key = getMenuItemIdKey(categorySlug, menuSlug)
+    menuItemId = menuItemIdCache.get(key)
+    if menuItemId is None:
+        menuItemId = dbSession.execute(lambda_stmt(
+            lambda: select(MenuItem.id).join(
+                Category, MenuItem.category_id == Category.id
+            ).where(
+                MenuItem.slug == menuSlug, Category.slug == categorySlug
+            )
+        )).scalar()
+        if menuItemId is not None:
+            menuItemIdCache.set(key, menuItemId)
+
+    return menuItemId
+
+
+def getMenuItemIdKey(categorySlug, menuSlug):
+    # Slugs come from url segments, which never contain a "/"
+    return '%s/%s' % (categorySlug, menuSlug)
+
+
+# Application Factory
+
+
+def create_app(warmUp=False):
+    """
+        Returns the app, ready to be served by any WSGI server.
 
-    return menuItem
+        With `warmUp`, every template is compiled & the caches are primed
+        beforehand so the first requests are not slower than the others.
+    """
+    if warmUp:
+        warmUpApp()
+
+    return app
+
+
+def warmUpApp():
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    with app.app_context():
+        getCategories(session)
+        latestItems.seed(session)
+        index = getSearchIndex()
+        if isinstance(index, search.InvertedIndex) and not index.built:
+            index.rebuild(session)
+        session.remove()
 
 
 if __name__ == '__main__':
-    app.secret_key = config.APP_SECRET_KEY
     app.debug = True
     app.run(host=config.APP_HOST, port=config.APP_PORT)
@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+"""
+    Rate limiting & load shedding.
+
+    Every client (a logged in user, or else an IP address) has a token
+    bucket holding up to `RATE_LIMIT_BURST` tokens, refilled at
+    `RATE_LIMIT_RATE` tokens per second. Each request to a route decorated
+    with `@rate_limit(cost)` takes `cost` tokens from it & is answered with
+    a `429 Too Many Requests` when there are not enough left.
+
+    Independently, any request is answered with a `503 Service Unavailable`
+    while the process is already serving `APP_MAX_CONCURRENCY` requests,
+    instead of letting more requests queue up for a database connection.
+"""
+
+
+import cache
+from collections import OrderedDict
+import config
+from flask import Response, g, request, session as login_session
+from functools import wraps
+import json
+import math
+import threading
+import time
+
+
+class Limiter(object):
+    """Interface of the token bucket backends."""
+
+    def take(self, key, cost, rate, burst):
+        """
+            Takes `cost` tokens from the bucket of `key`. Returns whether
+            there were enough of them & otherwise the number of seconds
+            until there will be.
+        """
+        raise NotImplementedError
+
+
+def refill(tokens, updatedAt, now, rate, burst):
+    return min(burst, tokens + max(0, now - updatedAt) * rate)
+
+
+def takeTokens(tokens, cost, rate):
+    """Returns the tokens left, whether `cost` was taken & the wait."""
+    if tokens >= cost:
+        return tokens - cost, True, 0
+
+    return tokens, False, (cost - tokens) / rate
+
+
+class LocalLimiter(Limiter):
+    """
+        Keeps the buckets in the process, i.e. every process of the app
+        limits the clients on its own. At most `maxsize` buckets are kept,
+        the least recently used ones are dropped (as if they were full).
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        # key => (tokens, time they were counted at)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        now = time.time()
+        with self._lock:
+            tokens, updatedAt = self._buckets.pop(key, (burst, now))
+            tokens, allowed, wait = takeTokens(
+                refill(tokens, updatedAt, now, rate, burst), cost, rate
+            )
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+
+        return allowed, wait
+
+
+class SharedLimiter(Limiter):
+    """
+        Keeps the buckets in a store shared by all the processes of the app.
+
+        With a redis client the bucket is updated atomically by a Lua
+        script. Other clients (e.g. the in-process `cache.LocalStore`
+        stand-in) only need `get` & `set(name, value, ex=None)`, & are
+        updated under a lock of this process.
+    """
+    script = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local cost = tonumber(ARGV[3])
+        local now = tonumber(ARGV[4])
+        local tokens = burst
+        local state = redis.call('GET', KEYS[1])
+        if state then
+            local separator = string.find(state, ':')
+            local updatedAt = tonumber(string.sub(state, separator + 1))
+            tokens = tonumber(string.sub(state, 1, separator - 1))
+            tokens = math.min(
+                burst, tokens + math.max(0, now - updatedAt) * rate
+            )
+        end
+        local allowed = 0
+        if tokens >= cost then
+            tokens = tokens - cost
+            allowed = 1
+        end
+        redis.call(
+            'SET', KEYS[1], tostring(tokens) .. ':' .. ARGV[4],
+            'EX', math.ceil(burst / rate) + 1
+        )
+        return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, client, namespace='ratelimit'):
+        self.client = client
+        self.namespace = namespace
+        self._script = None
+        if hasattr(client, 'register_script'):
+            self._script = client.register_script(self.script)
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        key = '{}:{}'.format(self.namespace, key)
+        now = time.time()
+        # Buckets are forgotten once they would be full again anyway
+        ttl = int(math.ceil(burst / rate)) + 1
+
+        if self._script is not None:
+            allowed, tokens = self._script(
+                keys=[key], args=[rate, burst, cost, repr(now)]
+            )
+            tokens = float(tokens)
+            if allowed:
+                return True, 0
+            return False, (cost - tokens) / rate
+
+        with self._lock:
+            tokens = burst
+            state = self.client.get(key)
+            if state is not None:
+                if isinstance(state, bytes):
+                    state = state.decode('ascii')
+                tokens, updatedAt = [float(v) for v in state.split(':')]
+                tokens = refill(tokens, updatedAt, now, rate, burst)
+            tokens, allowed, wait = takeTokens(tokens, cost, rate)
+            self.client.set(key, '%r:%r' % (tokens, now), ex=ttl)
+
+        return allowed, wait
+
+
+def makeLimiter():
+    """Returns the limiter using the backend set in `RATE_LIMIT_BACKEND`."""
+    if config.RATE_LIMIT_BACKEND == 'local':
+        return LocalLimiter()
+    elif config.RATE_LIMIT_BACKEND == 'shared':
+        return SharedLimiter(cache.getSharedClient())
+
+    raise RuntimeError(
+        'Unsupported rate limit backend "{}" provided.'.format(
+            config.RATE_LIMIT_BACKEND
+        )
+    )
+
+
+limiter = makeLimiter()
+
+
+def rate_limit(cost=1):
+    """
+        Takes `cost` tokens from the client's bucket before calling the view,
+        or answers `429 Too Many Requests` when there are not enough left.
+
+        `cost` may also be a function receiving the view's arguments, for
+        views whose cost depends on the request.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not config.RATE_LIMIT_ENABLED:
+                return f(*args, **kwargs)
+
+            allowed, wait = limiter.take(
+                getClientKey(),
+                cost(*args, **kwargs) if callable(cost) else cost,
+                config.RATE_LIMIT_RATE,
+                config.RATE_LIMIT_BURST
+            )
+            if not allowed:
+                return makeRejection(
+                    429, 'Too many requests, please slow down.', wait
+                )
+
+            return f(*args, **kwargs)
+
+        return decorated
+
+    return decorator
+
+
+def getClientKey():
+    """Logged in users are limited as such, other visitors by IP address."""
+    if 'user_id' in login_session:
+        return 'user:{}'.format(login_session['user_id'])
+
+    return 'ip:{}'.format(request.remote_addr)
+
+
+def makeRejection(status, message, retryAfter):
+    response = Response(
+        json.dumps({'message': message}),
+        status=status,
+        mimetype='application/json'
+    )
+    response.headers['Retry-After'] = str(max(1, int(math.ceil(retryAfter))))
+
+    return response
+
+
+class AdmissionControl(object):
+    """
+        Counts the requests being served by the process & refuses new ones
+        while `maxConcurrency` of them already are, so that requests are
+        shed before the connection pool of the database is exhausted rather
+        than queuing for it.
+    """
+
+    def __init__(self, maxConcurrency):
+        self.maxConcurrency = maxConcurrency
+        self.inFlight = 0
+        self._lock = threading.Lock()
+
+    def admit(self):
+        with self._lock:
+            if self.inFlight >= self.maxConcurrency:
+                return False
+            self.inFlight += 1
+
+        return True
+
+    def release(self):
+        with self._lock:
+            self.inFlight -= 1
+
+    def track(self, chunks):
+        """
+            Counts a streamed response, whose chunks are produced after the
+            request is over, as served until it has been sent.
+        """
+        with self._lock:
+            self.inFlight += 1
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            self.release()
+
+
+admission = AdmissionControl(config.APP_MAX_CONCURRENCY)
+# Set in the environ of the requests served by the asynchronous views, which
+# are admitted by app/asgi.py against `ASGI_MAX_CONCURRENCY` instead
+asyncRequestKey = 'catalogue.async'
+
+
+def init_app(app):
+    """Sheds the requests of `app` above `APP_MAX_CONCURRENCY`, if set."""
+    if config.APP_MAX_CONCURRENCY > 0:
+        app.before_request(admitRequest)
+        app.teardown_request(releaseRequest)
+
+
+def admitRequest():
+    # Static files never need the database
+    if request.endpoint == 'static' or asyncRequestKey in request.environ:
+        return None
+
+    if not admission.admit():
+        return makeRejection(
+            503, 'The server is busy, please try again.', retryAfter=1
+        )
+    g.admitted = True
+
+
+def releaseRequest(exception=None):
+    if g.pop('admitted', False):
+        admission.release()
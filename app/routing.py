@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+"""
+    Routes the queries of read-only requests to the read replicas.
+
+    The session of a GET, HEAD or OPTIONS request reads from one of the
+    replicas configured in `DB_REPLICA_URLS`, picked according to
+    `DB_REPLICA_STRATEGY`. Everything else goes to the primary: the queries
+    of any other request, anything flushed & everything read after a flush.
+
+    A visitor who wrote something is pinned to the primary for
+    `DB_PRIMARY_PIN_SECONDS` (with a cookie), so the page they are
+    redirected to shows their change even if the replicas lag behind.
+"""
+
+
+import config
+from flask import g, has_request_context, request
+import itertools
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import threading
+import time
+
+
+pinCookieName = 'read_primary'
+readOnlyMethods = ['GET', 'HEAD', 'OPTIONS']
+
+
+class ReplicaSet(object):
+    """
+        Picks the replica to read from, in turn (`round_robin`) or the one
+        whose queries have been the fastest lately (`least_latency`).
+    """
+    # Weight of the latest query in the moving average of the latency
+    smoothing = 0.2
+
+    def __init__(self, engines, strategy):
+        if strategy not in ['round_robin', 'least_latency']:
+            raise RuntimeError(
+                'Unsupported replica strategy "{}" provided.'.format(strategy)
+            )
+
+        self.engines = list(engines)
+        self.strategy = strategy
+        # engine => moving average of its query latency in seconds
+        self.latencies = {engine: 0.0 for engine in self.engines}
+        self._cycle = itertools.cycle(self.engines)
+        self._lock = threading.Lock()
+
+        if strategy == 'least_latency':
+            for engine in self.engines:
+                event.listen(engine, 'before_cursor_execute', startQuery)
+                event.listen(engine, 'after_cursor_execute', self.endQuery)
+
+    def pick(self):
+        """Returns the engine of a replica, or `None` if there is none."""
+        if not self.engines:
+            return None
+
+        with self._lock:
+            if self.strategy == 'round_robin':
+                return next(self._cycle)
+
+            return min(self.engines, key=self.latencies.get)
+
+    def endQuery(self, connection, cursor, statement, parameters, context,
+                 executemany):
+        elapsed = time.perf_counter() - connection.info['replica_start'].pop()
+        engine = connection.engine
+        with self._lock:
+            self.latencies[engine] += (
+                (elapsed - self.latencies[engine]) * self.smoothing
+            )
+
+
+def startQuery(connection, cursor, statement, parameters, context,
+               executemany):
+    connection.info.setdefault('replica_start', []).append(
+        time.perf_counter()
+    )
+
+
+replicas = ReplicaSet(config.replicaEngines, config.DB_REPLICA_STRATEGY)
+
+
+class RoutingSession(Session):
+    """
+        Session reading from a replica while `info['read_only']` is set.
+
+        A single replica is used for the whole session, so that a request
+        sees a consistent state of the database.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.info.get('read_only') and not self._flushing:
+            if 'replica' not in self.info:
+                self.info['replica'] = replicas.pick()
+            if self.info['replica'] is not None:
+                return self.info['replica']
+
+        return super(RoutingSession, self).get_bind(
+            mapper=mapper, clause=clause, **kwargs
+        )
+
+
+def init_app(app, sessionFactory, scopedSession):
+    """
+        Routes the queries run through `scopedSession` (made by the
+        `sessionFactory` sessionmaker of `RoutingSession`) in `app`.
+    """
+    if not replicas.engines:
+        return
+
+    event.listen(sessionFactory, 'after_flush', usePrimary)
+
+    @app.before_request
+    def routeReads():
+        scopedSession().info['read_only'] = (
+            request.method in readOnlyMethods and
+            pinCookieName not in request.cookies
+        )
+
+    @app.after_request
+    def pinToPrimary(response):
+        if g.pop('wrotePrimary', False):
+            response.set_cookie(
+                pinCookieName,
+                '1',
+                max_age=config.DB_PRIMARY_PIN_SECONDS,
+                httponly=True
+            )
+
+        return response
+
+
+def usePrimary(dbSession, flushContext):
+    """Sends the next reads of the session & of the visitor to the primary."""
+    dbSession.info['read_only'] = False
+    if has_request_context():
+        g.wrotePrimary = True
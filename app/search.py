@@ -0,0 +1,439 @@
+#!/usr/bin/python3
+"""
+    Full-text search over the name & description of the menu items.
+
+    The native full-text search of the database is used where it is
+    available: an FTS5 table on SQLite & a GIN index over a tsvector
+    expression on PostgreSQL (both created by `app/migrate.py`). Otherwise
+    an inverted index is built in-process on first use.
+
+    Usage:
+        python3 app/search.py rebuild
+            Rebuilds the search index from the `menu_items` table.
+        python3 app/search.py benchmark [--items N] [--backends ...]
+            Fills a temporary SQLite database with N made up menu items
+            (1M by default) & reports the time taken by queries matching
+            few, some & most of them with the FTS5 table (`fts5`) & the
+            in-process inverted index (`memory`).
+"""
+
+
+from collections import defaultdict
+import heapq
+import math
+from models import MenuItem
+import re
+from sqlalchemy import inspect, select, text
+import threading
+
+
+ftsTableName = 'menu_items_fts'
+ginIndexName = 'ix_menu_items_search'
+# Matches of the name weigh more than matches of the description
+tsvectorExpression = (
+    "setweight(to_tsvector('english', name), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+
+def tokenize(value):
+    return re.findall(r'\w+', (value or '').lower())
+
+
+class SearchIndex(object):
+    """
+        Interface of the search backends.
+
+        `add`, `update` & `remove` are called with the menu item being
+        changed before the session's transaction is committed, `commit`
+        once it has been committed & `rollback` if it was rolled back.
+    """
+
+    def search(self, session, query, offset, limit):
+        """
+            Returns the number of menu items matching every word of `query`
+            & the ids of `limit` of them, best matches first, skipping the
+            first `offset` ones.
+        """
+        raise NotImplementedError
+
+    def add(self, session, menuItem):
+        pass
+
+    def update(self, session, menuItem):
+        self.remove(session, menuItem)
+        self.add(session, menuItem)
+
+    def remove(self, session, menuItem):
+        pass
+
+    def commit(self, session):
+        pass
+
+    def rollback(self, session):
+        pass
+
+    def rebuild(self, connection):
+        pass
+
+
+class SqliteSearchIndex(SearchIndex):
+    """Searches the FTS5 table holding the name & description of items."""
+
+    def search(self, session, query, offset, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return 0, []
+
+        # Every word is quoted so that no FTS5 query syntax gets through
+        match = ' '.join('"%s"' % token for token in tokens)
+        total = session.execute(
+            text(
+                'SELECT count(*) FROM {0} WHERE {0} MATCH :match'.format(
+                    ftsTableName
+                )
+            ),
+            {'match': match}
+        ).scalar()
+        ids = [row[0] for row in session.execute(
+            text(
+                'SELECT rowid FROM {0} WHERE {0} MATCH :match '
+                'ORDER BY bm25({0}, 10.0, 1.0), rowid DESC '
+                'LIMIT :limit OFFSET :offset'.format(ftsTableName)
+            ),
+            {'match': match, 'limit': limit, 'offset': offset}
+        )]
+
+        return total, ids
+
+    def add(self, session, menuItem):
+        session.execute(
+            text(
+                'INSERT INTO {} (rowid, name, description) '
+                'VALUES (:id, :name, :description)'.format(ftsTableName)
+            ),
+            {
+                'id': menuItem.id,
+                'name': menuItem.name,
+                'description': menuItem.description
+            }
+        )
+
+    def remove(self, session, menuItem):
+        session.execute(
+            text('DELETE FROM {} WHERE rowid = :id'.format(ftsTableName)),
+            {'id': menuItem.id}
+        )
+
+    def rebuild(self, connection):
+        connection.execute(text('DELETE FROM {}'.format(ftsTableName)))
+        connection.execute(text(
+            'INSERT INTO {} (rowid, name, description) '
+            'SELECT id, name, description FROM menu_items'.format(
+                ftsTableName
+            )
+        ))
+
+
+class PostgresSearchIndex(SearchIndex):
+    """
+        Searches the GIN index over the tsvector of the name & description
+        of items, which PostgreSQL keeps up to date by itself.
+    """
+
+    def search(self, session, query, offset, limit):
+        query = ' '.join(tokenize(query))
+        if not query:
+            return 0, []
+
+        condition = (
+            "({}) @@ plainto_tsquery('english', :query)".format(
+                tsvectorExpression
+            )
+        )
+        total = session.execute(
+            text('SELECT count(*) FROM menu_items WHERE ' + condition),
+            {'query': query}
+        ).scalar()
+        ids = [row[0] for row in session.execute(
+            text(
+                "SELECT id FROM menu_items WHERE {} "
+                "ORDER BY ts_rank(({}), plainto_tsquery('english', :query)) "
+                "DESC, id DESC LIMIT :limit OFFSET :offset".format(
+                    condition, tsvectorExpression
+                )
+            ),
+            {'query': query, 'limit': limit, 'offset': offset}
+        )]
+
+        return total, ids
+
+
+class InvertedIndex(SearchIndex):
+    """
+        In-process inverted index of the words of the name & description of
+        every item, built from the database on first use.
+
+        Every process holds its own index, so changes made by other
+        processes are only seen after a `rebuild`. Changes made through a
+        session are kept in its `info` until its transaction is committed,
+        so that the index never holds changes which were rolled back.
+    """
+    nameWeight = 3
+
+    def __init__(self):
+        # word => {menu item id => weighted number of occurrences}
+        self.postings = defaultdict(dict)
+        # menu item id => the words it was indexed under
+        self.words = {}
+        self.built = False
+        self._lock = threading.RLock()
+
+    def search(self, session, query, offset, limit):
+        tokens = set(tokenize(query))
+        if not tokens:
+            return 0, []
+
+        with self._lock:
+            if not self.built:
+                self.rebuild(session)
+
+            postings = sorted(
+                (self.postings.get(token, {}) for token in tokens), key=len
+            )
+            matches = set(postings[0])
+            for posting in postings[1:]:
+                matches.intersection_update(posting)
+
+            documents = max(len(self.words), 1)
+            scores = {
+                itemId: sum(
+                    posting[itemId] * math.log(1 + documents / len(posting))
+                    for posting in postings
+                )
+                for itemId in matches
+            }
+
+        # Only the matches up to the requested page need to be ranked
+        ranked = heapq.nsmallest(
+            offset + limit,
+            scores,
+            key=lambda itemId: (-scores[itemId], -itemId)
+        )
+
+        return len(scores), ranked[offset:]
+
+    def add(self, session, menuItem):
+        # menu item id => its (name, description), or None once removed
+        session.info.setdefault('search_changes', {})[menuItem.id] = (
+            menuItem.name, menuItem.description
+        )
+
+    def remove(self, session, menuItem):
+        session.info.setdefault('search_changes', {})[menuItem.id] = None
+
+    def commit(self, session):
+        changes = session.info.pop('search_changes', {})
+        with self._lock:
+            for itemId, values in changes.items():
+                self._remove(itemId)
+                if values is not None:
+                    self._add(itemId, *values)
+
+    def rollback(self, session):
+        session.info.pop('search_changes', None)
+
+    def rebuild(self, connection):
+        menuItems = MenuItem.__table__
+        with self._lock:
+            self.postings = defaultdict(dict)
+            self.words = {}
+            rows = connection.execute(select([
+                menuItems.c.id, menuItems.c.name, menuItems.c.description
+            ]))
+            for row in rows:
+                self._add(row.id, row.name, row.description)
+            self.built = True
+
+    def _remove(self, itemId):
+        for token in self.words.pop(itemId, []):
+            posting = self.postings.get(token)
+            if posting is not None:
+                posting.pop(itemId, None)
+                if not posting:
+                    del self.postings[token]
+
+    def _add(self, itemId, name, description):
+        counts = defaultdict(int)
+        for token in tokenize(name):
+            counts[token] += self.nameWeight
+        for token in tokenize(description):
+            counts[token] += 1
+
+        for token, count in counts.items():
+            self.postings[token][itemId] = count
+        self.words[itemId] = list(counts)
+
+
+def hasFts5(connection):
+    return bool(connection.execute(text(
+        "SELECT sqlite_compileoption_used('ENABLE_FTS5')"
+    )).scalar())
+
+
+def getSearchIndex(connection):
+    """Returns the best search backend the database supports."""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        if connection.dialect.has_table(connection, ftsTableName):
+            return SqliteSearchIndex()
+    elif dialect == 'postgresql':
+        if ginIndexName in [
+            i['name'] for i in inspect(connection).get_indexes('menu_items')
+        ]:
+            return PostgresSearchIndex()
+
+    return InvertedIndex()
+
+
+def createIndex(connection):
+    """Creates (& fills) the native search index of the database, if any."""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite' and hasFts5(connection):
+        connection.execute(text(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS {} '
+            'USING fts5(name, description)'.format(ftsTableName)
+        ))
+        SqliteSearchIndex().rebuild(connection)
+    elif dialect == 'postgresql':
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS {} ON menu_items '
+            'USING gin (({}))'.format(ginIndexName, tsvectorExpression)
+        ))
+
+
+def dropIndex(connection):
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        connection.execute(text('DROP TABLE IF EXISTS ' + ftsTableName))
+    elif dialect == 'postgresql':
+        connection.execute(text('DROP INDEX IF EXISTS ' + ginIndexName))
+
+
+def makeBenchmarkItems(count, vocabulary=50000, seed=0):
+    """
+        Yields the rows of `count` made up menu items, whose words are
+        `word<rank>` picked with a frequency inversely proportional to their
+        rank, as in natural language.
+    """
+    import itertools
+    import random
+
+    generator = random.Random(seed)
+    words = ['word{}'.format(rank) for rank in range(1, vocabulary + 1)]
+    weights = list(itertools.accumulate(
+        1.0 / rank for rank in range(1, vocabulary + 1)
+    ))
+    for itemId in range(1, count + 1):
+        name = generator.choices(words, cum_weights=weights, k=3)
+        description = generator.choices(words, cum_weights=weights, k=12)
+        yield {
+            'id': itemId,
+            'name': ' '.join(name),
+            'slug': 'item_{}'.format(itemId),
+            'description': ' '.join(description)
+        }
+
+
+def benchmark(count, backends, repeat):
+    """
+        Returns the time taken to build each backend over `count` items &
+        a row per backend & query: the number of matches & the median time
+        taken to get the first page of them.
+    """
+    import os
+    from sqlalchemy import create_engine
+    import statistics
+    import tempfile
+    import time
+
+    queries = ['word40000', 'word500', 'word50 word60', 'word1 word2']
+    builds = {}
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine('sqlite:///{}'.format(
+            os.path.join(directory, 'search.db')
+        ))
+        menuItems = MenuItem.__table__
+        menuItems.create(engine)
+        items = makeBenchmarkItems(count)
+        with engine.begin() as connection:
+            while True:
+                batch = [row for row, i in zip(items, range(10000))]
+                if not batch:
+                    break
+                connection.execute(menuItems.insert(), batch)
+
+        for name in backends:
+            with engine.begin() as connection:
+                start = time.perf_counter()
+                if name == 'fts5':
+                    createIndex(connection)
+                    index = SqliteSearchIndex()
+                else:
+                    index = InvertedIndex()
+                    index.rebuild(connection)
+                builds[name] = time.perf_counter() - start
+
+            with engine.connect() as connection:
+                for query in queries:
+                    timings = []
+                    for i in range(repeat):
+                        start = time.perf_counter()
+                        total, ids = index.search(connection, query, 0, 20)
+                        timings.append(time.perf_counter() - start)
+                    rows.append(
+                        (name, query, total, statistics.median(timings))
+                    )
+            del index
+        engine.dispose()
+
+    return builds, rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Rebuilds or benchmarks the search index.'
+    )
+    parser.add_argument('command', choices=['rebuild', 'benchmark'])
+    parser.add_argument('--items', type=int, default=1000000)
+    parser.add_argument(
+        '--backends', nargs='+', choices=['fts5', 'memory'],
+        default=['fts5', 'memory']
+    )
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+
+    if arguments.command == 'rebuild':
+        from config import engine
+
+        with engine.begin() as connection:
+            getSearchIndex(connection).rebuild(connection)
+        print('The search index was rebuilt successfully!')
+    else:
+        builds, rows = benchmark(
+            arguments.items, arguments.backends, arguments.repeat
+        )
+        for name, elapsed in builds.items():
+            print('{} built over {} items in {:.1f} s'.format(
+                name, arguments.items, elapsed
+            ))
+        print('{:>7} {:>18} {:>9} {:>10}'.format(
+            'backend', 'query', 'matches', 'time (ms)'
+        ))
+        for name, query, total, elapsed in rows:
+            print('{:>7} {:>18} {:>9} {:>10.2f}'.format(
+                name, query, total, elapsed * 1000
+            ))
@@ -4,7 +4,9 @@
 from config import (
     engine, USER_EMAIL_FOR_DB_SEEDS, USER_NAME_FOR_DB_SEEDS
 )
+import counters
 from models import Base, Category, MenuItem, User
+import search
 from sqlalchemy.orm import sessionmaker
 
 
@@ -28,7 +30,9 @@ user1 = User(
 )
 
 session.add(user1)
-session.commit()
+# Everything is seeded in a single transaction, flushing only makes the
+# database assign the id of the user the categories belong to.
+session.flush()
 
 categories = [
     {
@@ -175,17 +179,21 @@ for category in categories:
         slug=category['slug'],
         user_id=category['user_id']
     )
-    session.add(newCategory)
-    session.commit()
     for menuItem in category['menu_items']:
-        newMenuItem = MenuItem(
+        newCategory.menu_items.append(MenuItem(
             name=menuItem['name'],
             slug=menuItem['slug'],
-            description=menuItem['description'],
-            category_id=newCategory.id
-        )
-        session.add(newMenuItem)
-        session.commit()
+            description=menuItem['description']
+        ))
+    session.add(newCategory)
+
+# The counters & the search index are filled in by the same transaction, so
+# the seeded items are never seen without them
+session.flush()
+connection = session.connection()
+search.getSearchIndex(connection).rebuild(connection)
+counters.reconcile(connection)
+session.commit()
 
 
 session.close()
@@ -0,0 +1,340 @@
+#!/usr/bin/python3
+"""
+    Encoding of the catalogue straight from database rows, without loading
+    any ORM objects, in the same shape & key order as `jsonify`.
+
+    The JSON is encoded with orjson when it is installed.
+
+    In the compact form, menu items are encoded as arrays of their values
+    in the order of `menuItemFields`, which the document lists once under
+    `menu_item_fields`, instead of repeating their keys in every object.
+
+    Usage:
+        python3 app/serializers.py benchmark [--items N]
+            Reports the CPU time & the peak memory taken to encode a
+            category of N made up menu items (10k by default) from ORM
+            objects & from rows, with & without orjson.
+"""
+
+
+import json
+from models import Category, MenuItem
+from sqlalchemy import desc, select
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Keys of a serialized menu item, in the order `jsonify` sorts them in
+menuItemFields = ['category_id', 'description', 'id', 'name', 'slug']
+
+
+def dumpJSON(value):
+    """Encodes a value exactly the way `jsonify` does outside debug mode."""
+    if orjson is not None:
+        try:
+            output = orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+        except (TypeError, orjson.JSONEncodeError):
+            output = None
+        # Unlike `jsonify`, orjson does not escape DEL & non-ASCII
+        # characters, the output is only kept when there are none of them
+        if output is not None and output.isascii() and b'\x7f' not in output:
+            return output.decode('ascii')
+
+    return json.dumps(value, separators=(',', ':'), sort_keys=True)
+
+
+def selectCategories():
+    """Selects the serialized columns of the categories."""
+    categories = Category.__table__
+
+    return select([categories.c.id, categories.c.name, categories.c.slug])
+
+
+def selectMenuItems():
+    """Selects the serialized columns of the menu items."""
+    menuItems = MenuItem.__table__
+
+    return select([
+        menuItems.c.id,
+        menuItems.c.name,
+        menuItems.c.slug,
+        menuItems.c.description,
+        menuItems.c.category_id
+    ])
+
+
+def serializeRow(row):
+    """
+        Returns a row of `selectCategories` or `selectMenuItems` as the
+        `serialize` property of its model would.
+    """
+    return dict(row._mapping)
+
+
+def compactMenuItem(menuItem):
+    """Returns a serialized menu item in the compact form."""
+    return [menuItem[field] for field in menuItemFields]
+
+
+def selectCatalogueRows(categoryId=None, categorySlug=None):
+    """
+        Selects the categories (or only the one with the given id or slug)
+        along with their menu items as plain rows of a single outer join, in
+        the order of the `Category.menu_items` relationship.
+    """
+    categories = Category.__table__
+    menuItems = MenuItem.__table__
+    query = select([
+        categories.c.id,
+        categories.c.name,
+        categories.c.slug,
+        menuItems.c.id.label('menu_item_id'),
+        menuItems.c.name.label('menu_item_name'),
+        menuItems.c.slug.label('menu_item_slug'),
+        menuItems.c.description.label('menu_item_description')
+    ]).select_from(
+        categories.outerjoin(menuItems)
+    ).order_by(
+        desc(categories.c.created_at),
+        categories.c.id,
+        desc(menuItems.c.created_at),
+        menuItems.c.id
+    )
+
+    if categoryId is not None:
+        query = query.where(categories.c.id == categoryId)
+    if categorySlug is not None:
+        query = query.where(categories.c.slug == categorySlug)
+
+    return query
+
+
+def fetchChunks(rows, chunkSize):
+    """Yields the rows of a result `chunkSize` rows at a time."""
+    while True:
+        chunk = rows.fetchmany(chunkSize)
+        if not chunk:
+            break
+        yield chunk
+
+
+def encodeCatalogue(chunks, compact=False):
+    """
+        Encodes chunks of rows selected by `selectCatalogueRows` as the
+        `{"categories": [...]}` document, yielding one string per chunk.
+    """
+    yield openCatalogue()
+    for output in encodeCategories(chunks, compact=compact):
+        yield output
+    yield closeCatalogue(compact)
+
+
+def openCatalogue():
+    return '{"categories":['
+
+
+def closeCatalogue(compact=False):
+    if compact:
+        return '],"menu_item_fields":%s}\n' % dumpJSON(menuItemFields)
+
+    return ']}\n'
+
+
+def encodeCategories(chunks, separator=',', compact=False):
+    """
+        Encodes chunks of rows selected by `selectCatalogueRows` as category
+        objects, each with its `menu_items`, separated by `separator`.
+
+        Yields one string per chunk so that a category with any number of
+        menu items is never held in memory as a whole.
+    """
+    encoder = CategoryEncoder(separator, compact)
+    for chunk in chunks:
+        yield encoder.encode(chunk)
+
+    output = encoder.finish()
+    if output:
+        yield output
+
+
+class CategoryEncoder(object):
+    """
+        Encodes the chunks of rows of `encodeCategories` one at a time, as
+        they are fetched, e.g. from an asynchronous result.
+    """
+
+    def __init__(self, separator=',', compact=False):
+        self.separator = separator
+        self.compact = compact
+        self.category = None
+        self.firstItem = True
+
+    def encode(self, chunk):
+        """Returns the JSON of a chunk of rows."""
+        output = []
+        for row in chunk:
+            if self.category is None or self.category['id'] != row.id:
+                if self.category is not None:
+                    output.append(closeCategory(self.category))
+                    output.append(self.separator)
+                self.category = {
+                    'id': row.id,
+                    'name': row.name,
+                    'slug': row.slug
+                }
+                output.append('{"id":%s,"menu_items":[' % dumpJSON(row.id))
+                self.firstItem = True
+
+            if row.menu_item_id is None:
+                continue
+            if not self.firstItem:
+                output.append(',')
+            self.firstItem = False
+            menuItem = {
+                'id': row.menu_item_id,
+                'name': row.menu_item_name,
+                'slug': row.menu_item_slug,
+                'description': row.menu_item_description,
+                'category_id': row.id
+            }
+            output.append(dumpJSON(
+                compactMenuItem(menuItem) if self.compact else menuItem
+            ))
+
+        return ''.join(output)
+
+    def finish(self):
+        """Returns the JSON closing the last category, once all are encoded."""
+        if self.category is None:
+            return ''
+
+        return closeCategory(self.category)
+
+
+def closeCategory(category):
+    return '],"name":%s,"slug":%s}' % (
+        dumpJSON(category['name']), dumpJSON(category['slug'])
+    )
+
+
+def encodeObjects(dbSession):
+    """
+        Encodes the catalogue out of ORM objects & their `serialize`
+        properties, the way the JSON API did before this module.
+    """
+    return json.dumps({'categories': [
+        dict(
+            category.serialize,
+            menu_items=[i.serialize for i in category.menu_items]
+        )
+        for category in dbSession.query(Category).order_by(
+            desc(Category.created_at), Category.id
+        )
+    ]}, separators=(',', ':'), sort_keys=True) + '\n'
+
+
+def encodeRows(connection, compact=False):
+    """Encodes the catalogue out of rows, as `/catalogue.json` streams it."""
+    rows = connection.execute(selectCatalogueRows())
+
+    return ''.join(encodeCatalogue(fetchChunks(rows, 1000), compact))
+
+
+def benchmark(count, repeat=5):
+    """
+        Returns a row per encoding of a category of `count` menu items in a
+        temporary Sqlite database: the best CPU time taken & the peak of the
+        memory allocated while encoding.
+    """
+    global orjson
+    import os
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    import tempfile
+    import time
+    import tracemalloc
+    from models import Base
+
+    fastEncoder = orjson
+    encodings = [
+        ('objects', None, lambda session, c: encodeObjects(session)),
+        ('rows', fastEncoder, lambda session, c: encodeRows(c)),
+        ('rows', None, lambda session, c: encodeRows(c)),
+        ('compact', fastEncoder, lambda session, c: encodeRows(c, True))
+    ]
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine('sqlite:///{}'.format(
+            os.path.join(directory, 'serializers.db')
+        ))
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(Category.__table__.insert().values(
+                id=1, name='Benchmark', slug='benchmark'
+            ))
+            connection.execute(MenuItem.__table__.insert(), [
+                {
+                    'category_id': 1,
+                    'name': 'Menu item {}'.format(i),
+                    'slug': 'menu_item_{}'.format(i),
+                    'description': 'Description of the menu item {}'.format(i)
+                }
+                for i in range(count)
+            ])
+
+        try:
+            for name, encoder, encode in encodings:
+                orjson = encoder
+                timings = []
+                for i in range(repeat + 1):
+                    tracing = i == repeat
+                    if tracing:
+                        tracemalloc.start()
+                    start = time.process_time()
+                    with engine.connect() as connection:
+                        with Session(bind=connection) as session:
+                            output = encode(session, connection)
+                    if tracing:
+                        peak = tracemalloc.get_traced_memory()[1]
+                        tracemalloc.stop()
+                    else:
+                        timings.append(time.process_time() - start)
+                rows.append((
+                    name,
+                    'orjson' if encoder is not None else 'json',
+                    len(output),
+                    min(timings),
+                    peak
+                ))
+        finally:
+            orjson = fastEncoder
+            engine.dispose()
+
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the encoding of the catalogue.'
+    )
+    parser.add_argument('command', choices=['benchmark'])
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+
+    if orjson is None:
+        print('orjson is not installed, json is used instead.')
+    print('{:>8} {:>7} {:>10} {:>9} {:>10}'.format(
+        'from', 'encoder', 'size', 'cpu (ms)', 'peak (MB)'
+    ))
+    for name, encoder, size, elapsed, peak in benchmark(
+        arguments.items, arguments.repeat
+    ):
+        print('{:>8} {:>7} {:>10} {:>9.1f} {:>10.1f}'.format(
+            name, encoder, size, elapsed * 1000, peak / 1e6
+        ))
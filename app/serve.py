@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+"""
+    Serves the app with several pre-forked worker processes.
+
+    Usage:
+        python3 app/serve.py [--workers N] [--preload]
+        python3 app/serve.py benchmark [--workers N] [--connections N]
+                                       [--requests N]
+            Runs the development server of app/project.py & this one in
+            turn, with no rate limits & no load shedding, while
+            `--connections` concurrent clients send `--requests` requests to
+            the read-only routes, & reports the throughput & the latency of
+            both @see app/asgi.py
+
+    The master process binds `APP_HOST`:`APP_PORT` & forks `--workers`
+    (`APP_WORKERS` by default) processes, each of them accepting connections
+    on the shared socket & serving them with a thread per request. Workers
+    which die are replaced.
+
+    Without `--preload`, every worker imports (& warms up, @see
+    `APP_WARM_UP`) the app itself after the fork. With `--preload` the
+    master imports the app once before forking so the workers share its
+    memory & start instantly, each of them disposing of the database
+    connections it inherited.
+
+    Signals sent to the master:
+        SIGHUP      Gracefully reloads: starts a new set of workers & stops
+                    the old ones once the new ones are ready to serve.
+                    Without `--preload`, the new workers load the code anew.
+        SIGTERM     Gracefully stops: workers finish the requests in flight.
+        SIGINT
+"""
+
+
+import argparse
+import config
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+
+# Seconds given to new workers to get ready while reloading
+readyTimeout = 60
+# Seconds waited before replacing a worker which died, so that workers
+# failing on start-up (e.g. on an import error) are not forked in a loop
+respawnDelay = 1
+
+
+def loadApplication():
+    from wsgi import application
+
+    return application
+
+
+def runWorker(listener, readyPipe, application):
+    """Serves requests on `listener` until SIGTERM is received."""
+    from werkzeug.serving import make_server
+
+    if application is None:
+        application = loadApplication()
+    else:
+        # Connections opened by the master (e.g. while warming up) must
+        # neither be shared with it nor closed, which would close them for
+        # the master too, so they are only forgotten
+        for engine in [config.engine] + config.replicaEngines:
+            engine.dispose(close=False)
+
+    server = make_server(
+        config.APP_HOST,
+        config.APP_PORT,
+        application,
+        threaded=True,
+        fd=listener.fileno()
+    )
+    # Every worker is woken up by a new connection but only one of them gets
+    # it, the others must not block in `accept` or they could not stop
+    server.socket.setblocking(False)
+    # Requests in flight are waited for when the server is closed
+    server.daemon_threads = False
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    os.write(readyPipe, b'.')
+    os.close(readyPipe)
+    server.serve_forever()
+    server.server_close()
+
+
+def benchmark(workers, connections, requests):
+    """
+        Returns the rows of `asgi.benchmark` for the development server of
+        app/project.py & for `workers` workers of this one.
+    """
+    import asgi
+
+    appFolder = os.path.dirname(os.path.abspath(__file__))
+
+    return asgi.benchmark(connections, requests, servers=[
+        ('dev', [sys.executable, os.path.join(appFolder, 'project.py')]),
+        ('prefork', [
+            sys.executable,
+            os.path.abspath(__file__),
+            '--workers', str(workers)
+        ])
+    ])
+
+
+class Master(object):
+
+    def __init__(self, workers, preload):
+        self.workers = workers
+        self.application = loadApplication() if preload else None
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((config.APP_HOST, config.APP_PORT))
+        self.listener.listen(128)
+        # pid of every running worker
+        self.pids = set()
+        self.stopping = False
+        self.reloading = False
+
+    def spawn(self):
+        """Forks a worker & returns its pid & the pipe it reports on."""
+        readPipe, writePipe = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(readPipe)
+            # A worker which crashed exits with an error, so it is replaced
+            status = 1
+            try:
+                runWorker(self.listener, writePipe, self.application)
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+
+        os.close(writePipe)
+        self.pids.add(pid)
+
+        return pid, readPipe
+
+    def spawnAll(self):
+        """Forks all the workers & waits until they are ready."""
+        spawned = [self.spawn() for i in range(self.workers)]
+        self.waitUntilReady([pipe for pid, pipe in spawned])
+
+        return set(pid for pid, pipe in spawned)
+
+    def waitUntilReady(self, pipes):
+        deadline = time.time() + readyTimeout
+        pending = list(pipes)
+        while pending and time.time() < deadline:
+            try:
+                ready = select.select(pending, [], [], 1)[0]
+            except InterruptedError:
+                continue
+            for pipe in ready:
+                os.read(pipe, 1)
+                pending.remove(pipe)
+        for pipe in pipes:
+            os.close(pipe)
+
+    def stopWorkers(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def onReload(self, signum, frame):
+        self.reloading = True
+
+    def onStop(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self.onReload)
+        signal.signal(signal.SIGTERM, self.onStop)
+        signal.signal(signal.SIGINT, self.onStop)
+
+        self.spawnAll()
+        print('Serving on http://{}:{} with {} workers'.format(
+            config.APP_HOST, config.APP_PORT, self.workers
+        ))
+
+        while not self.stopping:
+            if self.reloading:
+                self.reloading = False
+                old = set(self.pids)
+                self.spawnAll()
+                self.stopWorkers(old)
+                print('Reloaded the workers')
+
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid:
+                if pid in self.pids:
+                    self.pids.remove(pid)
+                    # Replace the workers which died, not the stopped ones
+                    if os.WIFSIGNALED(status) or os.WEXITSTATUS(status):
+                        print('Worker {} died, replacing it'.format(pid))
+                        time.sleep(respawnDelay)
+                        self.waitUntilReady([self.spawn()[1]])
+                continue
+
+            time.sleep(0.5)
+
+        self.stopWorkers(self.pids)
+        for pid in list(self.pids):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.listener.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serves the app with several worker processes.'
+    )
+    parser.add_argument(
+        'command', nargs='?', choices=['serve', 'benchmark'], default='serve'
+    )
+    parser.add_argument('--workers', type=int, default=config.APP_WORKERS)
+    parser.add_argument(
+        '--preload',
+        action='store_true',
+        help='import the app in the master before forking the workers'
+    )
+    parser.add_argument('--connections', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=5000)
+    arguments = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        print('app/serve.py needs a platform supporting fork().')
+        sys.exit(1)
+
+    if arguments.command == 'benchmark':
+        import asgi
+
+        asgi.printBenchmark(
+            benchmark(
+                arguments.workers, arguments.connections, arguments.requests
+            ),
+            arguments.connections,
+            arguments.requests
+        )
+        sys.exit(0)
+
+    Master(arguments.workers, arguments.preload).run()
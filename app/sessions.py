@@ -0,0 +1,411 @@
+#!/usr/bin/python3
+"""
+    Server-side sessions.
+
+    The session cookie only carries an opaque, random session id, signed
+    with `APP_SECRET_KEY`, while the session data is kept in a store: the
+    `sessions` table or a key-value store shared by all the processes
+    (@see `SESSION_BACKEND`). The data is only loaded when the session is
+    first accessed during a request & only written back when it has been
+    modified.
+
+    Session ids are only ever issued by the server: a session id which is
+    unknown to the store (e.g. expired) is replaced by a new one, & the id
+    of a session is replaced whenever its user logs in or out
+    (@see `regenerateSession`), so that an id known to someone else before
+    cannot be used afterwards.
+
+    Usage:
+        python3 app/sessions.py sweep
+            Deletes the expired sessions from the `sessions` table.
+        python3 app/sessions.py benchmark [--requests N]
+            Reports the time taken per request & the cookie bytes sent
+            each way with a logged in session, for each session backend.
+"""
+
+
+import base64
+import cache
+from collections.abc import MutableMapping
+import config
+from datetime import datetime
+from flask.sessions import (
+    SessionInterface, SessionMixin, session_json_serializer
+)
+import hashlib
+from itsdangerous import BadSignature, Signer
+from models import UserSession
+import os
+import random
+from sqlalchemy import select
+
+
+class ServerSideSession(SessionMixin, MutableMapping):
+    """
+        Session whose data is loaded from `store` on first access. `new`
+        sessions get their id sent in a cookie once they hold any data,
+        `hasCookie` tells whether the client sent a cookie for the session.
+    """
+
+    def __init__(self, sid, store, new, hasCookie=False):
+        self.sid = sid
+        self.store = store
+        self.new = new
+        self.hasCookie = hasCookie
+        self.modified = False
+        self.accessed = False
+        self._data = {} if new else None
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def _load(self):
+        self.accessed = True
+        if self._data is None:
+            data = self.store.load(self.sid)
+            if data is None:
+                # Unknown or expired, the id is never reused
+                self.sid = makeSessionId()
+                self.new = True
+                data = {}
+            self._data = data
+
+        return self._data
+
+    def regenerate(self):
+        """Moves the data of the session under a new session id."""
+        self._load()
+        if not self.new:
+            self.store.delete(self.sid)
+        self.sid = makeSessionId()
+        self.new = True
+        self.modified = True
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self._load()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def clear(self):
+        self._data = {}
+        self.accessed = True
+        self.modified = True
+
+
+class SqlSessionStore(object):
+    """Keeps the sessions in the `sessions` table."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.table = UserSession.__table__
+
+    def load(self, sid):
+        with self.engine.connect() as connection:
+            data = connection.execute(
+                select([self.table.c.data]).where(
+                    (self.table.c.id == sid) &
+                    (self.table.c.expires_at > datetime.utcnow())
+                )
+            ).scalar()
+
+        return None if data is None else session_json_serializer.loads(data)
+
+    def save(self, sid, data, ttl):
+        values = {
+            'data': session_json_serializer.dumps(data),
+            'expires_at': datetime.utcnow() + ttl
+        }
+        with self.engine.begin() as connection:
+            updated = connection.execute(
+                self.table.update().where(
+                    self.table.c.id == sid
+                ).values(**values)
+            ).rowcount
+            if not updated:
+                connection.execute(self.table.insert().values(
+                    id=sid, **values
+                ))
+
+        if random.random() < 1.0 / config.SESSION_SWEEP_EVERY:
+            self.sweep()
+
+    def delete(self, sid):
+        with self.engine.begin() as connection:
+            connection.execute(
+                self.table.delete().where(self.table.c.id == sid)
+            )
+
+    def sweep(self):
+        """Deletes the expired sessions, returning how many were deleted."""
+        with self.engine.begin() as connection:
+            return connection.execute(self.table.delete().where(
+                self.table.c.expires_at <= datetime.utcnow()
+            )).rowcount
+
+
+class KeyValueSessionStore(object):
+    """
+        Keeps the sessions in a key-value store with the `get`,
+        `set(name, value, ex=None)` & `delete` methods of a redis client,
+        which expires them by itself.
+    """
+
+    def __init__(self, client, namespace='session'):
+        self.client = client
+        self.namespace = namespace
+
+    def load(self, sid):
+        data = self.client.get(self._key(sid))
+
+        return None if data is None else session_json_serializer.loads(
+            data if isinstance(data, str) else data.decode('utf-8')
+        )
+
+    def save(self, sid, data, ttl):
+        self.client.set(
+            self._key(sid),
+            session_json_serializer.dumps(data),
+            ex=int(ttl.total_seconds())
+        )
+
+    def delete(self, sid):
+        self.client.delete(self._key(sid))
+
+    def sweep(self):
+        return 0
+
+    def _key(self, sid):
+        return '{}:{}'.format(self.namespace, sid)
+
+
+class ServerSideSessionInterface(SessionInterface):
+
+    def __init__(self, store):
+        self.store = store
+
+    salt = 'server-side-session'
+
+    def get_signer(self, app):
+        if not app.secret_key:
+            return None
+
+        # Signed the way Flask signs its cookie sessions
+        return Signer(
+            app.secret_key,
+            salt=self.salt,
+            key_derivation='hmac',
+            digest_method=hashlib.sha1
+        )
+
+    def open_session(self, app, request):
+        signer = self.get_signer(app)
+        if signer is None:
+            return None
+
+        cookie = request.cookies.get(app.config['SESSION_COOKIE_NAME'])
+        if cookie:
+            try:
+                sid = signer.unsign(cookie).decode('utf-8')
+            except BadSignature:
+                sid = None
+            if sid is not None and len(sid) == 43:
+                return ServerSideSession(
+                    sid, self.store, new=False, hasCookie=True
+                )
+
+        return ServerSideSession(
+            makeSessionId(), self.store, new=True, hasCookie=bool(cookie)
+        )
+
+    def save_session(self, app, session, response):
+        cookieName = app.config['SESSION_COOKIE_NAME']
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session.modified:
+            return
+
+        if not session.loaded or len(session) == 0:
+            if not session.new:
+                self.store.delete(session.sid)
+            if session.hasCookie:
+                response.delete_cookie(cookieName, domain=domain, path=path)
+            return
+
+        self.store.save(
+            session.sid, dict(session), app.permanent_session_lifetime
+        )
+        if session.new:
+            response.set_cookie(
+                cookieName,
+                self.get_signer(app).sign(session.sid).decode('utf-8'),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app)
+            )
+
+
+def makeSessionId():
+    """Returns a random, url safe session id of 43 characters."""
+    return base64.urlsafe_b64encode(os.urandom(32)).rstrip(b'=').decode()
+
+
+def regenerateSession(session):
+    """
+        Gives the session a new id, on login & logout. Flask's cookie
+        sessions have no id to replace.
+    """
+    if isinstance(session, ServerSideSession):
+        session.regenerate()
+
+
+def makeSessionInterface(engine):
+    """
+        Returns the session interface of the backend configured in
+        `SESSION_BACKEND`, or `None` to keep Flask's cookie sessions.
+    """
+    if config.SESSION_BACKEND == 'sql':
+        return ServerSideSessionInterface(SqlSessionStore(engine))
+    elif config.SESSION_BACKEND == 'shared':
+        return ServerSideSessionInterface(
+            KeyValueSessionStore(cache.getSharedClient())
+        )
+    elif config.SESSION_BACKEND == 'cookie':
+        return None
+
+    raise RuntimeError(
+        'Unsupported session backend "{}" provided.'.format(
+            config.SESSION_BACKEND
+        )
+    )
+
+
+def benchmark(interfaces, requests=1000):
+    """
+        Returns a row per session interface (`None` for Flask's cookie
+        sessions) & request kind, reading or modifying a session holding
+        the data of a logged in user: the median time taken per request,
+        the bytes of the `Cookie` request header & the average bytes of
+        the `Set-Cookie` response header.
+    """
+    from flask import Flask, session
+    import statistics
+    import time
+
+    loggedIn = {
+        'state': makeSessionId()[:32],
+        'provider': 'facebook',
+        'username': 'Benchmark User',
+        'email': 'benchmark.user@example.com',
+        'facebook_id': '1' * 17,
+        'access_token': 'EAA' + 'x' * 180,
+        'picture': 'https://platform-lookaside.fbsbx.com/platform/'
+                   'profilepic/?asid=' + '1' * 17 + '&height=50&width=50',
+        'user_id': 1
+    }
+
+    rows = []
+    for name, interface in interfaces:
+        app = Flask(__name__)
+        app.secret_key = config.APP_SECRET_KEY
+        if interface is not None:
+            app.session_interface = interface
+
+        @app.route('/read')
+        def read():
+            return session.get('username', '')
+
+        @app.route('/write')
+        def write():
+            session['visits'] = session.get('visits', 0) + 1
+            return ''
+
+        client = app.test_client()
+        with client.session_transaction() as data:
+            data.update(loggedIn)
+
+        for path in ['/read', '/write']:
+            # Warms up the code paths & the store before timing them
+            for i in range(requests // 10):
+                client.get(path)
+            timings = []
+            cookieBytes = setCookieBytes = 0
+            for i in range(requests):
+                start = time.perf_counter()
+                response = client.get(path)
+                timings.append(time.perf_counter() - start)
+                cookieBytes = len(response.request.headers.get('Cookie', ''))
+                setCookieBytes += sum(
+                    len(value) for value in response.headers.getlist(
+                        'Set-Cookie'
+                    )
+                )
+            rows.append((
+                name,
+                path[1:],
+                statistics.median(timings),
+                cookieBytes,
+                setCookieBytes / requests
+            ))
+
+        if interface is not None:
+            with client.session_transaction() as data:
+                data.clear()
+
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Sweeps or benchmarks the sessions.'
+    )
+    parser.add_argument('command', choices=['sweep', 'benchmark'])
+    parser.add_argument('--requests', type=int, default=1000)
+    arguments = parser.parse_args()
+
+    if arguments.command == 'sweep':
+        print('Deleted {} expired sessions.'.format(
+            SqlSessionStore(config.engine).sweep()
+        ))
+    else:
+        interfaces = [
+            ('cookie', None),
+            ('sql', ServerSideSessionInterface(
+                SqlSessionStore(config.engine)
+            )),
+            ('shared', ServerSideSessionInterface(
+                KeyValueSessionStore(cache.getSharedClient())
+            ))
+        ]
+        print('{:>7} {:>7} {:>10} {:>8} {:>12}'.format(
+            'backend', 'request', 'time (us)', 'cookie', 'set-cookie'
+        ))
+        for name, kind, elapsed, cookie, setCookie in benchmark(
+            interfaces, arguments.requests
+        ):
+            print('{:>7} {:>7} {:>10.1f} {:>8} {:>12.1f}'.format(
+                name, kind, elapsed * 1e6, cookie, setCookie
+            ))
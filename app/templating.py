@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+"""
+    Rendering of the templates.
+
+    Compiled templates are kept on disk in a Jinja bytecode cache (in
+    `TEMPLATE_BYTECODE_CACHE_DIR`), so that a process starting up loads
+    them instead of compiling them again. The parts of the layout which
+    are the same on most pages are cached once rendered with the `cache`
+    tag, e.g. the sidebar under the version of the list of categories it
+    shows:
+
+        {% cache 'sidebar', categories_version %}
+            {% include "sidebar.html" %}
+        {% endcache %}
+
+    The key of a fragment is made of all the values given to the tag, which
+    have to change whenever its content does. Rendering a fragment which
+    was not cached counts in the render-time profile of the templates as
+    `fragment:<name>` @see app/metrics.py
+
+    Usage:
+        python3 app/templating.py benchmark [--categories N ...]
+            Reports the time taken to render every page with each number of
+            categories in the sidebar, with & without the cached fragments,
+            & the time taken to load all the templates on start-up with &
+            without the bytecode cache.
+"""
+
+
+import config
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+import metrics
+import time
+
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """
+        Keeps the compiled templates on disk. Jinja compiles a template to
+        different code for the asynchronous environment of app/asgi.py,
+        which is cached apart.
+    """
+
+    def get_bucket(self, environment, name, filename, source):
+        if environment.is_async:
+            name = 'async:' + name
+
+        return super(BytecodeCache, self).get_bucket(
+            environment, name, filename, source
+        )
+
+
+class FragmentCacheExtension(Extension):
+    """
+        Adds the `{% cache name, key... %}...{% endcache %}` tag, which
+        renders its body once per key & then repeats it out of the
+        environment's `fragment_cache`.
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+
+        return nodes.CallBlock(
+            self.call_method('_render', [nodes.List(parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        key = getFragmentKey(parts)
+        fragment = cache.get(key)
+        if fragment is not None:
+            return Markup(fragment)
+
+        if self.environment.is_async:
+            return self._renderAsync(cache, key, parts[0], caller)
+
+        start = time.perf_counter()
+        fragment = caller()
+        metrics.recordRender(
+            'fragment:{}'.format(parts[0]), time.perf_counter() - start
+        )
+        cache.set(key, str(fragment))
+
+        return fragment
+
+    async def _renderAsync(self, cache, key, name, caller):
+        start = time.perf_counter()
+        fragment = await caller()
+        metrics.recordRender(
+            'fragment:{}'.format(name), time.perf_counter() - start
+        )
+        cache.set(key, str(fragment))
+
+        return fragment
+
+
+def init_app(app, fragmentCache):
+    """
+        Caches the compiled templates of `app` on disk, if
+        `TEMPLATE_BYTECODE_CACHE_ENABLED`, & the fragments of its templates
+        in `fragmentCache`.
+    """
+    if config.TEMPLATE_BYTECODE_CACHE_ENABLED:
+        app.jinja_env.bytecode_cache = BytecodeCache(
+            config.TEMPLATE_BYTECODE_CACHE_DIR
+        )
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = fragmentCache
+
+
+def getFragmentKey(parts):
+    return ':'.join(str(part) for part in parts)
+
+
+def loadTemplates(environment):
+    """Loads every template of `environment`, returning the time taken."""
+    start = time.perf_counter()
+    for name in environment.list_templates():
+        environment.get_template(name)
+
+    return time.perf_counter() - start
+
+
+def makePages(categories):
+    """
+        Returns the name & the context of every page rendered by the views,
+        with sample menu items of the given categories.
+    """
+    category = dict(categories[0], user_id=1, item_count=10)
+    menuItems = [{
+        'id': i,
+        'name': 'Menu Item {}'.format(i),
+        'slug': 'menu_item_{}'.format(i),
+        'description': 'Description of the menu item {}.'.format(i),
+        'category': category
+    } for i in range(1, 11)]
+
+    return [
+        ('home.html', {'menuItems': menuItems}),
+        ('category.html', {
+            'category': category,
+            'menuItems': menuItems,
+            'numberOfItems': len(menuItems),
+            'after': 0,
+            'nextAfter': None
+        }),
+        ('menuItem.html', {
+            'menuItem': menuItems[0],
+            'categorySlug': category['slug']
+        }),
+        ('search.html', {
+            'query': 'menu item',
+            'menuItems': menuItems,
+            'total': len(menuItems),
+            'page': 1,
+            'numberOfPages': 1
+        })
+    ]
+
+
+def benchmark(app, counts, repeat):
+    """
+        Returns a row per number of categories & page: the time taken to
+        render the page with its fragments rendered (none cached) & out of
+        the fragment cache.
+    """
+    from flask import g, render_template
+
+    cache = app.jinja_env.fragment_cache
+    rows = []
+    for count in counts:
+        categories = [{
+            'id': i,
+            'name': 'Category {}'.format(i),
+            'slug': 'category_{}'.format(i)
+        } for i in range(1, count + 1)]
+
+        with app.test_request_context('/'):
+            # Stands in for the categories of the database @see app/asgi.py
+            g.categories = categories
+            g.categoriesVersion = 'benchmark:{}'.format(count)
+            for name, context in makePages(categories):
+                timings = []
+                for cached in [False, True]:
+                    render_template(name, **context)
+                    start = time.perf_counter()
+                    for i in range(repeat):
+                        if not cached:
+                            cache.clear()
+                        render_template(name, **context)
+                    timings.append((time.perf_counter() - start) / repeat)
+                rows.append((count, name, timings[0], timings[1]))
+
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the rendering of the templates.'
+    )
+    parser.add_argument('command', choices=['benchmark'])
+    parser.add_argument(
+        '--categories', type=int, nargs='+', default=[10, 10000]
+    )
+    parser.add_argument('--repeat', type=int, default=20)
+    arguments = parser.parse_args()
+
+    from project import app
+
+    print('{:>10} {:>16} {:>14} {:>14}'.format(
+        'categories', 'page', 'render (ms)', 'cached (ms)'
+    ))
+    for count, name, rendered, cached in benchmark(
+        app, arguments.categories, arguments.repeat
+    ):
+        print('{:>10} {:>16} {:>14.2f} {:>14.2f}'.format(
+            count, name, rendered * 1000, cached * 1000
+        ))
+
+    # Start-ups of a process, in environments of their own
+    with tempfile.TemporaryDirectory() as directory:
+        for name, bytecodeCache in [
+            ('no bytecode cache', None),
+            ('empty bytecode cache', BytecodeCache(directory)),
+            ('bytecode cache', BytecodeCache(directory))
+        ]:
+            elapsed = loadTemplates(app.jinja_env.overlay(
+                bytecode_cache=bytecodeCache, cache_size=0
+            ))
+            print('Templates loaded ({}): {:.1f} ms'.format(
+                name, elapsed * 1000
+            ))
@@ -0,0 +1,13 @@
+#!/usr/bin/python3
+"""
+    WSGI entry point of the app.
+
+    e.g. `gunicorn --chdir app wsgi:application` or `python3 app/serve.py`
+"""
+
+
+import config
+from project import create_app
+
+
+application = create_app(warmUp=config.APP_WARM_UP)
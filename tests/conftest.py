@@ -0,0 +1,170 @@
+"""
+    The tests run the app against a SQLite database of their own, created
+    by `app/models.py`, `app/migrate.py` & `app/seeds.py` in a temporary
+    directory before the app is imported, as its settings are read from the
+    environment on import @see app/config.py
+
+    Usage:
+        python3 -m pytest
+            Runs every test.
+        TEST_POSTGRES_URL=postgresql://... python3 -m pytest
+            Also checks the query plans & the export of the catalogue on
+            the given (empty, scratch) PostgreSQL database
+            @see tests/test_indexes.py & tests/test_export.py
+        TEST_REDIS_URL=redis://... python3 -m pytest
+            Also runs the rate limiting script on the given (scratch) redis
+            server @see tests/test_ratelimit.py
+"""
+
+
+import os
+import pytest
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+appDirectory = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'
+)
+dataDirectory = tempfile.mkdtemp(prefix='item_catalogue_tests_')
+
+os.environ.update({
+    'DB_CONNECTION': 'sqlite',
+    'DB_DATABASE': os.path.join(dataDirectory, 'item_catalogue'),
+    'DB_REPLICA_URLS': '',
+    'DB_ASYNC_URL': '',
+    'APP_WARM_UP': 'false',
+    'TEMPLATE_BYTECODE_CACHE_ENABLED': 'false',
+    'SESSION_BACKEND': 'sql',
+    'CACHE_BACKEND': 'local',
+    'RATE_LIMIT_ENABLED': 'false',
+    'QUERY_BUDGET_STRICT': 'true',
+    'METRICS_HEADERS': 'false',
+    'USER_NAME_FOR_DB_SEEDS': 'Seeder',
+    'USER_EMAIL_FOR_DB_SEEDS': 'seeder@example.com',
+    'SQLALCHEMY_SILENCE_UBER_WARNING': '1'
+})
+sys.path.insert(0, appDirectory)
+
+for script in ['models.py', 'migrate.py', 'seeds.py']:
+    subprocess.run(
+        [sys.executable, script],
+        cwd=appDirectory,
+        check=True,
+        stdout=subprocess.DEVNULL
+    )
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(dataDirectory, ignore_errors=True)
+
+
+def clearCaches():
+    """Empties every cache of the app, so requests go to the database."""
+    import project
+
+    for cache in [
+        project.categoryCache,
+        project.pageCache,
+        project.menuItemIdCache,
+        project.fragmentCache,
+        project.latestItems,
+        project.userResolver.cache
+    ]:
+        cache.clear()
+
+
+@pytest.fixture
+def app():
+    from project import app
+
+    app.config['TESTING'] = True
+    clearCaches()
+
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def addMenuItem(client, categorySlug, name, slug, description=None):
+    return client.post('/catalogue/{}'.format(categorySlug), data={
+        'name': name, 'slug': slug, 'description': description or ''
+    })
+
+
+def editMenuItem(client, categorySlug, menuSlug, name, slug, description=None):
+    return client.post(
+        '/catalogue/{}/{}/edit'.format(categorySlug, menuSlug),
+        data={
+            '_method': 'PUT',
+            'name': name,
+            'slug': slug,
+            'description': description or ''
+        }
+    )
+
+
+def deleteMenuItem(client, categorySlug, menuSlug):
+    return client.post(
+        '/catalogue/{}/{}/delete'.format(categorySlug, menuSlug),
+        data={'_method': 'DELETE'}
+    )
+
+
+@pytest.fixture
+def owner(client):
+    """A client logged in as the seeded user, who owns every category."""
+    import config
+    from models import User
+    from sqlalchemy import select
+
+    with config.engine.connect() as connection:
+        userId = connection.execute(select([User.id]).where(
+            User.email == os.environ['USER_EMAIL_FOR_DB_SEEDS']
+        )).scalar()
+    with client.session_transaction() as session:
+        session['username'] = os.environ['USER_NAME_FOR_DB_SEEDS']
+        session['email'] = os.environ['USER_EMAIL_FOR_DB_SEEDS']
+        session['user_id'] = userId
+
+    return client
+
+
+@pytest.fixture(scope='module')
+def postgres():
+    """
+        An engine of the database at `TEST_POSTGRES_URL`, where the tables
+        are created & filled with the rows of the test database (& dropped
+        afterwards) @see tests/test_indexes.py & tests/test_export.py
+    """
+    import config
+    from models import Base, Category, MenuItem, User
+    from sqlalchemy import create_engine, select
+
+    url = os.environ.get('TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip('TEST_POSTGRES_URL is not set')
+    pytest.importorskip('psycopg2')
+
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    try:
+        with config.engine.connect() as source, engine.begin() as target:
+            for table in [
+                User.__table__, Category.__table__, MenuItem.__table__
+            ]:
+                target.execute(table.insert(), [
+                    dict(row._mapping)
+                    for row in source.execute(select([table]))
+                ])
+            target.exec_driver_sql('ANALYZE')
+
+        yield engine
+    finally:
+        Base.metadata.drop_all(engine)
+        engine.dispose()
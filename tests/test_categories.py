@@ -0,0 +1,87 @@
+"""
+    The sidebar lists the categories out of a cache shared by all the
+    requests @see app/project.py, instead of the session cookie of every
+    visitor, so neither the cookie nor the request grows with the number of
+    categories.
+"""
+
+
+from models import Category
+import project
+import pytest
+import templating
+import time
+
+
+@pytest.fixture
+def addCategories():
+    """Adds categories, which are deleted after the test."""
+    dbSession = project.DBSession()
+    added = []
+
+    def add(count, prefix='Extra'):
+        categories = [
+            Category(
+                name='{} {}'.format(prefix, i),
+                slug='{}_{}'.format(prefix.lower(), i)
+            )
+            for i in range(len(added), len(added) + count)
+        ]
+        dbSession.add_all(categories)
+        dbSession.commit()
+        added.extend(categories)
+
+        return categories
+
+    yield add
+
+    for category in added:
+        dbSession.delete(category)
+    dbSession.commit()
+    dbSession.close()
+
+
+def test_session_cookie_does_not_grow_with_the_categories(
+    app, addCategories
+):
+    rows = []
+    for count in [0, 1000]:
+        addCategories(count)
+        start = time.perf_counter()
+        response = app.test_client().get('/login')
+        elapsed = time.perf_counter() - start
+        cookie = response.headers['Set-Cookie'].split(';')[0]
+        rows.append((count, len(cookie), len(response.data), elapsed))
+
+    for count, cookieSize, bodySize, elapsed in rows:
+        print('{:>5} extra categories: cookie {} bytes, page {} bytes, '
+              '{:.1f} ms'.format(count, cookieSize, bodySize, elapsed * 1000))
+    assert rows[0][1] == rows[1][1]
+    # The sidebar lists all of them
+    assert rows[1][2] > rows[0][2]
+
+
+def test_sidebar_lists_the_committed_categories(client, addCategories):
+    assert b'Curling 0' not in client.get('/').data
+
+    [category] = addCategories(1, prefix='Curling')
+    assert b'Curling 0' in client.get('/').data
+
+    dbSession = project.DBSession.object_session(category)
+    category.name = 'Bobsleigh'
+    dbSession.commit()
+    page = client.get('/').data
+    assert b'Curling 0' not in page
+    assert b'Bobsleigh' in page
+
+
+def test_cached_sidebar_renders_faster(app):
+    rows = templating.benchmark(app, [10, 1000], 3)
+    for count, name, rendered, cached in rows:
+        print('{:>5} categories {:>14}: {:.2f} ms, cached {:.2f} ms'.format(
+            count, name, rendered * 1000, cached * 1000
+        ))
+
+    for count, name, rendered, cached in rows:
+        if count == 1000:
+            assert cached < rendered, name
@@ -0,0 +1,49 @@
+import export_catalogue
+import io
+import json
+from models import MenuItem
+import pytest
+
+
+def export(outputFormat='json', workers=1):
+    output = io.StringIO()
+    export_catalogue.export(output, outputFormat, workers, chunkSize=7)
+
+    return output.getvalue()
+
+
+def test_export_matches_the_api(client):
+    assert export() == client.get('/catalogue.json').get_data(as_text=True)
+
+    lines = export('ndjson').splitlines()
+    assert [json.loads(line) for line in lines] == json.loads(
+        export()
+    )['categories']
+
+
+@pytest.mark.parametrize('outputFormat', ['json', 'ndjson'])
+def test_workers_export_a_snapshot(postgres, monkeypatch, outputFormat):
+    monkeypatch.setattr(export_catalogue, 'engine', postgres)
+    expected = export(outputFormat)
+    writeShards = export_catalogue.writeShards
+
+    def writeShardsAfterAWrite(*args):
+        """Adds a menu item once the snapshot was taken."""
+        with postgres.begin() as connection:
+            connection.execute(MenuItem.__table__.insert().values(
+                id=1000000, name='Late Item', slug='late_item', category_id=1
+            ))
+
+        return writeShards(*args)
+
+    monkeypatch.setattr(
+        export_catalogue, 'writeShards', writeShardsAfterAWrite
+    )
+    try:
+        assert export(outputFormat, workers=2) == expected
+        assert export(outputFormat) != expected
+    finally:
+        with postgres.begin() as connection:
+            connection.execute(MenuItem.__table__.delete().where(
+                MenuItem.id == 1000000
+            ))
@@ -0,0 +1,22 @@
+import cache
+import config
+import identity
+
+
+def test_concurrent_logins_resolve_a_single_user():
+    conflicts, timings = identity.benchmark(config.engine, 8, 50)
+
+    print('Login resolved by the database {:.1f} us, by the cache {:.1f} us'
+          .format(timings['database'] * 1e6, timings['cache'] * 1e6))
+    assert conflicts == 0
+    assert timings['cache'] < timings['database']
+
+
+def test_resolver_returns_the_existing_user():
+    resolver = identity.UserResolver(config.engine, cache.LocalCache())
+    userId = resolver.resolve('seeder@example.com')
+    assert userId is not None
+
+    other = identity.UserResolver(config.engine, cache.LocalCache())
+    assert other.resolve('seeder@example.com', name='Seeder') == userId
+    assert resolver.cache.get('seeder@example.com') == userId
@@ -0,0 +1,123 @@
+"""
+    The hot queries have to be served by the indexes of the migration 0001
+    @see app/migrate.py: the statements run by each route are recorded &
+    explained on SQLite, & on PostgreSQL when `TEST_POSTGRES_URL` is set.
+"""
+
+
+from conftest import clearCaches
+import config
+from contextlib import contextmanager
+from models import Category, MenuItem, User
+import pytest
+from sqlalchemy import desc, event, select
+from sqlalchemy.sql import Select
+
+
+# The indexes the plans of the statements run by a route have to use
+hotRoutes = [
+    ('/', ['ix_menu_items_created_at']),
+    ('/catalogue/cricket/items', ['ix_menu_items_category_id_created_at']),
+    (
+        '/catalogue/cricket/items?after={after}',
+        ['ix_menu_items_category_id_created_at']
+    ),
+    (
+        '/catalogue.json',
+        ['ix_categories_created_at', 'ix_menu_items_category_id_created_at']
+    ),
+    ('/catalogue.json/cricket', ['ix_menu_items_category_id_created_at']),
+    (
+        '/feeds/categories/cricket.json',
+        ['ix_menu_items_category_id_created_at']
+    )
+]
+
+
+@contextmanager
+def recordStatements(engine):
+    """Records the SELECT statements run through `engine`."""
+    statements = []
+
+    def record(connection, statement, multiparams, params, options):
+        if isinstance(statement, Select):
+            statements.append(statement)
+
+    event.listen(engine, 'before_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_execute', record)
+
+
+def getStatements(client, url):
+    """Returns the SELECT statements run to answer a GET of `url`."""
+    users = User.__table__
+    categories = Category.__table__
+    menuItems = MenuItem.__table__
+    with config.engine.connect() as connection:
+        after = connection.execute(
+            select([menuItems.c.id]).select_from(
+                menuItems.join(categories)
+            ).where(categories.c.slug == 'cricket').order_by(
+                desc(menuItems.c.created_at), menuItems.c.id
+            ).limit(1)
+        ).scalar()
+
+    clearCaches()
+    with recordStatements(config.engine) as statements:
+        response = client.get(url.format(after=after))
+        response.get_data()
+        response.close()
+    assert response.status_code == 200
+
+    return statements + [
+        select([users.c.id]).where(users.c.email == 'seeder@example.com')
+    ]
+
+
+def explainOnSqlite(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect)
+    parameters = compiled.construct_params()
+
+    return [
+        row.detail for row in connection.exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + compiled.string,
+            tuple(parameters[name] for name in compiled.positiontup)
+        )
+    ]
+
+
+def explainOnPostgres(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect)
+
+    return connection.exec_driver_sql(
+        'EXPLAIN ' + compiled.string, compiled.construct_params()
+    ).scalars().all()
+
+
+@pytest.mark.parametrize('url, indexes', hotRoutes)
+def test_sqlite_plans_use_the_indexes(client, url, indexes):
+    statements = getStatements(client, url)
+    with config.engine.connect() as connection:
+        plans = [explainOnSqlite(connection, s) for s in statements]
+
+    details = [detail for plan in plans for detail in plan]
+    for index in indexes + ['ix_users_email']:
+        assert any(index in detail for detail in details), (index, plans)
+
+
+@pytest.mark.parametrize('url, indexes', hotRoutes)
+def test_postgres_plans_use_the_indexes(client, postgres, url, indexes):
+    statements = getStatements(client, url)
+    with postgres.connect() as connection:
+        # The test tables are small enough for the planner to rather scan &
+        # sort them, so the plans only show whether the indexes can serve
+        # the statements at all.
+        connection.exec_driver_sql('SET enable_seqscan = off')
+        connection.exec_driver_sql('SET enable_sort = off')
+        plans = [explainOnPostgres(connection, s) for s in statements]
+
+    lines = [line for plan in plans for line in plan]
+    for index in indexes + ['ix_users_email']:
+        assert any(index in line for line in lines), (index, plans)
@@ -0,0 +1,61 @@
+"""
+    Requests get a database session & connection of their own out of the
+    pool @see app/config.py, so the time they spend waiting for the database
+    overlaps across the threads of a server instead of adding up.
+"""
+
+
+import config
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from sqlalchemy import event
+import time
+
+
+# Seconds every SQL statement waits, standing in for the round trip to a
+# database server
+statementLatency = 0.01
+requestsPerThread = 8
+
+
+@contextmanager
+def slowStatements(engine, latency):
+    def wait(connection, cursor, statement, parameters, context, many):
+        time.sleep(latency)
+
+    event.listen(engine, 'before_cursor_execute', wait)
+    try:
+        yield
+    finally:
+        event.remove(engine, 'before_cursor_execute', wait)
+
+
+def measureThroughput(app, threads, url):
+    """Returns the requests per second served by `threads` threads."""
+    def run(i):
+        client = app.test_client()
+        return [
+            client.get(url).status_code for j in range(requestsPerThread)
+        ]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        statuses = [s for r in executor.map(run, range(threads)) for s in r]
+    elapsed = time.perf_counter() - start
+
+    assert statuses == [200] * threads * requestsPerThread
+
+    return len(statuses) / elapsed
+
+
+def test_throughput_scales_with_threads(app):
+    with slowStatements(config.engine, statementLatency):
+        throughputs = {
+            threads: measureThroughput(
+                app, threads, '/catalogue.json/cricket'
+            )
+            for threads in [1, 4]
+        }
+
+    print('Requests per second by threads: {}'.format(throughputs))
+    assert throughputs[4] > 2 * throughputs[1]
@@ -0,0 +1,93 @@
+"""
+    Menu items are looked up by their slugs through `resolveMenuItemId`,
+    whose ids are cached in `menuItemIdCache` @see app/project.py
+"""
+
+
+from models import MenuItem
+import project
+import pytest
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import NoResultFound
+import time
+
+
+def getMenuItemByQuery(dbSession, categorySlug, menuSlug):
+    """The lookup `getMenuItem` replaced: an ORM query & a joinedload."""
+    menuItem = dbSession.query(MenuItem).options(
+        joinedload(MenuItem.category)
+    ).filter_by(slug=menuSlug).one()
+    if menuItem.category.slug != categorySlug:
+        raise NoResultFound
+
+    return menuItem
+
+
+def timeLookups(lookup, clearCache=False, count=300, repeat=5):
+    """Returns the best time taken per lookup of `count` in a row."""
+    timings = []
+    with project.DBSession() as dbSession:
+        lookup(dbSession, 'cricket', 'cricket_ball')
+        for i in range(repeat):
+            start = time.perf_counter()
+            for j in range(count):
+                if clearCache:
+                    project.menuItemIdCache.clear()
+                lookup(dbSession, 'cricket', 'cricket_ball')
+            timings.append((time.perf_counter() - start) / count)
+
+    return min(timings)
+
+
+def test_menu_items_are_found_by_both_slugs(app):
+    with project.DBSession() as dbSession:
+        menuItem = project.getMenuItem(dbSession, 'cricket', 'cricket_ball')
+        assert (menuItem.slug, menuItem.category.slug) == (
+            'cricket_ball', 'cricket'
+        )
+        assert project.menuItemIdCache.get('cricket/cricket_ball') == (
+            menuItem.id
+        )
+
+        with pytest.raises(NoResultFound):
+            project.getMenuItem(dbSession, 'soccer', 'cricket_ball')
+        assert project.menuItemIdCache.get('soccer/cricket_ball') is None
+
+
+def test_stale_ids_are_looked_up_again(app):
+    with project.DBSession() as dbSession:
+        ball = project.getMenuItem(dbSession, 'cricket', 'cricket_ball')
+        bat = project.getMenuItem(dbSession, 'cricket', 'cricket_bat')
+        # As left by another process before the ball was renamed
+        project.menuItemIdCache.set('cricket/cricket_ball', bat.id)
+
+        assert project.getMenuItem(
+            dbSession, 'cricket', 'cricket_ball'
+        ) is ball
+        assert project.menuItemIdCache.get('cricket/cricket_ball') == ball.id
+
+
+def test_menu_item_lookup_latency(app):
+    timings = [
+        ('ORM query & joinedload', timeLookups(getMenuItemByQuery)),
+        ('getMenuItem, id cached', timeLookups(project.getMenuItem)),
+        ('getMenuItem, id not cached', timeLookups(
+            project.getMenuItem, clearCache=True
+        )),
+        ('resolveMenuItemId, id cached', timeLookups(
+            project.resolveMenuItemId
+        )),
+        ('resolveMenuItemId, id not cached', timeLookups(
+            project.resolveMenuItemId, clearCache=True
+        ))
+    ]
+
+    for name, elapsed in timings:
+        print('{:<34} {:>7.1f} us per lookup'.format(name, elapsed * 1e6))
+    timings = dict(timings)
+    assert timings['getMenuItem, id cached'] < (
+        timings['ORM query & joinedload']
+    )
+    assert timings['resolveMenuItemId, id cached'] < (
+        timings['resolveMenuItemId, id not cached'] / 10
+    )
@@ -0,0 +1,41 @@
+from flask import Flask
+import metrics
+import pytest
+from sqlalchemy import create_engine, text
+
+
+@pytest.fixture
+def budgetApp():
+    """An app whose only route runs 2 SQL statements, over its budget."""
+    engine = create_engine('sqlite://')
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    metrics.init_app(app, [engine])
+
+    @app.route('/')
+    @metrics.query_budget(1)
+    def index():
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+            connection.execute(text('SELECT 2'))
+
+        return 'ok'
+
+    return app
+
+
+def test_exceeded_query_budget_is_logged(budgetApp, monkeypatch, caplog):
+    monkeypatch.setattr(metrics.config, 'QUERY_BUDGET_STRICT', False)
+
+    with caplog.at_level('WARNING', logger=budgetApp.logger.name):
+        response = budgetApp.test_client().get('/')
+
+    assert response.status_code == 200
+    assert 'index ran 2 SQL statements, its budget is 1.' in caplog.messages
+
+
+def test_exceeded_query_budget_fails_when_strict(budgetApp, monkeypatch):
+    monkeypatch.setattr(metrics.config, 'QUERY_BUDGET_STRICT', True)
+
+    with pytest.raises(metrics.QueryBudgetExceeded):
+        budgetApp.test_client().get('/')
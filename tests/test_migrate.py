@@ -0,0 +1,37 @@
+from models import Base, Category, User
+import migrate
+from sqlalchemy import create_engine, select
+
+
+def test_lookup_indexes_merge_the_users_sharing_an_email(tmp_path):
+    engine = create_engine('sqlite:///{}'.format(tmp_path / 'migrate.db'))
+    Base.metadata.create_all(engine)
+    users = User.__table__
+    categories = Category.__table__
+    with engine.begin() as connection:
+        migrate.AddLookupIndexes().downgrade(connection)
+        connection.execute(users.insert(), [
+            {'id': 1, 'name': 'A', 'email': 'a@example.com'},
+            {'id': 2, 'name': 'B', 'email': 'b@example.com'},
+            {'id': 3, 'name': 'A', 'email': 'a@example.com'},
+            {'id': 4, 'name': 'A', 'email': 'a@example.com'}
+        ])
+        connection.execute(categories.insert(), [
+            {'id': 1, 'user_id': 3, 'name': 'One', 'slug': 'one'},
+            {'id': 2, 'user_id': 4, 'name': 'Two', 'slug': 'two'},
+            {'id': 3, 'user_id': 2, 'name': 'Three', 'slug': 'three'}
+        ])
+
+    with engine.begin() as connection:
+        migrate.AddLookupIndexes().upgrade(connection)
+
+    with engine.connect() as connection:
+        assert migrate.hasIndex(connection, migrate.getIndex(
+            'users', 'ix_users_email'
+        ))
+        assert connection.execute(
+            select([users.c.id]).order_by(users.c.id)
+        ).scalars().all() == [1, 2]
+        assert connection.execute(
+            select([categories.c.user_id]).order_by(categories.c.id)
+        ).scalars().all() == [1, 1, 2]
@@ -0,0 +1,207 @@
+"""
+    The Facebook login goes through a fake Graph API served on localhost,
+    which also stands in for the Google endpoints @see app/http_client.py
+"""
+
+
+import config
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import http_client
+import json
+from models import User
+from oauth2client.client import OAuth2WebServerFlow
+import project
+import pytest
+import statistics
+import threading
+import time
+
+
+class FakeGraphAPI(BaseHTTPRequestHandler):
+    """Answers the calls made by `fbconnect` after `delay` seconds."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    delay = 0
+    url = None
+    calls = []
+    bodies = {
+        '/oauth/access_token': {'access_token': 'token'},
+        '/me': {'name': 'Fake User', 'email': 'fake@example.com', 'id': '42'},
+        '/me/picture': {'data': {'url': 'http://localhost/picture.png'}},
+        '/o/oauth2/revoke': {},
+        '/token': {'access_token': 'google-token', 'expires_in': 3600}
+    }
+
+    def do_GET(self):
+        start = time.perf_counter()
+        time.sleep(self.delay)
+        path = self.path.split('?')[0].replace(
+            '/{}'.format(config.FB_VERSION), '', 1
+        )
+        body = json.dumps(self.bodies.get(path, {})).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.calls.append(
+            (path, self.client_address[1], start, time.perf_counter())
+        )
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.do_GET()
+
+    def do_DELETE(self):
+        time.sleep(self.delay)
+        body = b'{"success": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGraphAPI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(FakeGraphAPI, 'calls', [])
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    monkeypatch.setattr(config, 'FB_GRAPH_URL', url)
+    monkeypatch.setattr(config, 'GOOGLE_ACCOUNTS_URL', url)
+    monkeypatch.setattr(FakeGraphAPI, 'url', url)
+
+    yield FakeGraphAPI
+
+    server.shutdown()
+    server.server_close()
+    with project.DBSession() as dbSession:
+        dbSession.query(User).filter(
+            User.email == 'fake@example.com'
+        ).delete()
+        dbSession.commit()
+
+
+def logIn(client):
+    client.get('/login')
+    with client.session_transaction() as session:
+        state = session['state']
+
+    start = time.perf_counter()
+    response = client.post('/fbconnect?state=' + state, data='short-token')
+
+    return response, time.perf_counter() - start
+
+
+def test_fbconnect_logs_in(client, provider, monkeypatch):
+    monkeypatch.setattr(provider, 'delay', 0.1)
+    client.get('/login')
+    sessionId = client.get_cookie('session').value
+
+    response, elapsed = logIn(client)
+
+    assert response.status_code == 200
+    assert b'Welcome, Fake User' in response.data
+    with client.session_transaction() as session:
+        assert session['email'] == 'fake@example.com'
+        assert session['user_id'] is not None
+    assert client.get_cookie('session').value != sessionId
+
+    # /me & /me/picture are called at the same time
+    calls = {path: (start, end) for path, port, start, end in provider.calls}
+    assert calls['/me'][0] < calls['/me/picture'][1]
+    assert calls['/me/picture'][0] < calls['/me'][1]
+
+
+def test_logout_rotates_the_session(client, provider):
+    interface = project.sessionInterface
+    signer = interface.get_signer(client.application)
+    logIn(client)
+    sessionId = signer.unsign(client.get_cookie('session').value)
+
+    client.post('/logout')
+
+    assert signer.unsign(client.get_cookie('session').value) != sessionId
+    assert interface.store.load(sessionId.decode('utf-8')) is None
+
+
+def test_connections_to_the_provider_are_reused(client, provider):
+    for i in range(3):
+        assert logIn(client)[0].status_code == 200
+
+    # At most 2 connections, for the 2 calls made at the same time
+    assert len(provider.calls) == 9
+    assert len(set(port for path, port, s, e in provider.calls)) <= 2
+
+
+def test_slow_provider_fails_the_login(client, provider, monkeypatch):
+    monkeypatch.setattr(provider, 'delay', 0.5)
+    monkeypatch.setattr(config, 'OAUTH_READ_TIMEOUT', 0.1)
+
+    response, elapsed = logIn(client)
+
+    assert response.status_code == 502
+    # The first call timed out, with its retries
+    assert elapsed < 2
+
+
+def test_login_latency(client, provider, monkeypatch):
+    monkeypatch.setattr(provider, 'delay', 0.05)
+    timings = sorted(logIn(client)[1] for i in range(10))
+
+    print('fbconnect with 3 calls of 50 ms: median {:.1f} ms, '
+          'max {:.1f} ms'.format(
+              statistics.median(timings) * 1000, timings[-1] * 1000
+          ))
+    # The calls to /me & /me/picture overlap, the token exchange does not
+    assert statistics.median(timings) < 3 * provider.delay
+
+
+def test_slow_provider_still_logs_out(client, provider, monkeypatch):
+    logIn(client)
+    monkeypatch.setattr(provider, 'delay', 0.5)
+    monkeypatch.setattr(config, 'OAUTH_READ_TIMEOUT', 0.1)
+
+    response = client.post('/logout')
+
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert 'username' not in session
+
+
+def test_slow_provider_fails_the_revocation(client, provider, monkeypatch):
+    monkeypatch.setattr(provider, 'delay', 0.5)
+    monkeypatch.setattr(config, 'OAUTH_READ_TIMEOUT', 0.1)
+    with client.session_transaction() as session:
+        session['access_token'] = 'google-token'
+        session['username'] = 'Fake User'
+
+    response = client.get('/gdisconnect')
+
+    assert response.status_code == 400
+    assert response.json == 'Failed to revoke token for given user.'
+    with client.session_transaction() as session:
+        assert session['access_token'] == 'google-token'
+
+
+def test_code_exchange_goes_through_the_pool(provider):
+    flow = OAuth2WebServerFlow(
+        client_id='client',
+        client_secret='secret',
+        scope='',
+        redirect_uri='postmessage',
+        token_uri=provider.url + '/token'
+    )
+
+    for i in range(2):
+        credentials = flow.step2_exchange(
+            'code', http=http_client.httplib2Client
+        )
+        assert credentials.access_token == 'google-token'
+
+    assert len(set(port for path, port, s, e in provider.calls)) == 1
@@ -0,0 +1,120 @@
+from conftest import addMenuItem, deleteMenuItem, editMenuItem
+import feeds
+import project
+import pytest
+
+
+# Key => url of the pages cached by the tests
+pages = {
+    'home': '/',
+    'category:cricket': '/catalogue/cricket/items',
+    'category:soccer': '/catalogue/soccer/items',
+    'item:cricket:wicket': '/catalogue/cricket/wicket',
+    'item:cricket:cricket_bat': '/catalogue/cricket/cricket_bat',
+    'item:soccer:soccer_ball': '/catalogue/soccer/soccer_ball'
+}
+
+
+def getCachedPages():
+    return {key for key in pages if project.pageCache.get(key) is not None}
+
+
+@pytest.fixture
+def visitor(app):
+    """A client which never logs in."""
+    return app.test_client()
+
+
+def test_anonymous_pages_are_cached(visitor):
+    hits = project.pageCache.stats()['hits']
+
+    first = visitor.get('/catalogue/cricket/items')
+    second = visitor.get('/catalogue/cricket/items')
+
+    assert second.status_code == 200
+    assert second.data == first.data
+    assert project.pageCache.stats()['hits'] == hits + 1
+
+
+def test_later_pages_of_a_category_are_not_cached(visitor):
+    visitor.get('/catalogue/cricket/items?after=1')
+
+    assert getCachedPages() == set()
+
+
+@pytest.mark.parametrize('change, evicted', [
+    (
+        lambda owner: addMenuItem(owner, 'cricket', 'Stumps', 'stumps'),
+        {'home', 'category:cricket'}
+    ),
+    (
+        lambda owner: editMenuItem(
+            owner, 'cricket', 'wicket', 'Wicket Keeper', 'wicket'
+        ),
+        {'home', 'category:cricket', 'item:cricket:wicket'}
+    ),
+    (
+        lambda owner: deleteMenuItem(owner, 'cricket', 'wicket'),
+        {'home', 'category:cricket', 'item:cricket:wicket'}
+    )
+], ids=['add', 'edit', 'delete'])
+def test_changes_only_evict_the_affected_pages(owner, visitor, change,
+                                               evicted):
+    addMenuItem(owner, 'cricket', 'Wicket', 'wicket')
+    try:
+        project.pageCache.clear()
+        for url in pages.values():
+            assert visitor.get(url).status_code == 200
+        assert getCachedPages() == set(pages)
+
+        assert change(owner).status_code == 302
+
+        assert getCachedPages() == set(pages) - evicted
+    finally:
+        for slug in ['wicket', 'stumps']:
+            deleteMenuItem(owner, 'cricket', slug)
+
+
+def test_logged_in_visitors_bypass_the_cache(owner, visitor):
+    visitor.get('/')
+    stats = project.pageCache.stats()
+
+    response = owner.get('/')
+
+    assert b'action="/logout"' in response.data
+    assert b'action="/logout"' not in visitor.get('/').data
+    assert project.pageCache.stats() == {
+        'hits': stats['hits'] + 1, 'misses': stats['misses']
+    }
+
+
+def test_writers_read_their_own_writes(owner, visitor):
+    """Another process, whose feeds & pages predate the write, serves it."""
+    visitor.get('/')
+    stale = {
+        key: cache.get(key) for cache, key in [
+            (project.latestItems.cache, feeds.getFeedKey()),
+            (project.pageCache, 'home')
+        ]
+    }
+    with owner.session_transaction() as session:
+        loggedIn = dict(session)
+    addMenuItem(owner, 'cricket', 'Gully Bat', 'gully_bat')
+    try:
+        project.latestItems.cache.set(
+            feeds.getFeedKey(), stale[feeds.getFeedKey()]
+        )
+        project.pageCache.set('home', stale['home'])
+
+        assert owner.get_cookie(project.ownWritesCookieName) is not None
+        assert b'Gully Bat' in owner.get('/').data
+        assert b'Gully Bat' in owner.get('/feeds/latest.json').data
+
+        # Still theirs once logged out, other visitors wait for the caches
+        owner.post('/logout')
+        assert b'Gully Bat' in owner.get('/').data
+        assert b'Gully Bat' not in visitor.get('/').data
+    finally:
+        with owner.session_transaction() as session:
+            session.update(loggedIn)
+        deleteMenuItem(owner, 'cricket', 'gully_bat')
@@ -0,0 +1,140 @@
+"""
+    The token buckets are checked with each limiter: in the process, & in
+    cache.py's in-process stand-in for a shared store, both through its
+    `get` & `set` & through a Python port of the Lua script run by redis.
+    The script itself is run when a redis server is given in
+    `TEST_REDIS_URL`.
+"""
+
+
+import cache
+import config
+import os
+import pytest
+import ratelimit
+import types
+
+
+class Clock(object):
+    """Stands in for `time` in app/ratelimit.py."""
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+
+class ScriptedStore(cache.LocalStore):
+    """
+        `cache.LocalStore` running the Lua script of `SharedLimiter` the
+        way redis would, ported to Python.
+    """
+
+    def register_script(self, script):
+        assert script == ratelimit.SharedLimiter.script
+
+        def run(keys, args):
+            rate, burst, cost, now = [float(a) for a in args]
+            tokens = burst
+            state = self.get(keys[0])
+            if state:
+                tokens, updatedAt = [float(v) for v in state.split(':')]
+                tokens = min(burst, tokens + max(0, now - updatedAt) * rate)
+            allowed = 0
+            if tokens >= cost:
+                tokens -= cost
+                allowed = 1
+            self.set(keys[0], '{}:{}'.format(tokens, args[3]))
+
+            return [allowed, repr(tokens).encode('ascii')]
+
+        return run
+
+
+def makeRedisLimiter():
+    if not os.environ.get('TEST_REDIS_URL'):
+        pytest.skip('TEST_REDIS_URL is not set.')
+
+    import redis
+    client = redis.StrictRedis.from_url(os.environ['TEST_REDIS_URL'])
+    for key in client.scan_iter('test_ratelimit:*'):
+        client.delete(key)
+
+    return ratelimit.SharedLimiter(client, namespace='test_ratelimit')
+
+
+@pytest.fixture(params=['local', 'shared', 'scripted', 'redis'])
+def clock(request, monkeypatch):
+    """Enables the rate limit, 3 tokens & 1 more per second."""
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', types.SimpleNamespace(
+        time=clock.time
+    ))
+    monkeypatch.setattr(config, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(config, 'RATE_LIMIT_RATE', 1.0)
+    monkeypatch.setattr(config, 'RATE_LIMIT_BURST', 3.0)
+    monkeypatch.setattr(ratelimit, 'limiter', {
+        'local': lambda: ratelimit.LocalLimiter(),
+        'shared': lambda: ratelimit.SharedLimiter(cache.LocalStore()),
+        'scripted': lambda: ratelimit.SharedLimiter(ScriptedStore()),
+        'redis': makeRedisLimiter
+    }[request.param]())
+
+    return clock
+
+
+def getItem(client, **kwargs):
+    """Gets a menu item through the JSON API, which costs 1 token."""
+    return client.get(
+        '/catalogue.json/cricket/cricket_ball', **kwargs
+    ).status_code
+
+
+def test_spent_bucket_is_refused_until_refilled(client, clock):
+    assert [getItem(client) for i in range(3)] == [200] * 3
+
+    response = client.get('/catalogue.json/cricket')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+    assert response.json['message'] == 'Too many requests, please slow down.'
+
+    clock.now += 1
+    assert getItem(client) == 200
+    assert getItem(client) == 429
+
+    clock.now += 60
+    assert [getItem(client) for i in range(4)] == [200] * 3 + [429]
+
+
+def test_visitors_are_limited_by_ip(client, clock):
+    assert [getItem(client) for i in range(4)] == [200] * 3 + [429]
+
+    assert getItem(client, environ_base={'REMOTE_ADDR': '10.0.0.2'}) == 200
+
+
+def test_users_are_limited_wherever_they_are(owner, app, clock):
+    assert [getItem(owner) for i in range(3)] == [200] * 3
+    assert getItem(
+        owner, environ_base={'REMOTE_ADDR': '10.0.0.2'}
+    ) == 429
+
+    # Other visitors from the same IP keep their own bucket
+    assert getItem(app.test_client()) == 200
+
+
+def test_requests_above_the_concurrency_are_shed(client, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'admission', ratelimit.AdmissionControl(1))
+
+    streamed = client.get('/catalogue.json', buffered=False)
+    assert streamed.status_code == 200
+
+    # The streamed catalogue is served until its response is closed
+    response = client.get('/catalogue.json/cricket')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+    assert b''.join(streamed.response).startswith(b'{"categories":')
+    streamed.close()
+    assert ratelimit.admission.inFlight == 0
+    assert client.get('/catalogue.json/cricket').status_code == 200
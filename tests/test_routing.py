@@ -0,0 +1,158 @@
+"""
+    Requests go through an app of their own, reading from a primary & from
+    replicas which are separate Sqlite files, each holding its own name.
+"""
+
+
+from flask import Flask
+import pytest
+import routing
+from sqlalchemy import Column, Integer, String, create_engine, event
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import scoped_session, sessionmaker
+import time
+
+
+Base = declarative_base()
+
+
+class Source(Base):
+    __tablename__ = 'sources'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(20), nullable=False)
+
+
+def makeDatabase(directory, name):
+    engine = create_engine('sqlite:///{}'.format(directory / name))
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(Source.__table__.insert().values(name=name))
+
+    return engine
+
+
+def makeApp(primary, replicas, monkeypatch):
+    """Returns an app whose routes tell which database they read from."""
+    monkeypatch.setattr(routing, 'replicas', replicas)
+    sessionFactory = sessionmaker(bind=primary, class_=routing.RoutingSession)
+    session = scoped_session(sessionFactory)
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    routing.init_app(app, sessionFactory, session)
+
+    @app.teardown_appcontext
+    def removeSession(exception=None):
+        session.remove()
+
+    def readSource():
+        name = session.query(Source.name).order_by(Source.id).first()[0]
+
+        return name, 200, {'X-Source': name}
+
+    @app.route('/source', methods=['GET', 'OPTIONS'])
+    def showSource():
+        return readSource()
+
+    @app.route('/source', methods=['POST'])
+    def addSource():
+        session.add(Source(name='added'))
+        session.flush()
+        response = readSource()
+        session.commit()
+
+        return response
+
+    @app.route('/source/noop', methods=['POST'])
+    def touchSource():
+        return readSource()
+
+    return app
+
+
+@pytest.fixture
+def databases(tmp_path):
+    engines = [
+        makeDatabase(tmp_path, name)
+        for name in ['primary', 'replica1', 'replica2']
+    ]
+
+    yield engines
+
+    for engine in engines:
+        engine.dispose()
+
+
+@pytest.mark.parametrize('strategy', ['round_robin', 'least_latency'])
+def test_reads_go_to_the_replica(databases, strategy, monkeypatch):
+    primary, replica = databases[:2]
+    client = makeApp(
+        primary, routing.ReplicaSet([replica], strategy), monkeypatch
+    ).test_client()
+
+    assert client.get('/source').data == b'replica1'
+    assert client.head('/source').headers['X-Source'] == 'replica1'
+    assert client.options('/source').data == b'replica1'
+    assert client.get_cookie(routing.pinCookieName) is None
+
+
+def test_writes_go_to_the_primary(databases, monkeypatch):
+    primary, replica = databases[:2]
+    client = makeApp(
+        primary, routing.ReplicaSet([replica], 'round_robin'), monkeypatch
+    ).test_client()
+
+    # Read after a write, from the primary which has the new row
+    assert client.post('/source').data == b'primary'
+    with primary.connect() as connection:
+        assert connection.execute(
+            Source.__table__.select().where(Source.name == 'added')
+        ).fetchall()
+
+    # Pinned to the primary until the cookie expires
+    assert client.get_cookie(routing.pinCookieName).value == '1'
+    assert client.get('/source').data == b'primary'
+    assert client.head('/source').headers['X-Source'] == 'primary'
+
+    client.delete_cookie(routing.pinCookieName)
+    assert client.get('/source').data == b'replica1'
+
+
+def test_requests_which_write_nothing_are_not_pinned(databases, monkeypatch):
+    primary, replica = databases[:2]
+    client = makeApp(
+        primary, routing.ReplicaSet([replica], 'round_robin'), monkeypatch
+    ).test_client()
+
+    assert client.post('/source/noop').data == b'primary'
+    assert client.get_cookie(routing.pinCookieName) is None
+
+
+def test_round_robin_takes_the_replicas_in_turn(databases, monkeypatch):
+    primary, replica1, replica2 = databases
+    client = makeApp(
+        primary,
+        routing.ReplicaSet([replica1, replica2], 'round_robin'),
+        monkeypatch
+    ).test_client()
+
+    assert [client.get('/source').data for i in range(4)] == [
+        b'replica1', b'replica2', b'replica1', b'replica2'
+    ]
+
+
+def test_least_latency_prefers_the_fastest_replica(databases, monkeypatch):
+    primary, slow, fast = databases
+
+    def delay(connection, cursor, statement, parameters, context, many):
+        time.sleep(0.01)
+
+    replicas = routing.ReplicaSet([slow, fast], 'least_latency')
+    # After the listener starting the clock, so that the delay is measured
+    event.listen(slow, 'before_cursor_execute', delay)
+    client = makeApp(primary, replicas, monkeypatch).test_client()
+
+    # Both start at 0 & the first is picked, until its latency shows
+    assert client.get('/source').data == b'replica1'
+    assert [client.get('/source').data for i in range(3)] == [b'replica2'] * 3
+    assert replicas.latencies[slow] > replicas.latencies[fast]
@@ -0,0 +1,75 @@
+"""
+    Search goes through each backend of app/search.py in turn: the FTS5
+    table of the test database & the in-process inverted index.
+"""
+
+
+from conftest import addMenuItem, deleteMenuItem, editMenuItem
+import config
+import project
+import pytest
+import search
+from sqlalchemy.exc import IntegrityError
+
+
+@pytest.fixture(params=['fts5', 'memory'])
+def index(request, monkeypatch):
+    if request.param == 'fts5':
+        with config.engine.connect() as connection:
+            if search.getSearchIndex(connection).__class__ is not (
+                search.SqliteSearchIndex
+            ):
+                pytest.skip('The test database has no FTS5 table.')
+        searchIndex = search.SqliteSearchIndex()
+    else:
+        searchIndex = search.InvertedIndex()
+    monkeypatch.setattr(project, 'searchIndex', searchIndex)
+
+    return searchIndex
+
+
+def find(client, query):
+    """Returns the total & the names of the first page of matches."""
+    document = client.get('/search.json', query_string={'q': query}).json
+
+    return document['total'], [m['name'] for m in document['menu_items']]
+
+
+def test_name_matches_rank_first(owner, index):
+    addMenuItem(owner, 'cricket', 'Plain Pads', 'plain_pads',
+                'Pads for zanzibar & zanzibar again')
+    addMenuItem(owner, 'cricket', 'Zanzibar Pads', 'zanzibar_pads', 'Pads')
+    try:
+        assert find(owner, 'zanzibar') == (2, ['Zanzibar Pads', 'Plain Pads'])
+        assert find(owner, 'zanzibar plain') == (1, ['Plain Pads'])
+        assert find(owner, 'zanzibar missing') == (0, [])
+    finally:
+        deleteMenuItem(owner, 'cricket', 'plain_pads')
+        deleteMenuItem(owner, 'cricket', 'zanzibar_pads')
+
+
+def test_edits_and_deletes_are_reflected(owner, index):
+    addMenuItem(owner, 'cricket', 'Quokka Bat', 'quokka_bat')
+    assert find(owner, 'quokka') == (1, ['Quokka Bat'])
+
+    editMenuItem(owner, 'cricket', 'quokka_bat', 'Wombat Bat', 'quokka_bat')
+    assert find(owner, 'quokka') == (0, [])
+    assert find(owner, 'wombat') == (1, ['Wombat Bat'])
+
+    deleteMenuItem(owner, 'cricket', 'quokka_bat')
+    assert find(owner, 'wombat') == (0, [])
+
+
+def test_failed_edit_leaves_the_index_unchanged(owner, index):
+    addMenuItem(owner, 'cricket', 'Numbat Pad', 'numbat_pad')
+    try:
+        assert find(owner, 'numbat') == (1, ['Numbat Pad'])
+        with pytest.raises(IntegrityError):
+            editMenuItem(
+                owner, 'cricket', 'numbat_pad', 'Bilby Pad', 'cricket_ball'
+            )
+
+        assert find(owner, 'bilby') == (0, [])
+        assert find(owner, 'numbat') == (1, ['Numbat Pad'])
+    finally:
+        deleteMenuItem(owner, 'cricket', 'numbat_pad')
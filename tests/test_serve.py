@@ -0,0 +1,38 @@
+import config
+import os
+import pytest
+import serve
+
+
+@pytest.fixture
+def master(monkeypatch):
+    monkeypatch.setattr(config, 'APP_HOST', '127.0.0.1')
+    monkeypatch.setattr(config, 'APP_PORT', 0)
+    master = serve.Master(1, preload=False)
+
+    yield master
+
+    master.listener.close()
+
+
+def runWorker(master):
+    """Forks a worker of `master` & returns its exit status."""
+    pid, readyPipe = master.spawn()
+    os.close(readyPipe)
+
+    return os.WEXITSTATUS(os.waitpid(pid, 0)[1])
+
+
+def test_stopped_worker_exits_cleanly(master, monkeypatch):
+    monkeypatch.setattr(serve, 'runWorker', lambda *args: None)
+
+    assert runWorker(master) == 0
+
+
+def test_crashed_worker_exits_with_an_error(master, monkeypatch):
+    def crash(listener, readyPipe, application):
+        raise RuntimeError('The app failed to load.')
+
+    monkeypatch.setattr(serve, 'runWorker', crash)
+
+    assert runWorker(master) == 1
@@ -0,0 +1,51 @@
+import config
+import project
+import sessions
+
+
+def getSessionId(client, app):
+    cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+
+    return project.sessionInterface.get_signer(app).unsign(
+        cookie.value
+    ).decode('utf-8')
+
+
+def test_unknown_session_id_is_replaced(client, app):
+    planted = 'A' * 43
+    client.set_cookie(
+        app.config['SESSION_COOKIE_NAME'],
+        project.sessionInterface.get_signer(app).sign(planted).decode('utf-8')
+    )
+
+    client.get('/login')
+
+    sessionId = getSessionId(client, app)
+    assert sessionId != planted
+    assert project.sessionInterface.store.load(planted) is None
+    assert 'state' in project.sessionInterface.store.load(sessionId)
+
+
+def test_unsigned_session_id_is_replaced(client, app):
+    client.set_cookie(app.config['SESSION_COOKIE_NAME'], 'B' * 43)
+
+    client.get('/login')
+
+    assert getSessionId(client, app) != 'B' * 43
+
+
+def test_server_side_sessions_send_smaller_cookies():
+    rows = {
+        (name, kind): (cookie, setCookie)
+        for name, kind, elapsed, cookie, setCookie in sessions.benchmark([
+            ('cookie', None),
+            ('sql', sessions.ServerSideSessionInterface(
+                sessions.SqlSessionStore(config.engine)
+            ))
+        ], requests=10)
+    }
+
+    assert rows[('sql', 'read')][0] < rows[('cookie', 'read')][0]
+    # Only cookie sessions are sent back when modified
+    assert rows[('cookie', 'write')][1] > 0
+    assert rows[('sql', 'write')][1] == 0